@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_comfyui import make_png
+
+# =========================
+# comfy_mv_api / hy3d_api 부하·지연 벤치마크
+# =========================
+# /generate, /generate_mv_adapter, /generate_hy3d 요청을 지정한 비율로 섞어 동시에 보내고
+# 엔드포인트별 p50/p95/p99 지연, 처리량, 오류 수와 서버 프로세스의 CPU/메모리 사용량을 보고한다.
+#
+# --spawn: 가짜 ComfyUI(bench/fake_comfyui.py) 두 대와 두 API 서버를 임시 작업 디렉토리에 띄워 GPU 없이 측정
+#   python bench/bench_load.py --spawn --concurrency 8 --requests 200
+#   python bench/bench_load.py --spawn --times text2img=1,mv_adapter=2,hy3d=5 --fake-args "--model-load 2" --rate 2 --duration 60
+# 이미 떠 있는 서버를 측정할 때는 주소와 (CPU/메모리를 볼) 서버 PID 를 넘긴다
+#   python bench/bench_load.py --mv-server http://localhost:8001 --hy3d-server http://localhost:8002 --pid 1234 --pid 5678
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("generate", "mv_adapter", "hy3d")
+SAMPLE_INTERVAL = 0.5  # CPU/메모리 샘플링 간격(초)
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in filter(None, value.split(",")):
+        name, weight = item.split("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"알 수 없는 엔드포인트: {name} (가능: {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest-rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+# ---------------------------
+# 서버 띄우기 (--spawn)
+# ---------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Spawned:
+    def __init__(self, args):
+        self.workdir = tempfile.mkdtemp(prefix="bench_load_")
+        for path in ("output/3D", "tmp", "cache"):
+            os.makedirs(os.path.join(self.workdir, path), exist_ok=True)
+        self.processes = []
+        self.logs = []
+        fake_mv, fake_hy3d = free_port(), free_port()
+        mv_port, hy3d_port = free_port(), free_port()
+        self.mv_server = f"http://127.0.0.1:{mv_port}"
+        self.hy3d_server = f"http://127.0.0.1:{hy3d_port}"
+        self.fakes = [f"http://127.0.0.1:{fake_mv}", f"http://127.0.0.1:{fake_hy3d}"]
+
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+            "COMFY_BACKENDS_TEXT2IMG": f"127.0.0.1:{fake_mv}",
+            "COMFY_BACKENDS_MV_ADAPTER": f"127.0.0.1:{fake_mv}",
+            "COMFY_BACKENDS_HY3D": f"127.0.0.1:{fake_hy3d}",
+            "MVADAPTER_SERVER": self.mv_server,
+            "HY3D_SERVER": self.hy3d_server,
+        })
+        fake_args = ["--times", args.times] + args.fake_args.split()
+        for port in (fake_mv, fake_hy3d):
+            self._start("fake_comfyui", [sys.executable, os.path.join(REPO_ROOT, "bench", "fake_comfyui.py"), "--port", str(port)] + fake_args, env)
+        self.mv_pid = self._start("comfy_mv_api", [sys.executable, "-m", "uvicorn", "comfy_mv_api:app", "--port", str(mv_port), "--log-level", "warning"], env)
+        self.hy3d_pid = self._start("hy3d_api", [sys.executable, "-m", "uvicorn", "hy3d_api:app", "--port", str(hy3d_port), "--log-level", "warning"], env)
+
+    def _start(self, name: str, command: list, env: dict) -> int:
+        log = open(os.path.join(self.workdir, f"{name}_{len(self.processes)}.log"), "w")
+        process = subprocess.Popen(command, cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        self.logs.append(log)
+        return process.pid
+
+    async def wait_ready(self, session: aiohttp.ClientSession, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        for url in [f"{self.mv_server}/metrics", f"{self.hy3d_server}/metrics"] + [f"{fake}/queue" for fake in self.fakes]:
+            while True:
+                try:
+                    async with session.get(url) as resp:
+                        if resp.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"서버가 뜨지 않았습니다: {url} (로그: {self.workdir})")
+                await asyncio.sleep(0.2)
+
+    def stop(self, keep: bool = False):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self.logs:
+            log.close()
+        if keep:
+            print(f"작업 디렉토리: {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# ---------------------------
+# CPU / 메모리 샘플링 (/proc)
+# ---------------------------
+
+class ProcessSampler:
+    def __init__(self, pids: dict):
+        self.pids = pids  # 이름 -> pid
+        self.samples = {name: [] for name in pids}  # 이름 -> [(시각, cpu 초, rss 바이트)]
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _read(self, pid: int):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        # utime, stime 는 ")" 뒤 12, 13 번째 필드
+        return (int(fields[11]) + int(fields[12])) / self.tick, rss_pages * self.page
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            for name, pid in self.pids.items():
+                sample = self._read(pid)
+                if sample is not None:
+                    self.samples[name].append((now,) + sample)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def report(self) -> dict:
+        result = {}
+        for name, samples in self.samples.items():
+            if len(samples) < 2:
+                result[name] = None
+                continue
+            (t0, cpu0, _), (t1, cpu1, _) = samples[0], samples[-1]
+            rss = [sample[2] for sample in samples]
+            result[name] = {
+                "cpu_percent": round((cpu1 - cpu0) / (t1 - t0) * 100, 1) if t1 > t0 else 0.0,
+                "rss_mb_avg": round(sum(rss) / len(rss) / 2**20, 1),
+                "rss_mb_peak": round(max(rss) / 2**20, 1),
+            }
+        return result
+
+
+# ---------------------------
+# 요청
+# ---------------------------
+
+class LoadDriver:
+    def __init__(self, args, mv_server: str, hy3d_server: str):
+        self.args = args
+        self.mv_server = mv_server.rstrip("/")
+        self.hy3d_server = hy3d_server.rstrip("/")
+        self.mix = parse_mix(args.mix)
+        self.random = random.Random(args.seed)
+        self.results = []  # (엔드포인트, 성공 여부, 지연 초, 상태 코드)
+        self.reference = None
+        self.sequence = 0
+
+    def _next_index(self) -> int:
+        self.sequence += 1
+        return self.sequence if self.args.unique else 0
+
+    def pick(self) -> str:
+        names = list(self.mix)
+        return self.random.choices(names, weights=[self.mix[name] for name in names])[0]
+
+    async def prepare(self, session: aiohttp.ClientSession):
+        # mv_adapter 요청에 쓸 참조 이미지를 한 장 만들어 둔다
+        if "mv_adapter" in self.mix:
+            async with session.post(f"{self.mv_server}/generate", json={"user_prompt": "bench reference", "user_negative": ""}) as resp:
+                body = await resp.json()
+            self.reference = body.get("filename")
+            if not self.reference:
+                raise SystemExit(f"참조 이미지 생성 실패: {body}")
+
+    async def request(self, session: aiohttp.ClientSession, name: str):
+        index = self._next_index()
+        started = time.perf_counter()
+        status = 0
+        try:
+            if name == "generate":
+                payload = {"user_prompt": f"bench prompt {index}", "user_negative": "", "tier": self.args.tier}
+                async with session.post(f"{self.mv_server}/generate", json=payload) as resp:
+                    status = resp.status
+                    body = await resp.json()
+                ok = status == 200 and body.get("status") == "completed"
+            elif name == "mv_adapter":
+                payload = {"reference_filename": self.reference, "user_prompt": f"bench prompt {index}", "tier": self.args.tier}
+                async with session.post(f"{self.mv_server}/generate_mv_adapter", json=payload) as resp:
+                    status = resp.status
+                    body = await resp.json()
+                ok = status == 200 and body.get("status") == "completed"
+            else:
+                form = aiohttp.FormData()
+                for offset, view in enumerate(("front", "back", "left")):
+                    # 색을 요청마다 바꿔 결과 캐시를 피한다 (--no-unique 면 같은 뷰 → 캐시 적중)
+                    color = ((index * 3 + offset) % 256, (index // 256) % 256, offset * 80)
+                    form.add_field(view, make_png(self.args.upload_size, color, self.args.upload_alpha), filename=f"{view}.png", content_type="image/png")
+                if self.args.tier:
+                    form.add_field("tier", self.args.tier)
+                async with session.post(f"{self.hy3d_server}/generate_hy3d", data=form) as resp:
+                    status = resp.status
+                    await resp.read()
+                ok = status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            ok = False
+        self.results.append((name, ok, time.perf_counter() - started, status))
+
+    async def closed_loop(self, session: aiohttp.ClientSession, deadline: float):
+        # 동시 사용자 N 명이 응답을 받자마자 다음 요청을 보낸다
+        remaining = [self.args.requests]
+
+        async def user():
+            while time.monotonic() < deadline and (self.args.duration or remaining[0] > 0):
+                remaining[0] -= 1
+                await self.request(session, self.pick())
+
+        await asyncio.gather(*(user() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, session: aiohttp.ClientSession, deadline: float):
+        # 응답과 무관하게 초당 rate 개 요청이 포아송 도착 (대기열이 쌓일 때의 지연 측정)
+        tasks = []
+        sent = 0
+        while time.monotonic() < deadline and (self.args.duration or sent < self.args.requests):
+            tasks.append(asyncio.create_task(self.request(session, self.pick())))
+            sent += 1
+            await asyncio.sleep(self.random.expovariate(self.args.rate))
+        await asyncio.gather(*tasks)
+
+    def report(self, elapsed: float) -> dict:
+        summary = {}
+        for name in list(self.mix) + ["total"]:
+            rows = [row for row in self.results if name == "total" or row[0] == name]
+            latencies = [row[2] for row in rows if row[1]]
+            summary[name] = {
+                "requests": len(rows),
+                "errors": sum(1 for row in rows if not row[1]),
+                "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3),
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            }
+        return summary
+
+
+def print_report(report: dict):
+    print(f"\n{'endpoint':<12} {'req':>6} {'err':>5} {'rps':>8} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8} {'mean(s)':>8}")
+    for name, row in report["latency"].items():
+        print(f"{name:<12} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>8.2f} "
+              f"{row['p50']:>8.3f} {row['p95']:>8.3f} {row['p99']:>8.3f} {row['mean']:>8.3f}")
+    print(f"\n{'process':<14} {'cpu%':>7} {'rss avg(MB)':>12} {'rss peak(MB)':>13}")
+    for name, row in report["processes"].items():
+        if row is None:
+            print(f"{name:<14} {'-':>7} {'-':>12} {'-':>13}")
+        else:
+            print(f"{name:<14} {row['cpu_percent']:>7.1f} {row['rss_mb_avg']:>12.1f} {row['rss_mb_peak']:>13.1f}")
+    for name, stats in report.get("fake_comfyui", {}).items():
+        print(f"{name}: {stats}")
+    print(f"\nelapsed {report['elapsed']:.1f}s")
+
+
+async def main(args):
+    spawned = Spawned(args) if args.spawn else None
+    mv_server = spawned.mv_server if spawned else args.mv_server
+    hy3d_server = spawned.hy3d_server if spawned else args.hy3d_server
+    pids = {"comfy_mv_api": spawned.mv_pid, "hy3d_api": spawned.hy3d_pid} if spawned else {f"pid {pid}": pid for pid in args.pid}
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            if spawned:
+                await spawned.wait_ready(session)
+            driver = LoadDriver(args, mv_server, hy3d_server)
+            await driver.prepare(session)
+
+            sampler = ProcessSampler(pids)
+            sampling = asyncio.create_task(sampler.run())
+            started = time.monotonic()
+            deadline = started + args.duration if args.duration else float("inf")
+            if args.rate:
+                await driver.open_loop(session, deadline)
+            else:
+                await driver.closed_loop(session, deadline)
+            elapsed = time.monotonic() - started
+            sampling.cancel()
+
+            report = {
+                "config": {key: value for key, value in vars(args).items() if key != "pid"},
+                "elapsed": round(elapsed, 3),
+                "latency": driver.report(elapsed),
+                "processes": sampler.report(),
+            }
+            if spawned:
+                report["fake_comfyui"] = {}
+                for name, fake in zip(("fake_mv", "fake_hy3d"), spawned.fakes):
+                    async with session.get(f"{fake}/fake/stats") as resp:
+                        report["fake_comfyui"][name] = await resp.json()
+    finally:
+        if spawned:
+            spawned.stop(keep=args.keep)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="comfy_mv_api / hy3d_api 부하 벤치마크")
+    parser.add_argument("--spawn", action="store_true", help="가짜 ComfyUI 와 두 API 서버를 직접 띄워서 측정")
+    parser.add_argument("--mv-server", default=os.getenv("MVADAPTER_SERVER", "http://localhost:8001"))
+    parser.add_argument("--hy3d-server", default=os.getenv("HY3D_SERVER", "http://localhost:8002"))
+    parser.add_argument("--pid", type=int, action="append", default=[], help="CPU/메모리를 측정할 서버 PID (여러 번 지정 가능)")
+    parser.add_argument("--mix", default="generate=4,mv_adapter=3,hy3d=1", help="엔드포인트별 요청 비율")
+    parser.add_argument("--concurrency", type=int, default=8, help="동시 사용자 수 (closed loop)")
+    parser.add_argument("--rate", type=float, default=0.0, help="초당 요청 수 (open loop, 지정 시 --concurrency 무시)")
+    parser.add_argument("--requests", type=int, default=100, help="보낼 요청 수 (--duration 이 없을 때)")
+    parser.add_argument("--duration", type=float, default=0.0, help="측정 시간(초)")
+    parser.add_argument("--timeout", type=float, default=900, help="요청 하나의 최대 시간(초)")
+    parser.add_argument("--tier", default=None, help="요청에 넣을 품질 티어")
+    parser.add_argument("--no-unique", dest="unique", action="store_false", help="같은 프롬프트/뷰를 반복 (결과 캐시 적중 측정)")
+    parser.add_argument("--upload-size", type=int, default=256, help="hy3d 업로드 PNG 한 변 크기(px)")
+    parser.add_argument("--upload-alpha", action="store_true", help="hy3d 업로드 PNG 를 배경이 투명한 RGBA 로 (hy3d_alpha 변형 측정)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--times", default="text2img=0.5,mv_adapter=1,hy3d=2", help="--spawn 가짜 ComfyUI 워크플로우별 실행 시간(초)")
+    parser.add_argument("--fake-args", default="", help="--spawn 가짜 ComfyUI 에 넘길 추가 인자 (예: \"--model-load 2 --fail-rate 0.05\")")
+    parser.add_argument("--keep", action="store_true", help="--spawn 작업 디렉토리(서버 로그, 생성물)를 지우지 않음")
+    parser.add_argument("--json", default=None, help="결과를 JSON 파일로 저장 (변경 전/후 비교용)")
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser().parse_args()))
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.workflows import get_registry
+
+# =========================
+# 워크플로우 생성 + 직렬화 마이크로벤치마크
+# =========================
+# before: 예전 방식처럼 요청마다 그래프 dict 리터럴을 새로 만들고 전체를 json.dumps
+#         (템플릿 그래프를 파이썬 리터럴 소스로 바꿔 컴파일한 함수로 재현)
+# after : 레지스트리 템플릿의 슬롯만 패치한 사전 직렬화 결과 사용
+#
+# 실행: python bench/bench_workflows.py [반복 횟수]
+
+SAMPLE_VALUES = {
+    "text2img": {"user_prompt": "a single pepper, vibrant red hot chili pepper", "user_negative": "shadow"},
+    "mv_adapter": {"reference_image": "ComfyUI_00001_.png", "user_prompt": "a single pepper"},
+    "hy3d": {"front_image": "tmp/front.png", "back_image": "tmp/back.png", "left_image": "tmp/left.png"},
+}
+
+
+def make_literal_builder(template):
+    # 슬롯 위치를 인자로 받는 dict 리터럴 함수 (예전 generate_* 함수와 같은 형태)
+    graph = template.render_graph(**SAMPLE_VALUES[template.name])
+    source = "def build(values):\n    return " + repr(graph) + "\n"
+    namespace = {}
+    exec(compile(source, f"<legacy {template.name}>", "exec"), namespace)
+    return namespace["build"]
+
+
+def bench(number: int):
+    registry = get_registry()
+    print(f"{'workflow':<12} {'nodes':>5} {'before(us)':>11} {'after(us)':>10} {'speedup':>8}")
+    for name, values in SAMPLE_VALUES.items():
+        template = registry.get(name)
+        build = make_literal_builder(template)
+
+        def before():
+            json.dumps({"prompt": build(values)})
+
+        def after():
+            template.render(**values).serialized
+
+        before_us = min(timeit.repeat(before, number=number, repeat=5)) / number * 1e6
+        after_us = min(timeit.repeat(after, number=number, repeat=5)) / number * 1e6
+        print(f"{name:<12} {len(template.graph):>5} {before_us:>11.1f} {after_us:>10.1f} {before_us / after_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+import uuid
+import zlib
+
+from aiohttp import web
+
+# =========================
+# 가짜 ComfyUI 서버 (GPU 없이 부하/지연 측정용)
+# =========================
+# /prompt, /history, /queue, /interrupt, /view, /upload/image, /ws 를 실제 ComfyUI 와 같은 형태로 흉내 낸다.
+# - 워크플로우 종류(text2img / mv_adapter / hy3d)는 그래프의 노드 종류로 판별하고, 종류별 실행 시간을 설정할 수 있다
+# - 대기열: FIFO, 동시 실행 슬롯 수(--slots, 실제 ComfyUI 는 1)와 슬롯에 올라간 모델이 바뀔 때의 로드 시간(--model-load)
+# - 실행 중에는 노드 순서대로 executing/executed 웹소켓 이벤트를 보내므로 노드별 시간, 중간 출력(raw 메시)도 재현된다
+# - 샘플러 노드는 스텝마다 progress 이벤트와 (KSampler, MV 샘플러) 바이너리 미리보기 프레임을 보낸다
+# - 장애 주입: 제출 실패(--submit-fail-rate), 실행 오류(--fail-rate), 완료 이벤트 누락(--drop-ws-rate)
+#
+# 실행: python bench/fake_comfyui.py --port 8190 --times text2img=3,mv_adapter=8,hy3d=40
+
+DEFAULT_TIMES = {"text2img": 3.0, "mv_adapter": 8.0, "hy3d": 40.0}
+
+# 스텝 progress 를 보내는 노드와 그중 미리보기 프레임도 보내는 노드
+SAMPLER_TYPES = {"KSampler", "DiffusersMVSampler", "Hy3DGenerateMeshMultiView", "Hy3DSampleMultiView", "Hy3DDelightImage"}
+PREVIEW_TYPES = {"KSampler", "DiffusersMVSampler"}
+# 배경 제거(세그멘테이션) 노드: --bg-removal 만큼 추가로 걸린다 (입력 알파 재사용 변형의 절감 확인용)
+BG_REMOVAL_TYPES = {"Image Remove Background (rembg)", "BiRefNet", "ImageRemoveBackground+"}
+
+
+def parse_times(value: str) -> dict:
+    times = dict(DEFAULT_TIMES)
+    for item in filter(None, (value or "").split(",")):
+        name, seconds = item.split("=")
+        times[name.strip()] = float(seconds)
+    return times
+
+
+# ---------------------------
+# 더미 출력 파일
+# ---------------------------
+
+def make_png(size: int, color: tuple = (200, 80, 60), alpha: bool = False) -> bytes:
+    # 단색 RGB PNG (zlib 만으로 생성)
+    # alpha=True 면 RGBA 로 가장자리 1/4 은 투명, 가운데만 불투명 (배경이 지워진 물체 이미지 흉내)
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    if alpha:
+        low, high = size // 4, size - size // 4
+        rows = []
+        for y in range(size):
+            rows.append(b"\x00" + b"".join(
+                bytes(color) + (b"\xff" if low <= x < high and low <= y < high else b"\x00") for x in range(size)
+            ))
+        raw = b"".join(rows)
+    else:
+        raw = b"".join(b"\x00" + bytes(color) * size for _ in range(size))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 6 if alpha else 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_glb() -> bytes:
+    # 삼각형 하나짜리 최소 glTF 바이너리
+    positions = struct.pack("<9f", 0, 0, 0, 1, 0, 0, 0, 1, 0)
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}}]}],
+        "buffers": [{"byteLength": len(positions)}],
+        "bufferViews": [{"buffer": 0, "byteOffset": 0, "byteLength": len(positions)}],
+        "accessors": [{"bufferView": 0, "componentType": 5126, "count": 3, "type": "VEC3",
+                       "min": [0, 0, 0], "max": [1, 1, 0]}],
+    }
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode()
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    bin_chunk = positions + b"\x00" * (-len(positions) % 4)
+    body = (
+        struct.pack("<II", len(json_chunk), 0x4E4F534A) + json_chunk
+        + struct.pack("<II", len(bin_chunk), 0x004E4942) + bin_chunk
+    )
+    return struct.pack("<III", 0x46546C67, 2, 12 + len(body)) + body
+
+
+# ---------------------------
+# 그래프 해석
+# ---------------------------
+
+def workflow_kind(graph: dict) -> str:
+    class_types = {node.get("class_type", "") for node in graph.values()}
+    if any(class_type.startswith("Hy3D") for class_type in class_types):
+        return "hy3d"
+    if "DiffusersMVSampler" in class_types:
+        return "mv_adapter"
+    return "text2img"
+
+
+def _links(node: dict):
+    for value in node.get("inputs", {}).values():
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+            yield value[0]
+
+
+def execution_order(graph: dict) -> list:
+    # 의존 노드가 먼저 오도록 위상 정렬 (ComfyUI 실행 순서와 같은 성질)
+    order, seen = [], set()
+
+    def visit(node_id):
+        if node_id in seen or node_id not in graph:
+            return
+        seen.add(node_id)
+        for upstream in _links(graph[node_id]):
+            visit(upstream)
+        order.append(node_id)
+
+    for node_id in sorted(graph, key=lambda key: (len(key), key)):
+        visit(node_id)
+    return order
+
+
+def _find_upstream(graph: dict, node_id: str, class_type: str):
+    stack, seen = [node_id], set()
+    while stack:
+        current = stack.pop()
+        if current in seen or current not in graph:
+            continue
+        seen.add(current)
+        if graph[current].get("class_type") == class_type:
+            return graph[current]
+        stack.extend(_links(graph[current]))
+    return None
+
+
+def image_count(graph: dict, node_id: str) -> int:
+    latent = _find_upstream(graph, node_id, "EmptyLatentImage")
+    if latent is not None:
+        return int(latent["inputs"].get("batch_size", 1))
+    selector = _find_upstream(graph, node_id, "ViewSelector")
+    if selector is not None:
+        return max(1, sum(1 for value in selector["inputs"].values() if value is True))
+    return 1
+
+
+def batch_size(graph: dict) -> int:
+    return sum(
+        int(node["inputs"].get("batch_size", 1))
+        for node in graph.values() if node.get("class_type") == "EmptyLatentImage"
+    ) or 1
+
+
+# ---------------------------
+# 서버
+# ---------------------------
+
+class FakeComfy:
+    def __init__(self, args):
+        self.times = parse_times(args.times)
+        self.jitter = args.jitter
+        self.slots = args.slots
+        self.model_load = args.model_load
+        self.batch_cost = args.batch_cost
+        self.fail_rate = args.fail_rate
+        self.submit_fail_rate = args.submit_fail_rate
+        self.drop_ws_rate = args.drop_ws_rate
+        self.steps = args.steps
+        self.preview_size = args.preview_size
+        self.bg_removal = args.bg_removal
+        self.png = make_png(args.image_size, alpha=args.alpha_output)
+        self.glb = open(args.glb, "rb").read() if args.glb else make_glb()
+        self.sockets = {}      # client_id -> WebSocketResponse
+        self.history = {}      # prompt_id -> history 항목
+        self.pending = []      # [(번호, prompt_id, graph, client_id)]
+        self.running = {}      # prompt_id -> (번호, graph, client_id)
+        self.interrupted = set()
+        self.counter = 0
+        self.file_counter = 0
+        self.loaded = {}       # 슬롯 -> 올라간 워크플로우 종류
+        self.model_switches = 0
+        self._wakeup = None
+
+    # ---------------------------
+    # 실행 루프
+    # ---------------------------
+
+    async def start(self, app):
+        self._wakeup = asyncio.Condition()
+        app["workers"] = [asyncio.create_task(self._worker(slot)) for slot in range(self.slots)]
+
+    async def stop(self, app):
+        for worker in app["workers"]:
+            worker.cancel()
+
+    async def _worker(self, slot: int):
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: bool(self.pending))
+                number, prompt_id, graph, client_id = self.pending.pop(0)
+            self.running[prompt_id] = (number, graph, client_id)
+            try:
+                await self._execute(slot, prompt_id, graph, client_id)
+            finally:
+                self.running.pop(prompt_id, None)
+
+    async def _send(self, client_id: str, message_type: str, data: dict):
+        socket = self.sockets.get(client_id)
+        if socket is not None and not socket.closed:
+            try:
+                await socket.send_str(json.dumps({"type": message_type, "data": data}))
+            except ConnectionError:
+                pass
+
+    async def _send_preview(self, client_id: str, step: int):
+        # 웹소켓 바이너리 프레임: PREVIEW_IMAGE(1) + PNG(2) + 이미지
+        socket = self.sockets.get(client_id)
+        if socket is not None and not socket.closed and self.preview_size:
+            color = (min(255, 40 + step * 20), 80, 160)
+            try:
+                await socket.send_bytes(struct.pack(">II", 1, 2) + make_png(self.preview_size, color))
+            except ConnectionError:
+                pass
+
+    async def _run_node(self, prompt_id: str, node_id: str, node: dict, client_id: str, seconds: float):
+        class_type = node.get("class_type")
+        if class_type in BG_REMOVAL_TYPES:
+            seconds += self.bg_removal
+        if class_type not in SAMPLER_TYPES:
+            await asyncio.sleep(seconds)
+            return
+        steps = node.get("inputs", {}).get("steps")
+        steps = int(steps) if isinstance(steps, (int, float)) and steps > 0 else max(1, self.steps)
+        for step in range(1, steps + 1):
+            if prompt_id in self.interrupted:
+                return
+            await asyncio.sleep(seconds / steps)
+            await self._send(client_id, "progress", {"value": step, "max": steps, "prompt_id": prompt_id, "node": node_id})
+            if class_type in PREVIEW_TYPES:
+                await self._send_preview(client_id, step)
+
+    def _duration(self, kind: str, graph: dict) -> float:
+        seconds = self.times.get(kind, 1.0)
+        if kind == "text2img":
+            seconds *= 1 + self.batch_cost * (batch_size(graph) - 1)
+        return max(0.0, seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _node_output(self, graph: dict, node_id: str):
+        node = graph[node_id]
+        class_type = node.get("class_type")
+        if class_type == "SaveImage":
+            prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+            images = []
+            for _ in range(image_count(graph, node_id)):
+                self.file_counter += 1
+                images.append({"filename": f"{prefix}_{self.file_counter:05}_.png", "subfolder": "", "type": "output"})
+            return {"images": images}
+        if class_type in ("PreviewImage", "MaskPreview+"):
+            self.file_counter += 1
+            return {"images": [{"filename": f"ComfyUI_temp_{self.file_counter:05}_.png", "subfolder": "", "type": "temp"}]}
+        if class_type == "Preview3D":
+            exporter = _find_upstream(graph, node_id, "Hy3DExportMesh")
+            prefix = exporter["inputs"].get("filename_prefix", "3D/Hy3D") if exporter else "3D/Hy3D"
+            self.file_counter += 1
+            return {"result": [f"{prefix}_{self.file_counter:05}_.glb".replace("/", "\\"), None]}
+        return None
+
+    async def _execute(self, slot: int, prompt_id: str, graph: dict, client_id: str):
+        kind = workflow_kind(graph)
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        if self.loaded.get(slot) != kind:
+            if slot in self.loaded:
+                self.model_switches += 1
+            self.loaded[slot] = kind
+            await asyncio.sleep(self.model_load)
+
+        order = execution_order(graph)
+        per_node = self._duration(kind, graph) / max(1, len(order))
+        fail_at = random.randrange(len(order)) if random.random() < self.fail_rate else None
+        outputs, status = {}, "success"
+        for index, node_id in enumerate(order):
+            if prompt_id in self.interrupted:
+                status = "interrupted"
+                break
+            await self._send(client_id, "executing", {"node": node_id, "display_node": node_id, "prompt_id": prompt_id})
+            await self._run_node(prompt_id, node_id, graph[node_id], client_id, per_node)
+            if index == fail_at:
+                status = "error"
+                await self._send(client_id, "execution_error", {
+                    "prompt_id": prompt_id, "node_id": node_id, "node_type": graph[node_id].get("class_type"),
+                    "exception_message": "injected failure",
+                })
+                break
+            output = self._node_output(graph, node_id)
+            if output is not None:
+                outputs[node_id] = output
+                await self._send(client_id, "executed", {"node": node_id, "display_node": node_id, "output": output, "prompt_id": prompt_id})
+
+        self.history[prompt_id] = {
+            "prompt": [self.counter, prompt_id, graph, {}, list(outputs)],
+            "outputs": outputs,
+            "status": {"status_str": status, "completed": status == "success", "messages": []},
+        }
+        self.interrupted.discard(prompt_id)
+        if random.random() < self.drop_ws_rate:
+            return  # 완료 이벤트 누락 → 클라이언트는 history 확인으로 복구해야 한다
+        if status == "success":
+            await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+            await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+        elif status == "interrupted":
+            await self._send(client_id, "execution_interrupted", {"prompt_id": prompt_id})
+
+    # ---------------------------
+    # HTTP / 웹소켓
+    # ---------------------------
+
+    async def ws(self, request):
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        socket = web.WebSocketResponse(heartbeat=30)
+        await socket.prepare(request)
+        self.sockets[client_id] = socket
+        await socket.send_str(json.dumps({"type": "status", "data": {"status": self._status(), "sid": client_id}}))
+        try:
+            async for _ in socket:
+                pass
+        finally:
+            if self.sockets.get(client_id) is socket:
+                del self.sockets[client_id]
+        return socket
+
+    def _status(self) -> dict:
+        return {"exec_info": {"queue_remaining": len(self.pending) + len(self.running)}}
+
+    async def prompt(self, request):
+        body = await request.json()
+        if random.random() < self.submit_fail_rate:
+            return web.json_response({"error": "injected submit failure"}, status=500)
+        graph = body["prompt"]
+        self.counter += 1
+        prompt_id = uuid.uuid4().hex
+        async with self._wakeup:
+            self.pending.append((self.counter, prompt_id, graph, body.get("client_id")))
+            self._wakeup.notify()
+        return web.json_response({"prompt_id": prompt_id, "number": self.counter, "node_errors": {}})
+
+    async def get_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry is not None else {})
+
+    async def get_queue(self, request):
+        return web.json_response({
+            "queue_running": [[number, prompt_id, {}, {}, []] for prompt_id, (number, _, _) in self.running.items()],
+            "queue_pending": [[number, prompt_id, {}, {}, []] for number, prompt_id, _, _ in self.pending],
+        })
+
+    async def post_queue(self, request):
+        body = await request.json()
+        if body.get("clear"):
+            self.pending.clear()
+        for prompt_id in body.get("delete", []):
+            self.pending = [item for item in self.pending if item[1] != prompt_id]
+        return web.json_response({})
+
+    async def interrupt(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        targets = [body["prompt_id"]] if body.get("prompt_id") else list(self.running)
+        self.interrupted.update(prompt_id for prompt_id in targets if prompt_id in self.running)
+        return web.json_response({})
+
+    async def view(self, request):
+        filename = request.query.get("filename", "")
+        if filename.endswith(".glb"):
+            return web.Response(body=self.glb, content_type="model/gltf-binary")
+        return web.Response(body=self.png, content_type="image/png")
+
+    async def upload_image(self, request):
+        reader = await request.multipart()
+        name, subfolder = None, ""
+        while (part := await reader.next()) is not None:
+            if part.name == "image":
+                name = part.filename
+                while await part.read_chunk():
+                    pass
+            elif part.name == "subfolder":
+                subfolder = await part.text()
+        return web.json_response({"name": name, "subfolder": subfolder, "type": "input"})
+
+    async def stats(self, request):
+        # 벤치마크 리포트용 (실제 ComfyUI 에는 없는 경로)
+        return web.json_response({
+            "prompts": self.counter,
+            "pending": len(self.pending),
+            "running": len(self.running),
+            "model_switches": self.model_switches,
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        app.router.add_get("/ws", self.ws)
+        app.router.add_post("/prompt", self.prompt)
+        app.router.add_get("/history/{prompt_id}", self.get_history)
+        app.router.add_get("/queue", self.get_queue)
+        app.router.add_post("/queue", self.post_queue)
+        app.router.add_post("/interrupt", self.interrupt)
+        app.router.add_get("/view", self.view)
+        app.router.add_post("/upload/image", self.upload_image)
+        app.router.add_get("/fake/stats", self.stats)
+        return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="가짜 ComfyUI 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--times", default="", help="워크플로우별 실행 시간(초), 예: text2img=3,mv_adapter=8,hy3d=40")
+    parser.add_argument("--jitter", type=float, default=0.1, help="실행 시간 변동 비율 (0.1 = ±10%%)")
+    parser.add_argument("--slots", type=int, default=1, help="동시 실행 슬롯 수 (실제 ComfyUI 는 1)")
+    parser.add_argument("--model-load", type=float, default=0.0, help="슬롯의 모델 종류가 바뀔 때 로드 시간(초)")
+    parser.add_argument("--batch-cost", type=float, default=0.5, help="text2img 배치 1장 추가당 실행 시간 증가 비율")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="실행 오류 확률")
+    parser.add_argument("--submit-fail-rate", type=float, default=0.0, help="/prompt 500 응답 확률")
+    parser.add_argument("--drop-ws-rate", type=float, default=0.0, help="완료 웹소켓 이벤트 누락 확률")
+    parser.add_argument("--steps", type=int, default=10, help="샘플러 노드의 스텝 수 (노드 입력에 steps 가 없을 때)")
+    parser.add_argument("--preview-size", type=int, default=128, help="미리보기 프레임 한 변 크기(px), 0 이면 보내지 않음")
+    parser.add_argument("--image-size", type=int, default=64, help="/view 로 돌려줄 PNG 한 변 크기(px)")
+    parser.add_argument("--alpha-output", action="store_true", help="/view 로 배경이 투명한 RGBA PNG 를 돌려줌")
+    parser.add_argument("--bg-removal", type=float, default=0.0, help="배경 제거 노드 하나당 추가 실행 시간(초)")
+    parser.add_argument("--glb", default=None, help="/view 로 돌려줄 GLB 파일 (없으면 삼각형 하나짜리 GLB)")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    web.run_app(FakeComfy(args).app(), host=args.host, port=args.port, print=None)
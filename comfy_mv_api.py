@@ -1,361 +1,611 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-import json
-from urllib import request as urlrequest
-import time
+from typing import List, Optional
+from core.comfy_client import get_client, close_clients, output_images, ComfyUnavailable, ExecutionTimeout
+from core.jobs import JobStore, create_job_router
+from core.cache import FileCache, hash_workflow
+from core.artifacts import ArtifactIndex, KIND_IMAGE, KIND_VIEW
+from core.workflows import get_registry, RenderedWorkflow
+from core.graph import prune_graph, report_workflow
+from core.alpha import reusable_alpha, prepare_reference
+from core.backends import get_pool, close_pools, NoBackendAvailable
+from core.scheduler import get_scheduler, scheduler_stats
+from core.pipeline import StagePipeline
+from core.tracing import TraceMiddleware, span, trace_headers
+from core.metrics import (
+    MetricsMiddleware, create_metrics_router, register_job_gauges, register_backend_gauges,
+    track, count_errors, observe_execution
+)
 
 # 환경 변수 로딩
 from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import shutil
+import hashlib
+import time
+import uuid
+import random
+import aiohttp
+import asyncio
 os.environ["CUDA_VISIBLE_DEVICES"] = os.getenv("CUDA_DEVICE", "0")
 
+output_dir = "output"  # ComfyUI 출력 디렉토리
+
 app = FastAPI()
-app.mount("/images", StaticFiles(directory="output"), name="images")
 
-comfy_ip = "0.0.0.0:8190"  # ComfyUI 서버 주소
+@app.on_event("shutdown")
+async def shutdown_comfy_clients():
+    await pipeline.close()
+    await close_hy3d_session()
+    await close_pools()
+    await close_clients()
+
+app.mount("/images", StaticFiles(directory=output_dir), name="images")
+
+jobs = JobStore()
+app.include_router(create_job_router(jobs))
+
+# GET /metrics (Prometheus 텍스트 형식)
+app.add_middleware(MetricsMiddleware)
+# X-Trace-Id 로 받은 trace 를 이어받아 단계별 span 기록, 응답에 Server-Timing 헤더
+app.add_middleware(TraceMiddleware, service="comfy_mv_api")
+app.include_router(create_metrics_router())
+register_job_gauges(jobs)
+register_backend_gauges()
+
+comfy_ip = "0.0.0.0:8190"  # 기본 ComfyUI 서버 주소 (COMFY_BACKENDS_TEXT2IMG / COMFY_BACKENDS_MV_ADAPTER 로 여러 대 지정)
+
+# 워크플로우별 ComfyUI 백엔드 풀 (제출마다 가장 한가한 정상 인스턴스로 배정)
+text2img_pool = get_pool("text2img", comfy_ip)
+mv_adapter_pool = get_pool("mv_adapter", comfy_ip)
 host_ip = os.getenv("MVADAPTER_SERVER")  # 일반 이미지 생성 및 MV_Adapter 서버 주소
 
+BATCH_MAX_SIZE = int(os.getenv("GENERATE_BATCH_MAX_SIZE", "8"))  # KSampler 한 번에 묶을 최대 latent 수
+BATCH_MAX_PROMPTS = int(os.getenv("GENERATE_BATCH_MAX_PROMPTS", "16"))   # /generate_batch 한 요청의 최대 프롬프트 수
+BATCH_MAX_VARIANTS = int(os.getenv("GENERATE_BATCH_MAX_VARIANTS", "16"))  # 프롬프트당 최대 생성 장수
+BATCH_MAX_IMAGES = int(os.getenv("GENERATE_BATCH_MAX_IMAGES", "32"))     # 한 요청의 최대 총 생성 장수 (프롬프트 수 × variants)
+
+# /generate 결과 캐시 (렌더링된 워크플로우 해시 → 출력 이미지)
+generate_cache = FileCache(
+    os.getenv("GENERATE_CACHE_DIR", os.path.join("cache", "generate")),
+    int(os.getenv("GENERATE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+)
+
+# 워크플로우 템플릿은 시작 시 한 번만 로드
+workflow_registry = get_registry()
+
+# 생성물 인덱스 (클라이언트가 디렉토리 스캔 대신 조회)
+artifacts = ArtifactIndex(os.getenv("ARTIFACT_DB", os.path.join(output_dir, "artifacts.db")))
+
 class PromptInput(BaseModel):
     user_prompt: str
     user_negative: str
+    tier: Optional[str] = None  # draft / standard / final (없으면 기본 티어)
+
+class BatchInput(BaseModel):
+    prompts: List[PromptInput] = []   # 서로 다른 프롬프트 목록
+    user_prompt: Optional[str] = None  # 단일 프롬프트 + variants 로 변형 여러 장 생성
+    user_negative: str = ""
+    variants: int = 1                  # 프롬프트당 생성 장수
+    seed: Optional[int] = None         # 기준 시드 (latent 배치마다 +1, 없으면 요청마다 무작위)
+    tier: Optional[str] = None         # 배치 전체에 적용할 티어
 
 class MVAdapterInput(BaseModel):
     reference_filename: str  # generate()에서 생성된 이미지 파일명
     user_prompt: str
+    tier: Optional[str] = None
 
-# 텍스트 기반 프롬프트 워크플로우 생성
+class PipelineInput(BaseModel):
+    user_prompt: str
+    user_negative: str = ""
+    tier: Optional[str] = None
+    compact: Optional[bool] = None    # Hy3D 서버의 GLB 경량화 여부
+    max_bytes: Optional[int] = None   # GLB 목표 용량
 
-def generate_prompt_text(user_prompt, user_negative: str) -> dict:
-    return {
-        "3": {
-            "inputs": {
-                "seed": 337089376345,
-                "steps": 20,
-                "cfg": 7,
-                "sampler_name": "dpmpp_2m",
-                "scheduler": "karras",
-                "denoise": 1,
-                "model": ["4", 0],
-                "positive": ["6", 0],
-                "negative": ["7", 0],
-                "latent_image": ["5", 0]
-            },
-            "class_type": "KSampler",
-            "_meta": {
-                "title": "KSampler"
-            }
-        },
-        "4": {
-            "inputs": {
-                "ckpt_name": "AnythingXL_xl.safetensors"
-            },
-            "class_type": "CheckpointLoaderSimple",
-            "_meta": {
-                "title": "Load Checkpoint"
-            }
-        },
-        "5": {
-            "inputs": {
-                "width": 1024,
-                "height": 1024,
-                "batch_size": 1
-            },
-            "class_type": "EmptyLatentImage",
-            "_meta": {
-                "title": "Empty Latent Image"
-            }
-        },
-        "6": {
-            "inputs": {
-                "text": f"{user_prompt}, ctv, no humans, stylized, shiny surface, masterpiece, best quality, ultra-detailed, genshin impact style, fantasy style illustration, still life, solo, simple background, cel shading, anime rendering\n",
-                "clip": ["4", 1]
-            },
-            "class_type": "CLIPTextEncode",
-            "_meta": {
-                "title": "CLIP Text Encode (Prompt)"
-            }
-        },
-        "7": {
-            "inputs": {
-                "text": f"{user_negative}, low quality, distorted tip, melted shape, blurry, broken parts, watercolor, extra leaf, human, text, doll, face, jack-o-lantern, carved, halloween, face, glowing from inside, spooky, scary\n",
-                "clip": ["4", 1]
-            },
-            "class_type": "CLIPTextEncode",
-            "_meta": {
-                "title": "CLIP Text Encode (Prompt)"
-            }
-        },
-        "8": {
-            "inputs": {
-                "samples": ["3", 0],
-                "vae": ["4", 2]
-            },
-            "class_type": "VAEDecode",
-            "_meta": {
-                "title": "VAE Decode"
-            }
-        },
-        "12": {
-            "inputs": {
-                "image": ["13", 0]
-            },
-            "class_type": "Image Remove Background (rembg)",
-            "_meta": {
-                "title": "Image Remove Background (rembg)"
-            }
-        },
-        "13": {
-            "inputs": {
-                "image": ["8", 0]
-            },
-            "class_type": "AILab_ImagePreview",
-            "_meta": {
-                "title": "이미지 미리보기 (RMBG)"
-            }
-        },
-        "9": {
-            "inputs": {
-                "filename_prefix": "ComfyUI",
-                "images": ["12", 0]
-            },
-            "class_type": "SaveImage",
-            "_meta": {
-                "title": "Save Image"
+# 참조 이미지 파일명 확인 (output_dir 밖을 가리키는 이름은 400)
+
+def check_reference_filename(filename: str) -> str:
+    if not filename or "/" in filename or "\\" in filename or ".." in filename or os.path.isabs(filename):
+        raise HTTPException(status_code=400, detail=f"잘못된 참조 이미지 파일명: {filename}")
+    return filename
+
+# 티어 이름 확인 (정의되지 않은 티어는 400)
+
+def resolve_tier(tier: Optional[str]) -> str:
+    try:
+        return workflow_registry.resolve_tier(tier)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+
+# 텍스트 기반 프롬프트 워크플로우 생성 (workflows/text2img 템플릿의 슬롯만 패치)
+
+def generate_prompt_text(user_prompt, user_negative: str, tier: str = None, **slots) -> RenderedWorkflow:
+    return workflow_registry.render("text2img", tier=tier, user_prompt=user_prompt, user_negative=user_negative, **slots)
+
+# 배치 텍스트 워크플로우 생성
+# groups: (user_prompt, user_negative, batch_size, seed) 목록
+# 체크포인트 로더(4)는 하나만 두고 공유, 프롬프트별로 CLIP 인코딩/샘플링/저장 체인을 복제한다.
+# 반환: (워크플로우, 그룹별 SaveImage 노드 id 목록)
+
+def generate_batch_workflow(groups: list, tier: str = None):
+    template = workflow_registry.get("text2img")
+    tier_slots = workflow_registry.tier_values("text2img", tier)
+    workflow = {}
+    save_nodes = []
+    for index, (user_prompt, user_negative, batch_size, seed) in enumerate(groups):
+        single = template.render_graph(**tier_slots, user_prompt=user_prompt, user_negative=user_negative, seed=seed, batch_size=batch_size)
+        prefix = f"b{index}_"
+        for node_id, node in single.items():
+            if node_id == "4":
+                workflow.setdefault("4", node)
+                continue
+            # 템플릿 노드는 공유되므로 링크를 바꿀 때는 새 dict 로 만든다
+            inputs = {
+                name: [prefix + value[0], value[1]] if isinstance(value, list) and len(value) == 2 and value[0] != "4" else value
+                for name, value in node["inputs"].items()
             }
-        }
-    }
+            workflow[prefix + node_id] = dict(node, inputs=inputs)
+        save_nodes.append(prefix + "9")
+    workflow, _ = prune_graph(workflow, save_nodes)
+    return workflow, save_nodes
 
-# MVAdapter 워크플로우 정적 정의 및 입력 이미지만 반영
-
-def generate_mv_adapter_workflow(reference_image_filename, user_prompt : str) -> dict:
-    workflow = {
-      "1": {
-        "inputs": {
-          "ckpt_name": "sdXL_v10VAEFix.safetensors",
-          "pipeline_name": "MVAdapterI2MVSDXLPipeline"
-        },
-        "class_type": "LdmPipelineLoader",
-        "_meta": {
-          "title": "LDM Pipeline Loader"
-        }
-      },
-      "2": {
-        "inputs": {
-          "scheduler_name": "DDPM",
-          "shift_snr": True,
-          "shift_mode": "interpolated",
-          "shift_scale": 8,
-          "pipeline": ["1", 0]
-        },
-        "class_type": "DiffusersMVSchedulerLoader",
-        "_meta": {
-          "title": "Diffusers MV Scheduler Loader"
-        }
-      },
-      "3": {
-        "inputs": {
-          "vae_name": "sdxl_vae.safetensors",
-          "upcast_fp32": True
-        },
-        "class_type": "LdmVaeLoader",
-        "_meta": {
-          "title": "LDM Vae Loader"
-        }
-      },
-      "4": {
-        "inputs": {
-          "load_mvadapter": True,
-          "adapter_path": "huanngzh/mv-adapter",
-          "adapter_name": "mvadapter_i2mv_sdxl_beta.safetensors",
-          "num_views": 6,
-          "enable_vae_slicing": True,
-          "enable_vae_tiling": False,
-          "pipeline": ["1", 0],
-          "scheduler": ["2", 0],
-          "autoencoder": ["3", 0]
-        },
-        "class_type": "DiffusersMVModelMakeup",
-        "_meta": {
-          "title": "Diffusers MV Model Makeup"
-        }
-      },
-      "6": {
-        "inputs": {
-          "num_views": 6,
-          "prompt": f"{user_prompt}, high quality",
-          "negative_prompt": "watermark, ugly, deformed, noisy, blurry, low contrast",
-          "width": 1024,
-          "height": 1024,
-          "steps": 50,
-          "cfg": 3,
-          "seed": 21,
-          "controlnet_conditioning_scale": 1,
-          "pipeline": ["4", 0],
-          "reference_image": ["8", 0],
-          "azimuth_degrees": ["13", 0]
-        },
-        "class_type": "DiffusersMVSampler",
-        "_meta": {
-          "title": "Diffusers MV Sampler"
-        }
-      },
-      "7": {
-        "inputs": {
-          "image": f"/home/wanted-1/ComfyUI/output/{reference_image_filename}"
-        },
-        "class_type": "LoadImage",
-        "_meta": {
-          "title": "이미지 로드"
-        }
-      },
-      "8": {
-        "inputs": {
-          "height": 1024,
-          "width": 1024,
-          "remove_bg_fn": ["9", 0],
-          "image": ["7", 0]
-        },
-        "class_type": "ImagePreprocessor",
-        "_meta": {
-          "title": "Image Preprocessor"
-        }
-      },
-      "9": {
-        "inputs": {
-          "ckpt_name": "ZhengPeng7/BiRefNet"
-        },
-        "class_type": "BiRefNet",
-        "_meta": {
-          "title": "BiRefNet"
-        }
-      },
-      "10": {
-        "inputs": {
-          "images": ["8", 0]
-        },
-        "class_type": "PreviewImage",
-        "_meta": {
-          "title": "이미지 미리보기"
-        }
-      },
-      "11": {
-        "inputs": {
-          "images": ["6", 0]
-        },
-        "class_type": "PreviewImage",
-        "_meta": {
-          "title": "이미지 미리보기"
-        }
-      },
-      "12": {
-        "inputs": {
-          "filename_prefix": "ComfyUI",
-          "images": ["6", 0]
-        },
-        "class_type": "SaveImage",
-        "_meta": {
-          "title": "이미지 저장"
-        }
-      },
-      "13": {
-        "inputs": {
-          "front_view": True,
-          "front_right_view": False,
-          "right_view": False,
-          "back_view": True,
-          "left_view": True,
-          "front_left_view": False
-        },
-        "class_type": "ViewSelector",
-        "_meta": {
-          "title": "View Selector"
-        }
-      }
-    }
-    return workflow
+# MVAdapter 워크플로우 생성 (workflows/mv_adapter 템플릿에 입력 이미지/프롬프트만 반영)
+# alpha=True 면 입력 이미지의 알파를 마스크로 쓰는 변형(mv_adapter_alpha)으로 BiRefNet 배경 제거를 건너뛴다
+
+def generate_mv_adapter_workflow(reference_image_filename, user_prompt : str, tier: str = None, alpha: bool = False, **slots) -> RenderedWorkflow:
+    name = "mv_adapter_alpha" if alpha else "mv_adapter"
+    return workflow_registry.render(name, tier=tier, reference_image=reference_image_filename, user_prompt=user_prompt, **slots)
 
 # ComfyUI 서버와 통신
 
-def queue_prompt(prompt_workflow: dict, ip: str) -> str:
-    data = json.dumps({"prompt": prompt_workflow}).encode("utf-8")
-    req = urlrequest.Request(f"http://{ip}/prompt", data=data)
+async def queue_prompt(prompt_workflow, ip: str, pool=None) -> str:
     try:
-        res = urlrequest.urlopen(req)
-        return json.loads(res.read().decode("utf-8"))['prompt_id']
+        return await get_client(ip).queue_prompt(prompt_workflow)
     except Exception as e:
+        if pool is not None and isinstance(e, aiohttp.ClientConnectionError):
+            pool.mark_failed(ip)
         raise HTTPException(status_code=500, detail=str(e))
 
-def check_progress(prompt_id: str, ip: str) -> dict:
-    while True:
+# 웹소켓 완료 이벤트로 즉시 깨어나고, 소켓이 끊긴 경우에만 history 폴링
+# 백엔드가 응답하지 않으면 풀에서 빼고 502, 티어별 최대 대기 시간을 넘기면 prompt 를 취소하고 504
+async def check_progress(prompt_id: str, ip: str, timeout: float = None, pool=None) -> dict:
+    try:
+        return await get_client(ip).wait_for_completion(prompt_id, timeout)
+    except ComfyUnavailable as e:
+        if pool is not None:
+            pool.mark_failed(ip)
+        raise HTTPException(status_code=502, detail=str(e))
+    except ExecutionTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+# 풀에서 고른 백엔드에 모델 그룹(풀 이름: text2img / mv_adapter) 순서를 맞춰 제출 후 완료까지 대기 (job 이 주어지면 prompt_id/백엔드/단계를 기록)
+# 반환: (history, 실행한 백엔드 주소) - 출력 파일은 같은 백엔드에서 받아야 한다
+
+async def run_workflow(prompt_workflow, pool, job=None, tier: str = None) -> tuple:
+    # 지표/trace 의 endpoint 는 템플릿 이름 (기본 템플릿은 풀 이름과 같고, 변형은 mv_adapter_alpha 처럼 따로 집계)
+    endpoint = getattr(getattr(prompt_workflow, "template", None), "name", pool.name)
+    timeout = workflow_registry.timeout(endpoint, tier)
+    # 가끔 가지치기하지 않은 원본으로 실행해 제거 노드의 비용 표본을 모은다 (캐시 키는 이미 계산된 뒤)
+    prompt_workflow = workflow_registry.cost_sample(prompt_workflow)
+    try:
+        ip = pool.acquire()
+    except NoBackendAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    # 같은 백엔드에서 모델이 다른 워크플로우와 번갈아 실행되지 않도록 모델 그룹 단위로 제출
+    scheduler = get_scheduler(ip)
+    try:
+        if job is not None:
+            job.set_stage("waiting_for_model")
+        with span(f"{pool.name}.waiting_for_model", backend=ip):
+            await scheduler.admit(pool.name)
+        try:
+            with track("submit", endpoint, ip):
+                prompt_id = await queue_prompt(prompt_workflow, ip, pool)
+            submitted_at = time.monotonic()
+            if job is not None:
+                job.attach_prompt(prompt_id, ip, prompt_workflow)
+            with count_errors("execution", endpoint, ip):
+                result = await check_progress(prompt_id, ip, timeout, pool)
+            observe_execution(endpoint, ip, submitted_at, get_client(ip).pop_execution_start(prompt_id))
+        finally:
+            scheduler.release(pool.name)
+    finally:
+        pool.release(ip)
+    if job is not None:
+        job.set_stage("collecting_outputs")
+
+    # 가지치기/변형으로 건너뛴 노드와 추정 절감 시간 기록
+    reports = report_workflow(prompt_workflow, get_client(ip).pop_node_durations(prompt_id))
+    if job is not None:
+        job.info.update(reports)
+    return result, ip
+
+# history 에 기록된 출력 이미지를 output_dir 에 확정 (로컬에 없으면 /view 로 받아 저장)
+# 디렉토리 스캔 없이 해당 파일만 다루며, output_dir 기준 상대 경로를 반환
+
+async def materialize_output_image(image: dict, ip: str, new_name: str = None) -> str:
+    subfolder = image.get("subfolder", "")
+    src_rel = os.path.join(subfolder, image["filename"])
+    dst_rel = os.path.join(subfolder, new_name) if new_name else src_rel
+    src_path = os.path.join(output_dir, src_rel)
+    dst_path = os.path.join(output_dir, dst_rel)
+    if os.path.exists(src_path):
+        if src_path != dst_path:
+            os.rename(src_path, dst_path)
+    elif not os.path.exists(dst_path):
+        data = await get_client(ip).view(image["filename"], subfolder, image.get("type", "output"))
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        with open(dst_path, "wb") as f:
+            f.write(data)
+    return dst_rel.replace(os.sep, "/")
+
+# 캐시 적중 이미지를 내용 해시 기반 파일명으로 output 에 내보냄. ComfyUI 의 카운터 파일명은 재사용될 수
+# 있으므로 output 에 같은 이름의 파일이 있어도 믿지 않고, 항상 캐시 사본의 다이제스트로 이름을 정하고 확인한다
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def export_cached_image(cache_path: str) -> str:
+    digest = _file_digest(cache_path)
+    filename = f"cached_{digest[:32]}{os.path.splitext(cache_path)[1]}"
+    output_path = os.path.join(output_dir, filename)
+    if not os.path.exists(output_path) or _file_digest(output_path) != digest:
+        tmp_path = f"{output_path}.tmp"
+        shutil.copyfile(cache_path, tmp_path)
+        os.replace(tmp_path, output_path)
+    return filename
+
+# 텍스트 이미지 생성
+
+async def run_generate_image(input_data: PromptInput, job=None) -> dict:
+    run_id = job.id if job is not None else uuid.uuid4().hex
+    tier = resolve_tier(input_data.tier)
+    prompt_workflow = generate_prompt_text(input_data.user_prompt, input_data.user_negative, tier)
+
+    # 시드/체크포인트/샘플러가 고정이므로 같은 워크플로우는 항상 같은 이미지 → 캐시 조회
+    cache_key = hash_workflow(prompt_workflow)
+    cached = await asyncio.to_thread(generate_cache.get, cache_key)
+    if cached is not None:
+        cache_path, meta = cached
+        image_filename = await asyncio.to_thread(export_cached_image, cache_path)
+        if job is not None:
+            job.set_stage("cache_hit")
+        artifacts.record(run_id, KIND_IMAGE, image_filename, "generate", input_data.user_prompt)
+        return {
+            "status": "completed",
+            "job_id": run_id,
+            "image": f"{host_ip}/images/{image_filename}",
+            "filename": image_filename,
+            "tier": tier,
+            "cached": True
+        }
+
+    result, ip = await run_workflow(prompt_workflow, text2img_pool, job, tier)
+
+    # SaveImage(9) 노드가 저장한 파일명을 history 에서 그대로 사용
+    file_image_url = None
+    image_filename = None
+    images = output_images(result, "9")
+    if images:
+        with track("retrieval", text2img_pool.name, ip):
+            image_filename = await materialize_output_image(images[-1], ip)
+        file_image_url = f"{host_ip}/images/{image_filename}"
+        await asyncio.to_thread(generate_cache.put, cache_key, os.path.join(output_dir, image_filename), {"filename": image_filename})
+        artifacts.record(run_id, KIND_IMAGE, image_filename, "generate", input_data.user_prompt)
+
+    return {
+        "status": "completed" if file_image_url else "fail",
+        "job_id": run_id,
+        "image": file_image_url,
+        "filename": image_filename,
+        "tier": tier,
+        "cached": False
+    }
+
+# MVAdapter 기반 이미지 생성
+
+async def run_generate_mv_adapter(input_data: MVAdapterInput, job=None) -> dict:
+    run_id = job.id if job is not None else uuid.uuid4().hex
+    tier = resolve_tier(input_data.tier)
+    reference_filename = check_reference_filename(input_data.reference_filename)
+    # 입력 이미지가 이미 배경이 지워진 RGBA(text2img 의 rembg 출력 등)면 BiRefNet 을 다시 돌리지 않고
+    # ImagePreprocessor 의 크롭/축소/가운데 정렬을 여기서 입력 알파로 해 둔 참조 이미지를 쓴다
+    reference_path = os.path.join(output_dir, reference_filename)
+    alpha = await reusable_alpha([reference_path])
+    if alpha:
+        template = workflow_registry.get("mv_adapter_alpha")
+        size = {**template.defaults, **workflow_registry.tier_values("mv_adapter_alpha", tier)}
+        stem = os.path.splitext(reference_filename)[0]
+        reference_filename = f"{stem}_mvref_{size['width']}x{size['height']}.png"
+        with span("mv_adapter_alpha.preprocess"):
+            await asyncio.to_thread(
+                prepare_reference, reference_path, os.path.join(output_dir, reference_filename), size["width"], size["height"]
+            )
+    prompt_workflow = generate_mv_adapter_workflow(reference_filename, input_data.user_prompt, tier, alpha)
+    result, ip = await run_workflow(prompt_workflow, mv_adapter_pool, job, tier)
+
+    # SaveImage(12) 노드의 출력 3장을 ViewSelector 순서대로 front/back/left 로 이름 변경
+    view_names = ["front", "back", "left"]
+    views = {}
+    for image, view in zip(output_images(result, "12"), view_names):
+        new_name = image["filename"].replace("_.png", f"_{view}.png")
+        with track("retrieval", mv_adapter_pool.name, ip):
+            views[view] = await materialize_output_image(image, ip, new_name)
+        artifacts.record(run_id, KIND_VIEW, views[view], "mv_adapter", input_data.user_prompt, view)
+
+    # 대표 이미지로 front 를 반환
+    file_image_url = f"{host_ip}/images/{views['front']}" if "front" in views else None
+    return {
+        "status": "completed" if len(views) == len(view_names) else "fail",
+        "job_id": run_id,
+        "image": file_image_url,
+        "tier": tier,
+        "views": views
+    }
+
+# 배치 텍스트 이미지 생성
+# 같은 프롬프트끼리 latent batch_size 로 묶어 체크포인트 로드/CLIP 인코딩을 배치당 한 번만 수행
+
+def plan_batch_groups(input_data: BatchInput) -> list:
+    requests = list(input_data.prompts)
+    if input_data.user_prompt:
+        requests.append(PromptInput(user_prompt=input_data.user_prompt, user_negative=input_data.user_negative))
+    if not requests:
+        raise HTTPException(status_code=400, detail="프롬프트가 비어 있습니다.")
+    if len(requests) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"프롬프트는 최대 {BATCH_MAX_PROMPTS}개까지 가능합니다.")
+    variants = input_data.variants
+    if not 1 <= variants <= BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"variants 는 1~{BATCH_MAX_VARIANTS} 사이여야 합니다.")
+    if len(requests) * variants > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"한 번에 최대 {BATCH_MAX_IMAGES}장까지 생성할 수 있습니다.")
+
+    # 동일한 (프롬프트, 네거티브) 는 하나로 합쳐 장수만 늘린다
+    counts = {}
+    for item in requests:
+        key = (item.user_prompt, item.user_negative)
+        counts[key] = counts.get(key, 0) + variants
+
+    # latent 배치(그룹)마다 다른 시드: 기준 시드 + 그룹 번호 (기준 시드를 주면 재현 가능)
+    base_seed = input_data.seed if input_data.seed is not None else random.randrange(2 ** 32)
+    groups = []
+    for (user_prompt, user_negative), count in counts.items():
+        for start in range(0, count, BATCH_MAX_SIZE):
+            groups.append((user_prompt, user_negative, min(BATCH_MAX_SIZE, count - start), base_seed + len(groups)))
+    return groups
+
+async def run_generate_batch(input_data: BatchInput, job=None) -> dict:
+    run_id = job.id if job is not None else uuid.uuid4().hex
+    groups = plan_batch_groups(input_data)
+    tier = resolve_tier(input_data.tier)
+    prompt_workflow, save_nodes = generate_batch_workflow(groups, tier)
+    result, ip = await run_workflow(prompt_workflow, text2img_pool, job, tier)
+
+    images = []
+    for (user_prompt, user_negative, batch_size, seed), node_id in zip(groups, save_nodes):
+        for batch_index, image in enumerate(output_images(result, node_id)):
+            with track("retrieval", text2img_pool.name, ip):
+                image_filename = await materialize_output_image(image, ip)
+            artifacts.record(run_id, KIND_IMAGE, image_filename, "generate_batch", user_prompt)
+            images.append({
+                "user_prompt": user_prompt,
+                "user_negative": user_negative,
+                "seed": seed,
+                "batch_index": batch_index,
+                "filename": image_filename,
+                "image": f"{host_ip}/images/{image_filename}"
+            })
+
+    expected = sum(group[2] for group in groups)
+    return {
+        "status": "completed" if len(images) == expected else "fail",
+        "job_id": run_id,
+        "tier": tier,
+        "images": images
+    }
+
+# =========================
+# 서버 측 엔드투엔드 파이프라인 (text2img → mv_adapter → hy3d)
+# =========================
+# 단계 사이의 이미지/뷰는 클라이언트를 거치지 않고 서버에서 바로 넘긴다.
+# Hy3D 단계는 뷰 3장을 Hy3D 서버의 /jobs/generate_hy3d 로 스트리밍 업로드하고 완료까지 상태를 조회한다.
+
+HY3D_SERVER = os.getenv("HY3D_SERVER")
+PIPELINE_POLL_INTERVAL = 1  # Hy3D 작업 상태 조회 간격(초)
+HY3D_REQUEST_TIMEOUT = float(os.getenv("PIPELINE_HY3D_REQUEST_TIMEOUT", "60"))  # Hy3D 서버 요청 하나의 최대 시간(초)
+HY3D_STAGE_GRACE = float(os.getenv("PIPELINE_HY3D_GRACE", "600"))  # Hy3D 단계 최대 시간 = 티어별 hy3d timeout + 이 값(초, 업로드/대기/경량화 몫)
+
+_hy3d_session = None
+
+def get_hy3d_session() -> aiohttp.ClientSession:
+    global _hy3d_session
+    if _hy3d_session is None or _hy3d_session.closed:
+        _hy3d_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HY3D_REQUEST_TIMEOUT, sock_connect=5))
+    return _hy3d_session
+
+async def close_hy3d_session():
+    if _hy3d_session is not None:
+        await _hy3d_session.close()
+
+async def pipeline_text2img(job, data: dict) -> dict:
+    result = await run_generate_image(
+        PromptInput(user_prompt=data["user_prompt"], user_negative=data["user_negative"], tier=data["tier"]), job
+    )
+    if not result["filename"]:
+        raise RuntimeError("이미지 생성 실패 (text2img)")
+    job.add_partial("image", {"filename": result["filename"], "url": result["image"]})
+    return dict(data, reference_filename=result["filename"])
+
+async def pipeline_mv_adapter(job, data: dict) -> dict:
+    result = await run_generate_mv_adapter(
+        MVAdapterInput(reference_filename=data["reference_filename"], user_prompt=data["user_prompt"], tier=data["tier"]), job
+    )
+    if result["status"] != "completed":
+        raise RuntimeError("텍스처 뷰 생성 실패 (mv_adapter)")
+    job.add_partial("views", {view: f"{host_ip}/images/{path}" for view, path in result["views"].items()})
+    return dict(data, views=result["views"])
+
+async def pipeline_hy3d(job, data: dict) -> dict:
+    session = get_hy3d_session()
+    form = aiohttp.FormData()
+    handles = []
+    try:
+        for view in ("front", "back", "left"):
+            handle = open(os.path.join(output_dir, data["views"][view]), "rb")
+            handles.append(handle)
+            form.add_field(view, handle, filename=f"{view}.png", content_type="image/png")
+        form.add_field("progressive", "true")
+        for name in ("tier", "compact", "max_bytes"):
+            if data.get(name) is not None:
+                form.add_field(name, str(data[name]).lower())
+        async with session.post(f"{HY3D_SERVER}/jobs/generate_hy3d", data=form, headers=trace_headers()) as res:
+            res.raise_for_status()
+            remote = await res.json()
+    finally:
+        for handle in handles:
+            handle.close()
+
+    # Hy3D 서버가 멈추거나 작업이 끝나지 않아도 단계 워커를 계속 붙잡지 않도록 전체 시간 제한
+    limit = workflow_registry.timeout("hy3d", data.get("tier"))
+    deadline = time.monotonic() + limit + HY3D_STAGE_GRACE if limit else None
+    try:
+        while remote["status"] not in ("completed", "failed", "cancelled"):
+            if deadline is not None and time.monotonic() > deadline:
+                raise HTTPException(status_code=504, detail=f"GLB 생성 시간 초과 (hy3d, {limit + HY3D_STAGE_GRACE:.0f}초)")
+            await asyncio.sleep(PIPELINE_POLL_INTERVAL)
+            async with session.get(f"{HY3D_SERVER}/jobs/{remote['job_id']}", headers=trace_headers()) as res:
+                res.raise_for_status()
+                remote = await res.json()
+            # Hy3D 서버 작업의 단계/노드/스텝을 파이프라인 작업에 그대로 보여준다
+            if remote["status"] == "running" and remote["stage"] != job.stage:
+                job.set_stage(remote["stage"])
+            job.progress.mirror(remote.get("progress"))
+            mesh = (remote.get("partial") or {}).get("mesh")
+            if mesh and "mesh" not in job.partial:
+                job.add_partial("mesh", {"filename": mesh["filename"], "url": f"{HY3D_SERVER}{mesh['url']}"})
+    except BaseException:
+        # 파이프라인 작업이 취소/시간 초과/조회 실패로 끝나면 Hy3D 서버의 작업도 취소
         try:
-            req = urlrequest.Request(f"http://{ip}/history/{prompt_id}")
-            res = urlrequest.urlopen(req)
-            history = json.loads(res.read().decode("utf-8"))
-            if prompt_id in history:
-                return history[prompt_id]
+            async with session.delete(f"{HY3D_SERVER}/jobs/{remote['job_id']}", headers=trace_headers()):
+                pass
         except Exception:
             pass
-        time.sleep(3)
+        raise
+    if remote["status"] != "completed":
+        raise RuntimeError(f"GLB 생성 실패 (hy3d): {remote.get('error') or remote['status']}")
+    glb = remote["outputs"]
+    return dict(data, glb={"filename": glb["filename"], "url": f"{HY3D_SERVER}{glb['url']}"}, hy3d_job_id=remote["job_id"])
+
+# 단계별 동시 실행 수: ComfyUI 백엔드당 2개(하나 실행 + 하나 대기)로 GPU 가 쉬지 않게 한다
+pipeline = StagePipeline("text_to_glb", [
+    ("text2img", pipeline_text2img, int(os.getenv("PIPELINE_TEXT2IMG_CONCURRENCY", str(2 * len(text2img_pool.backends))))),
+    ("mv_adapter", pipeline_mv_adapter, int(os.getenv("PIPELINE_MV_ADAPTER_CONCURRENCY", str(2 * len(mv_adapter_pool.backends))))),
+    ("hy3d", pipeline_hy3d, int(os.getenv("PIPELINE_HY3D_CONCURRENCY", "2"))),
+])
+
+async def run_pipeline(input_data: PipelineInput, job) -> dict:
+    data = await pipeline.run(job, input_data.dict())
+    return {
+        "status": "completed",
+        "job_id": job.id,
+        "tier": data["tier"],
+        "image": job.partial.get("image"),
+        "views": job.partial.get("views"),
+        "mesh": job.partial.get("mesh"),
+        "glb": data["glb"],
+    }
 
 # 텍스트 이미지 생성 요청
 
 @app.post("/generate")
-def generate_image(input_data: PromptInput):
+async def generate_image(input_data: PromptInput):
     try:
-        prompt_workflow = generate_prompt_text(input_data.user_prompt, input_data.user_negative)
-        prompt_id = queue_prompt(prompt_workflow, comfy_ip)
-        result = check_progress(prompt_id, comfy_ip)
-
-        file_image_url = None
-        image_filename = None
-        for node_output in result["outputs"].values():
-            if "images" in node_output:
-                for image in node_output["images"]:
-                    image_filename = image["filename"]
-                    file_image_url = f"{host_ip}/images/{image_filename}"
+        return await run_generate_image(input_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {
-            "status": "completed" if file_image_url else "fail",
-            "image": file_image_url,
-            "filename": image_filename
-        }
+# 배치 텍스트 이미지 생성 요청
+
+@app.post("/generate_batch")
+async def generate_batch(input_data: BatchInput):
+    try:
+        return await run_generate_batch(input_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # MVAdapter 기반 이미지 생성 요청
 
 @app.post("/generate_mv_adapter")
-def generate_mv_adapter(input_data: MVAdapterInput):
+async def generate_mv_adapter(input_data: MVAdapterInput):
     try:
-        prompt_workflow = generate_mv_adapter_workflow(input_data.reference_filename, input_data.user_prompt)
-        prompt_id = queue_prompt(prompt_workflow, comfy_ip)
-        result = check_progress(prompt_id, comfy_ip)
-
-        file_image_url = None
-        output_dir = "output"
-        for node_output in result["outputs"].values():
-            if "images" in node_output:
-                # 기존 결과 중 하나만 대표로 반환
-                for image in node_output["images"]:
-                    if "filename" in image:
-                        file_image_url = f"{host_ip}/images/{image['filename']}"
-                break  # 첫 번째 출력만 사용
-
-        # 마지막 3개 파일 이름 변경
-        view_names = ["front", "back", "left"]
-        files = sorted(
-            [f for f in os.listdir(output_dir) if f.endswith(".png") and f.startswith("ComfyUI_")]
-        )
-        last_three = files[-3:]
-        for old_name, view in zip(last_three, view_names):
-            old_path = os.path.join(output_dir, old_name)
-            new_name = old_name.replace("_.png", f"_{view}.png")
-            new_path = os.path.join(output_dir, new_name)
-            os.rename(old_path, new_path)
-
-        return {"status": "completed" if file_image_url else "fail", "image": file_image_url}
+        return await run_generate_mv_adapter(input_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# 백엔드 풀 상태 (헬스, 대기열 깊이, 배정 수)
+
+@app.get("/backends")
+async def backend_stats():
+    return [text2img_pool.stats(), mv_adapter_pool.stats()]
+
+# 모델 친화 스케줄러 상태 (백엔드별 현재 모델 그룹, 대기 수, 모델 전환 수)
+
+@app.get("/scheduler")
+async def scheduler_status():
+    return scheduler_stats()
+
+# /generate 결과 캐시 통계
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return generate_cache.stats()
+
+# 프롬프트 하나로 GLB 까지 서버에서 이어서 실행 (즉시 job_id 반환)
+# 진행 중에는 GET /jobs/{job_id} 의 partial 에 image → views → mesh 가 차례로 채워진다
+
+@app.post("/pipeline", status_code=202)
+async def submit_pipeline(input_data: PipelineInput):
+    input_data.tier = resolve_tier(input_data.tier)
+    if not HY3D_SERVER:
+        raise HTTPException(status_code=503, detail="HY3D_SERVER 가 설정되지 않았습니다.")
+    job = jobs.submit("pipeline", lambda job: run_pipeline(input_data, job))
+    return job.to_dict()
+
+@app.get("/pipeline/stats")
+async def pipeline_stats():
+    return pipeline.stats()
+
+# 비동기 작업 제출 (즉시 job_id 반환, 결과는 GET /jobs/{job_id} 로 조회)
+
+@app.post("/jobs/generate", status_code=202)
+async def submit_generate_job(input_data: PromptInput):
+    resolve_tier(input_data.tier)  # 잘못된 티어는 제출 시점에 400
+    job = jobs.submit("generate", lambda job: run_generate_image(input_data, job))
+    return job.to_dict()
+
+@app.post("/jobs/generate_batch", status_code=202)
+async def submit_generate_batch_job(input_data: BatchInput):
+    plan_batch_groups(input_data)  # 잘못된 요청은 제출 시점에 400
+    resolve_tier(input_data.tier)
+    job = jobs.submit("generate_batch", lambda job: run_generate_batch(input_data, job))
+    return job.to_dict()
+
+@app.post("/jobs/generate_mv_adapter", status_code=202)
+async def submit_generate_mv_adapter_job(input_data: MVAdapterInput):
+    resolve_tier(input_data.tier)  # 잘못된 티어/파일명은 제출 시점에 400
+    check_reference_filename(input_data.reference_filename)
+    job = jobs.submit("generate_mv_adapter", lambda job: run_generate_mv_adapter(input_data, job))
+    return job.to_dict()
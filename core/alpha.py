@@ -0,0 +1,93 @@
+import asyncio
+import os
+
+from PIL import Image
+
+# =========================
+# 알파 채널(배경 제거 마스크) 판별
+# =========================
+# 배경 제거는 text2img(rembg), mv_adapter(BiRefNet), hy3d(InSPyReNet, 뷰마다) 에서 세 번 반복된다.
+# 입력 이미지에 이미 쓸 만한 알파 마스크가 있으면 세그멘테이션 모델을 건너뛰고
+# 그 알파를 그대로 쓰는 변형 워크플로우(<이름>_alpha)로 바꿔 실행한다.
+# - hy3d_alpha: LoadImage 의 마스크를 뷰 이미지와 같은 크기로 맞춰 InvertMask 에 넣는다
+# - mv_adapter_alpha: MV-Adapter ImagePreprocessor 의 물체 영역 크롭/축소/가운데 정렬/회색 합성을
+#   prepare_reference 로 미리 해 둔 참조 이미지를 샘플러에 바로 넣는다 (ImagePreprocessor 는 배경 제거를 생략할 수 없음)
+#
+# "쓸 만한" 알파: 물체 영역(불투명 픽셀) 비율이 ALPHA_MIN_COVERAGE ~ ALPHA_MAX_COVERAGE 사이이고
+# 가장자리 픽셀 대부분(ALPHA_MIN_BORDER_CLEAR 이상)이 투명한 것 (= 배경이 실제로 지워진 이미지)
+
+ALPHA_REUSE = os.getenv("ALPHA_REUSE", "1") == "1"  # 0 이면 항상 세그멘테이션 포함 원본 워크플로우
+ALPHA_MIN_COVERAGE = float(os.getenv("ALPHA_MIN_COVERAGE", "0.02"))
+ALPHA_MAX_COVERAGE = float(os.getenv("ALPHA_MAX_COVERAGE", "0.95"))
+ALPHA_MIN_BORDER_CLEAR = float(os.getenv("ALPHA_MIN_BORDER_CLEAR", "0.9"))
+
+ALPHA_THRESHOLD = 128  # 이 값 이상이면 불투명(물체)
+SAMPLE_SIZE = 256      # 판별용으로 줄인 마스크 크기(px)
+
+REFERENCE_FILL = 0.9       # 참조 이미지에서 물체 긴 변이 차지하는 비율 (MV-Adapter preprocess_image 와 동일)
+REFERENCE_BACKGROUND = 127  # 배경 회색 (0.5 를 8비트로 내림)
+
+
+def alpha_stats(path: str):
+    # 반환: {"coverage": 물체 비율, "border_clear": 가장자리 투명 비율}, 알파가 없거나 읽을 수 없으면 None
+    try:
+        with Image.open(path) as image:
+            if image.mode == "P" and "transparency" in image.info:
+                image = image.convert("RGBA")
+            if "A" not in image.getbands():
+                return None
+            alpha = image.getchannel("A")
+            alpha.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+    except (OSError, ValueError):
+        return None
+    width, height = alpha.size
+    pixels = alpha.load()
+    opaque = sum(alpha.histogram()[ALPHA_THRESHOLD:])
+    border = [(x, 0) for x in range(width)] + [(x, height - 1) for x in range(width)]
+    border += [(0, y) for y in range(1, height - 1)] + [(width - 1, y) for y in range(1, height - 1)]
+    clear = sum(1 for x, y in border if pixels[x, y] < ALPHA_THRESHOLD)
+    return {
+        "coverage": opaque / (width * height),
+        "border_clear": clear / len(border) if border else 0.0,
+    }
+
+
+def has_valid_alpha(path: str) -> bool:
+    stats = alpha_stats(path)
+    return (
+        stats is not None
+        and ALPHA_MIN_COVERAGE <= stats["coverage"] <= ALPHA_MAX_COVERAGE
+        and stats["border_clear"] >= ALPHA_MIN_BORDER_CLEAR
+    )
+
+
+async def reusable_alpha(paths: list) -> bool:
+    # 모든 입력이 쓸 만한 알파를 가지고 있으면 True (이미지 디코딩은 스레드에서)
+    if not ALPHA_REUSE or not paths:
+        return False
+    results = await asyncio.gather(*(asyncio.to_thread(has_valid_alpha, path) for path in paths))
+    return all(results)
+
+
+def prepare_reference(src: str, dst: str, width: int, height: int) -> str:
+    # MV-Adapter ImagePreprocessor(preprocess_image) 와 같은 변환을 배경 제거 없이 입력 알파로 수행
+    # 알파 > 0 영역(위/왼쪽 1px 여유)으로 크롭 → 긴 변을 크기의 0.9 로 → 가운데 정렬 → 회색 배경에 알파 합성 (RGB)
+    with Image.open(src) as image:
+        image = image.convert("RGBA")
+    bbox = image.getchannel("A").point(lambda value: 255 if value > 0 else 0).getbbox()
+    if bbox is not None:
+        left, upper, right, lower = bbox
+        image = image.crop((max(left - 1, 0), max(upper - 1, 0), right, lower))
+    crop_width, crop_height = image.size
+    if crop_height > crop_width:
+        size = (int(crop_width * (height * REFERENCE_FILL) / crop_height), int(height * REFERENCE_FILL))
+    else:
+        size = (int(width * REFERENCE_FILL), int(crop_height * (width * REFERENCE_FILL) / crop_width))
+    image = image.resize(size, Image.BICUBIC)
+    canvas = Image.new("RGB", (width, height), (REFERENCE_BACKGROUND,) * 3)
+    canvas.paste(image.convert("RGB"), ((width - size[0]) // 2, (height - size[1]) // 2), image.getchannel("A"))
+    # 같은 참조 이미지로 동시에 들어온 요청이 쓰다 만 파일을 읽지 않도록 임시 파일에 쓰고 바꿔치기
+    temp = f"{dst}.{os.getpid()}.{id(canvas)}.tmp"
+    canvas.save(temp, format="PNG")
+    os.replace(temp, dst)
+    return dst
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+import time
+
+# =========================
+# 생성물(Artifact) 인덱스
+# =========================
+# 서버가 이미지/뷰/GLB 를 만들 때마다 (job_id, 종류, 뷰, 단계, 프롬프트, 경로, 시각)을 SQLite 에 기록한다.
+# 클라이언트는 출력 디렉토리를 glob/stat 하는 대신 인덱스를 조회하므로
+# 파일 개수와 무관하게 O(log n) 으로 최신 결과를 찾는다.
+# 경로는 출력 디렉토리 기준 상대 경로로 저장한다.
+
+KIND_IMAGE = "image"
+KIND_VIEW = "view"
+KIND_GLB = "glb"
+KIND_MESH = "mesh"  # 텍스처 전 단계의 raw 메시 (progressive 모드)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    view TEXT NOT NULL DEFAULT '',
+    stage TEXT,
+    prompt TEXT,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_kind_view ON artifacts (kind, view, created_at);
+CREATE INDEX IF NOT EXISTS idx_artifacts_job ON artifacts (job_id, kind, view);
+"""
+
+
+class ArtifactIndex:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            # 서버(기록)와 클라이언트(조회)가 서로 다른 프로세스에서 동시에 접근하므로 WAL 사용
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def record(self, job_id: str, kind: str, path: str, stage: str = None, prompt: str = None, view: str = ""):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO artifacts (job_id, kind, view, stage, prompt, path, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, view or "", stage, prompt, path.replace(os.sep, "/"), time.time())
+            )
+
+    # ---------------------------
+    # 조회
+    # ---------------------------
+
+    def latest(self, kind: str, view: str = "", job_id: str = None):
+        # 가장 최근 생성물 한 건 (job_id 를 주면 해당 작업 안에서)
+        if job_id:
+            sql = "SELECT * FROM artifacts WHERE job_id = ? AND kind = ? AND view = ? ORDER BY id DESC LIMIT 1"
+            params = (job_id, kind, view or "")
+        else:
+            sql = "SELECT * FROM artifacts WHERE kind = ? AND view = ? ORDER BY created_at DESC LIMIT 1"
+            params = (kind, view or "")
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+
+    def latest_views(self, views, job_id: str = None) -> dict:
+        result = {}
+        for view in views:
+            row = self.latest(KIND_VIEW, view, job_id)
+            result[view] = row["path"] if row else None
+        return result
+
+    def for_job(self, job_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM artifacts WHERE job_id = ? ORDER BY id", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,155 @@
+import asyncio
+import os
+import time
+
+from core.comfy_client import get_client
+
+# =========================
+# ComfyUI 백엔드 풀
+# =========================
+# 워크플로우 종류별로 ComfyUI 인스턴스 목록을 두고, 제출할 때마다 가장 한가한 정상 인스턴스를 고른다.
+# 부하는 각 백엔드의 /queue (실행 중 + 대기) 를 주기적으로 폴링한 값과
+# 이 프로세스가 배정했지만 아직 끝나지 않은 작업 수 중 큰 값으로 본다.
+# /queue 폴링이 연속으로 실패한 백엔드는 배정에서 빠지고, 다시 응답하면 자동으로 복귀한다.
+#
+# 설정: COMFY_BACKENDS_<WORKFLOW> (예: COMFY_BACKENDS_HY3D=10.0.0.2:8188,10.0.0.3:8188)
+#       없으면 COMFY_BACKENDS, 그것도 없으면 서버별 기본 주소 하나
+
+POLL_INTERVAL = float(os.getenv("COMFY_POOL_POLL_INTERVAL", "2"))  # /queue 폴링 간격(초)
+FAIL_THRESHOLD = int(os.getenv("COMFY_POOL_FAIL_THRESHOLD", "2"))   # 이만큼 연속 실패하면 배정 제외
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class Backend:
+    # GPU(ComfyUI 인스턴스) 하나의 상태. 같은 주소는 여러 풀이 공유한다
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.healthy = True
+        self.failures = 0
+        self.queue_running = 0
+        self.queue_pending = 0
+        self.inflight = 0    # 이 프로세스가 배정했고 아직 반환되지 않은 작업 수
+        self.assigned = 0    # 누적 배정 수
+        self.checked_at = None
+
+    @property
+    def load(self) -> int:
+        return max(self.queue_running + self.queue_pending, self.inflight)
+
+    def mark_ok(self, running: int, pending: int):
+        if not self.healthy:
+            print(f"[POOL] backend {self.ip} is back in rotation")
+        self.healthy = True
+        self.failures = 0
+        self.queue_running = running
+        self.queue_pending = pending
+        self.checked_at = time.time()
+
+    def mark_failed(self):
+        self.failures += 1
+        self.checked_at = time.time()
+        if self.healthy and self.failures >= FAIL_THRESHOLD:
+            self.healthy = False
+            print(f"[POOL] backend {self.ip} removed from rotation")
+            # 이 백엔드의 완료를 기다리던 요청도 바로 확인해서 실패 처리되도록
+            get_client(self.ip).wake_waiters()
+
+    def to_dict(self) -> dict:
+        return {
+            "ip": self.ip,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "queue_running": self.queue_running,
+            "queue_pending": self.queue_pending,
+            "inflight": self.inflight,
+            "assigned": self.assigned,
+            "checked_at": self.checked_at,
+        }
+
+
+_backends = {}  # ip -> Backend
+_pools = {}     # workflow -> BackendPool
+_poller = None
+
+
+def _get_backend(ip: str) -> Backend:
+    if ip not in _backends:
+        _backends[ip] = Backend(ip)
+    return _backends[ip]
+
+
+async def _poll_backend(backend: Backend):
+    try:
+        queue = await get_client(backend.ip).get_queue()
+        backend.mark_ok(len(queue.get("queue_running", [])), len(queue.get("queue_pending", [])))
+    except Exception:
+        backend.mark_failed()
+
+
+async def _poll_forever():
+    while True:
+        await asyncio.gather(*(_poll_backend(backend) for backend in list(_backends.values())))
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def _ensure_poller():
+    global _poller
+    if _poller is None or _poller.done():
+        _poller = asyncio.create_task(_poll_forever())
+
+
+class BackendPool:
+    def __init__(self, name: str, ips: list):
+        self.name = name
+        self.backends = [_get_backend(ip) for ip in ips]
+
+    def acquire(self) -> str:
+        # 가장 부하가 적은 정상 백엔드 (동률이면 누적 배정이 적은 쪽)
+        _ensure_poller()
+        candidates = [backend for backend in self.backends if backend.healthy]
+        if not candidates:
+            raise NoBackendAvailable(f"{self.name}: 사용 가능한 ComfyUI 백엔드가 없습니다.")
+        backend = min(candidates, key=lambda b: (b.load, b.assigned))
+        backend.inflight += 1
+        backend.assigned += 1
+        return backend.ip
+
+    def release(self, ip: str):
+        backend = _backends.get(ip)
+        if backend is not None and backend.inflight > 0:
+            backend.inflight -= 1
+
+    def mark_failed(self, ip: str):
+        # 제출 중 연결 오류 등 즉시 확인된 실패는 다음 폴링을 기다리지 않고 반영
+        backend = _backends.get(ip)
+        if backend is not None:
+            backend.failures = max(backend.failures, FAIL_THRESHOLD - 1)
+            backend.mark_failed()
+
+    def stats(self) -> dict:
+        return {"workflow": self.name, "backends": [backend.to_dict() for backend in self.backends]}
+
+
+def backend_states() -> list:
+    return list(_backends.values())
+
+
+def backend_ips(workflow: str, default: str) -> list:
+    value = os.getenv(f"COMFY_BACKENDS_{workflow.upper()}") or os.getenv("COMFY_BACKENDS") or default
+    return [ip.strip() for ip in value.split(",") if ip.strip()]
+
+
+def get_pool(workflow: str, default: str) -> BackendPool:
+    if workflow not in _pools:
+        _pools[workflow] = BackendPool(workflow, backend_ips(workflow, default))
+    return _pools[workflow]
+
+
+async def close_pools():
+    global _poller
+    if _poller is not None:
+        _poller.cancel()
+        _poller = None
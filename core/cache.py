@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# =========================
+# 디스크 기반 결과 캐시 (content-addressed, 용량 기준 LRU)
+# =========================
+# 키(해시)마다 결과 파일 <key><ext> 와 메타데이터 <key>.json 을 캐시 디렉토리에 저장한다.
+# LRU 순서는 파일 mtime 으로 유지하므로 재시작 후에도 디렉토리 스캔 한 번으로 복원된다.
+
+
+def hash_workflow(workflow) -> str:
+    # 템플릿에서 렌더링된 워크플로우는 직렬화 결과가 결정적이므로 그대로 해시
+    data = getattr(workflow, "serialized", None)
+    if data is None:
+        data = json.dumps(workflow, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class FileCache:
+    def __init__(self, directory: str, max_bytes: int, max_entries: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries  # 0 이면 개수 제한 없음
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (파일명, 크기), 오래된 것부터
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                # put 도중 종료되어 남은 임시 사본 (용량 집계/축출 대상이 아니므로 지운다)
+                os.remove(os.path.join(self.directory, name))
+                continue
+            if name.endswith(".json"):
+                continue
+            key = name.split(".", 1)[0]
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(self._meta_path(key)):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            found.append((st.st_mtime, key, name, st.st_size))
+        for _, key, name, size in sorted(found):
+            self._entries[key] = (name, size)
+            self._total_bytes += size
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    # ---------------------------
+    # 조회 / 저장
+    # ---------------------------
+
+    def get(self, key: str):
+        # 적중 시 (캐시 파일 경로, 메타데이터), 아니면 None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = os.path.join(self.directory, entry[0])
+            try:
+                with open(self._meta_path(key), encoding="utf-8") as f:
+                    meta = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return path, meta
+
+    def put(self, key: str, src_path: str, meta: dict) -> str:
+        ext = os.path.splitext(src_path)[1]
+        name = f"{key}{ext}"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        shutil.copyfile(src_path, tmp_path)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            os.replace(tmp_path, path)
+            with open(self._meta_path(key), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            self._entries[key] = (name, size)
+            self._total_bytes += size
+            self._evict()
+        return path
+
+    def _drop(self, key: str):
+        name, size = self._entries.pop(key)
+        self._total_bytes -= size
+        for path in (os.path.join(self.directory, name), self._meta_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _evict(self):
+        # 가장 오래 사용되지 않은 항목부터 용량/개수 한도 이하가 될 때까지 제거
+        while len(self._entries) > 1 and (
+            self._total_bytes > self.max_bytes
+            or (self.max_entries and len(self._entries) > self.max_entries)
+        ):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    # ---------------------------
+    # 통계
+    # ---------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# =========================
+# 작은 값 메모 캐시 (TTL + 개수 기준 LRU, JSON 파일 하나로 영속화)
+# =========================
+# 프롬프트 변환 결과처럼 작은 JSON 값을 키별로 보관한다. put 은 메모리만 갱신하고, 파일 저장은 flush 가
+# 따로 한다 (asyncio 에서는 asyncio.to_thread(cache.flush) 로 이벤트 루프 밖에서 호출).
+# 임시 파일에 쓰고 교체하므로 도중에 종료돼도 파일이 깨지지 않고, 재시작하면 그대로 복원된다.
+
+
+class MemoCache:
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl  # 초, 0 이면 만료 없음
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # flush 끼리 직렬화 (항목 잠금은 파일 쓰는 동안 잡지 않음)
+        self._dirty = False
+        self._entries = OrderedDict()  # key -> (저장 시각, 값), 오래 사용되지 않은 것부터
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, stored_at, value in data:
+            if not self._expired(stored_at, now):
+                self._entries[key] = (stored_at, value)
+        # 실행 사이에 max_entries 를 줄였으면 오래 사용되지 않은 것부터 버린다 (다음 flush 때 파일에도 반영)
+        self._trim()
+
+    def _save(self, snapshot: list):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def flush(self):
+        # 바뀐 내용이 있을 때만 기록. 스냅샷은 잠금 안에서 뜨고, 직렬화/디스크 쓰기는 잠금 밖에서 한다
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+                self._dirty = False
+            try:
+                self._save(snapshot)
+            except OSError as e:
+                with self._lock:
+                    self._dirty = True  # 다음 flush 때 다시 시도
+                print(f"[MEMO-CACHE] failed to save {self.path}: {e}")
+
+    def _trim(self):
+        while self.max_entries and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            self._dirty = True
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - stored_at > self.ttl
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0], time.time()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            self._trim()
+            self._dirty = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
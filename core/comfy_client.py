@@ -0,0 +1,442 @@
+import asyncio
+import json
+import os
+import struct
+import time
+import uuid
+from collections import OrderedDict
+
+import aiohttp
+
+from core.tracing import current_trace_id
+
+# =========================
+# ComfyUI 공용 비동기 클라이언트
+# =========================
+# 호스트별 keep-alive 커넥션 풀(aiohttp)로 /prompt, /history 를 호출하고,
+# /ws?clientId=... 웹소켓을 구독해 prompt 완료 이벤트가 오는 즉시 대기 중인 요청을 깨운다.
+# 소켓이 끊어진 동안에는 /history 폴링으로 대체한다.
+# executed 이벤트로 전달되는 노드별 출력은 watch_outputs 로 실행 도중에 받아볼 수 있다.
+# 노드 진행(executing), 스텝 진행(progress k/N), 샘플링 중 미리보기 이미지(바이너리 프레임)는 watch_progress 로 받는다.
+# 대기는 모두 asyncio Future 위에서 이뤄지므로 스레드나 이벤트 루프를 점유하지 않는다.
+# 백엔드가 죽어 history 확인이 연속으로 실패하거나(ComfyUnavailable) 최대 대기 시간을 넘기면(ExecutionTimeout) 대기를 끝낸다.
+
+POLL_INTERVAL = 3          # 소켓이 끊겼을 때 history 폴링 간격(초)
+SAFETY_POLL_INTERVAL = 30  # 소켓 연결 중에도 이벤트 유실에 대비한 history 확인 간격(초)
+RECONNECT_DELAY = 2        # 웹소켓 재연결 대기(초)
+CONNECT_WAIT = 1           # 첫 prompt 제출 전 소켓 연결을 기다리는 시간(초)
+FINISHED_KEEP = 1024       # 대기자 등록 전에 끝난 prompt_id 를 기억할 개수
+HISTORY_MAX_FAILURES = int(os.getenv("COMFY_HISTORY_MAX_FAILURES", "3"))  # 연속 history 확인 실패 허용 횟수
+
+# 커넥션 풀 / 타임아웃 설정
+POOL_LIMIT = int(os.getenv("COMFY_POOL_LIMIT", "100"))                  # 전체 동시 연결 수
+POOL_LIMIT_PER_HOST = int(os.getenv("COMFY_POOL_LIMIT_PER_HOST", "32"))  # ComfyUI 호스트당 동시 연결 수
+KEEPALIVE_TIMEOUT = float(os.getenv("COMFY_KEEPALIVE_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("COMFY_CONNECT_TIMEOUT", "5"))
+REQUEST_TIMEOUT = float(os.getenv("COMFY_REQUEST_TIMEOUT", "30"))
+
+DONE_EVENTS = ("execution_success", "execution_error", "execution_interrupted")
+
+# 웹소켓 바이너리 프레임: 4바이트 이벤트 종류(big endian) + 본문
+BINARY_PREVIEW_IMAGE = 1                # 본문: 4바이트 이미지 형식(1 JPEG, 2 PNG) + 이미지
+BINARY_PREVIEW_IMAGE_WITH_METADATA = 4  # 본문: 4바이트 메타데이터 길이 + JSON(prompt_id 등) + 이미지
+PREVIEW_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+
+class ComfyUnavailable(aiohttp.ClientConnectionError):
+    # 완료를 기다리는 동안 백엔드에 닿을 수 없게 됨 (연결 오류로 취급해 백엔드 풀에서 빼도록)
+    pass
+
+
+class ExecutionTimeout(Exception):
+    # prompt 가 최대 대기 시간 안에 끝나지 않음 (prompt 는 취소 요청 후 발생)
+    pass
+
+
+class ComfyClient:
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.client_id = uuid.uuid4().hex
+        self._session = None
+        self._waiters = {}
+        self._finished = OrderedDict()
+        self._timings = OrderedDict()  # prompt_id -> {"node", "start", "durations"}
+        self._started = OrderedDict()  # prompt_id -> 실행 시작 시각 (time.monotonic)
+        self._node_outputs = OrderedDict()  # prompt_id -> {node_id: executed 출력}
+        self._output_watchers = {}  # prompt_id -> callback(node_id, output)
+        self._progress_watchers = {}  # prompt_id -> callback(event)
+        self._executing = None  # 지금 실행 중인 prompt_id (prompt_id 가 없는 미리보기 프레임의 주인)
+        self._connected = asyncio.Event()
+        self._wake = asyncio.Event()  # 소켓이 끊기거나 백엔드가 응답하지 않을 때 대기 중인 요청을 바로 history 확인으로 돌린다
+        self._listener = None
+
+    # ---------------------------
+    # 세션 / 커넥션 풀
+    # ---------------------------
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=POOL_LIMIT,
+                limit_per_host=POOL_LIMIT_PER_HOST,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, sock_connect=CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ---------------------------
+    # HTTP
+    # ---------------------------
+
+    async def queue_prompt(self, prompt_workflow) -> str:
+        # prompt_workflow: dict 또는 미리 직렬화된 RenderedWorkflow (serialized 속성)
+        # client_id 는 웹소켓 이벤트 수신용이라 고정이고, 요청 추적 id 는 extra_data.trace_id 로 넘긴다
+        await self._ensure_listener()
+        serialized = getattr(prompt_workflow, "serialized", None)
+        if serialized is None:
+            serialized = json.dumps(prompt_workflow, ensure_ascii=False)
+        extra_data = {"trace_id": current_trace_id()} if current_trace_id() else {}
+        body = f'{{"prompt": {serialized}, "client_id": {json.dumps(self.client_id)}, "extra_data": {json.dumps(extra_data)}}}'
+        headers = {"Content-Type": "application/json"}
+        async with self._get_session().post(f"http://{self.ip}/prompt", data=body.encode("utf-8"), headers=headers) as res:
+            res.raise_for_status()
+            return (await res.json(content_type=None))['prompt_id']
+
+    async def get_history(self, prompt_id: str):
+        async with self._get_session().get(f"http://{self.ip}/history/{prompt_id}") as res:
+            res.raise_for_status()
+            history = await res.json(content_type=None)
+        return history.get(prompt_id)
+
+    async def view(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        async with self._get_session().get(f"http://{self.ip}/view", params=params) as res:
+            res.raise_for_status()
+            return await res.read()
+
+    async def get_queue(self) -> dict:
+        # {"queue_running": [...], "queue_pending": [...]}
+        async with self._get_session().get(f"http://{self.ip}/queue") as res:
+            res.raise_for_status()
+            return await res.json(content_type=None)
+
+    async def upload_image(self, path: str, name: str, subfolder: str = "", overwrite: bool = True) -> str:
+        # 로컬 파일을 /upload/image 로 청크 단위 스트리밍 업로드 (파일 전체를 메모리에 올리지 않음)
+        # 반환: LoadImage 의 image 입력에 넣을 input 디렉토리 기준 이름 (subfolder/name)
+        with open(path, "rb") as f:
+            form = aiohttp.FormData()
+            form.add_field("image", f, filename=name, content_type="image/png")
+            form.add_field("subfolder", subfolder)
+            form.add_field("type", "input")
+            form.add_field("overwrite", "true" if overwrite else "false")
+            async with self._get_session().post(f"http://{self.ip}/upload/image", data=form) as res:
+                res.raise_for_status()
+                data = await res.json(content_type=None)
+        name = data.get("name", name)
+        subfolder = data.get("subfolder", subfolder)
+        return f"{subfolder}/{name}" if subfolder else name
+
+    async def cancel_prompt(self, prompt_id: str):
+        # 대기열에서 제거하고, 이미 실행 중이면 interrupt
+        session = self._get_session()
+        async with session.post(f"http://{self.ip}/queue", json={"delete": [prompt_id]}) as res:
+            res.raise_for_status()
+        async with session.get(f"http://{self.ip}/queue") as res:
+            res.raise_for_status()
+            queue = await res.json(content_type=None)
+        if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+            async with session.post(f"http://{self.ip}/interrupt", json={"prompt_id": prompt_id}) as res:
+                res.raise_for_status()
+
+    # ---------------------------
+    # 완료 대기
+    # ---------------------------
+
+    async def wait_for_completion(self, prompt_id: str, timeout: float = None) -> dict:
+        # timeout: 최대 대기 시간(초, 대기열 + 실행), None 이면 무제한
+        deadline = time.monotonic() + timeout if timeout else None
+        failures = 0
+        future = self._register(prompt_id)
+        try:
+            while True:
+                # 소켓이 끊겼거나 직전 history 확인이 실패했으면 짧은 간격으로 확인
+                interval = SAFETY_POLL_INTERVAL if self._connected.is_set() and not failures else POLL_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        await self._cancel_quietly(prompt_id)
+                        raise ExecutionTimeout(f"ComfyUI 작업이 {timeout:.0f}초 안에 끝나지 않았습니다 ({self.ip})")
+                    interval = min(interval, remaining)
+                wake = asyncio.ensure_future(self._wake.wait())
+                try:
+                    await asyncio.wait((future, wake), timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    wake.cancel()
+                if not future.done():
+                    try:
+                        result = await self.get_history(prompt_id)
+                    except Exception as e:
+                        failures += 1
+                        if failures >= HISTORY_MAX_FAILURES:
+                            raise ComfyUnavailable(f"ComfyUI 백엔드에 연결할 수 없습니다 ({self.ip}): {e}") from e
+                        continue
+                    failures = 0
+                    if result is not None:
+                        return result
+                    continue
+                result = await self._fetch_history_after_done(prompt_id)
+                if result is not None:
+                    return result
+                future = self._register(prompt_id, reset=True)
+        finally:
+            self._waiters.pop(prompt_id, None)
+
+    async def _try_history(self, prompt_id: str):
+        try:
+            return await self.get_history(prompt_id)
+        except Exception:
+            return None
+
+    def wake_waiters(self):
+        # 완료를 기다리는 요청들이 다음 폴링 간격을 기다리지 않고 history 를 확인하게 한다
+        # (소켓 끊김, 백엔드 풀의 /queue 폴링 실패 시)
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    async def _cancel_quietly(self, prompt_id: str):
+        try:
+            await self.cancel_prompt(prompt_id)
+        except Exception:
+            pass
+
+    async def _fetch_history_after_done(self, prompt_id: str):
+        # 완료 이벤트 직후 history 기록이 늦게 반영되는 경우를 대비해 짧게 재시도
+        for delay in (0, 0.1, 0.3, 1):
+            await asyncio.sleep(delay)
+            result = await self._try_history(prompt_id)
+            if result is not None:
+                return result
+        return None
+
+    def _register(self, prompt_id: str, reset: bool = False) -> asyncio.Future:
+        future = self._waiters.get(prompt_id)
+        if future is None or reset:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[prompt_id] = future
+        if self._finished.pop(prompt_id, None) is not None and not future.done():
+            future.set_result(True)
+        return future
+
+    def _mark_done(self, prompt_id: str):
+        future = self._waiters.get(prompt_id)
+        if future is not None:
+            if not future.done():
+                future.set_result(True)
+            return
+        self._finished[prompt_id] = True
+        while len(self._finished) > FINISHED_KEEP:
+            self._finished.popitem(last=False)
+
+    # ---------------------------
+    # 웹소켓 리스너
+    # ---------------------------
+
+    async def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        if not self._connected.is_set():
+            # 소켓이 붙기 전에 제출하면 ComfyUI 가 이벤트를 보내지 않으므로 잠시 기다린다
+            try:
+                await asyncio.wait_for(self._connected.wait(), CONNECT_WAIT)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _listen(self):
+        url = f"ws://{self.ip}/ws?clientId={self.client_id}"
+        while True:
+            try:
+                async with self._get_session().ws_connect(url, heartbeat=30) as ws:
+                    self._connected.set()
+                    async for message in ws:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            self._handle_message(message.data)
+                        elif message.type == aiohttp.WSMsgType.BINARY:
+                            self._handle_binary(message.data)
+                        elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                self._connected.clear()
+                raise
+            except Exception:
+                pass
+            if self._connected.is_set():
+                self._connected.clear()
+                self.wake_waiters()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _handle_message(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        if msg_type in ("execution_start", "executing") and prompt_id not in self._started:
+            self._started[prompt_id] = time.monotonic()
+            while len(self._started) > FINISHED_KEEP:
+                self._started.popitem(last=False)
+        if msg_type == "executing":
+            self._track_node(prompt_id, data.get("node"))
+            self._executing = prompt_id if data.get("node") is not None else None
+            self._emit_progress(prompt_id, {"type": "executing", "node": data.get("node")})
+        elif msg_type == "executed":
+            self._node_executed(prompt_id, data.get("node"), data.get("output") or {})
+        elif msg_type == "execution_cached":
+            self._emit_progress(prompt_id, {"type": "cached", "nodes": data.get("nodes") or []})
+        elif msg_type == "progress":
+            self._emit_progress(prompt_id, {
+                "type": "progress", "node": data.get("node"), "value": data.get("value"), "max": data.get("max")
+            })
+        if msg_type in DONE_EVENTS or (msg_type == "executing" and data.get("node") is None):
+            if self._executing == prompt_id:
+                self._executing = None
+            self._mark_done(prompt_id)
+
+    def _handle_binary(self, raw: bytes):
+        # 샘플링 중 미리보기 이미지. 메타데이터가 없는 형식은 prompt_id 가 없으므로
+        # 이 클라이언트가 제출해 지금 실행 중인 prompt 의 것으로 본다 (ComfyUI 는 한 번에 하나만 실행)
+        if len(raw) < 8:
+            return
+        event, value = struct.unpack(">II", raw[:8])
+        if event == BINARY_PREVIEW_IMAGE:
+            prompt_id, mime, image = self._executing, PREVIEW_FORMATS.get(value), raw[8:]
+        elif event == BINARY_PREVIEW_IMAGE_WITH_METADATA:
+            try:
+                metadata = json.loads(raw[8:8 + value])
+            except ValueError:
+                return
+            prompt_id, mime, image = metadata.get("prompt_id"), metadata.get("image_type"), raw[8 + value:]
+        else:
+            return
+        if prompt_id and mime:
+            self._emit_progress(prompt_id, {"type": "preview", "mime": mime, "data": image})
+
+    # ---------------------------
+    # 노드별 실행 시간
+    # ---------------------------
+
+    def _track_node(self, prompt_id: str, node_id):
+        # executing 이벤트 사이의 간격을 직전 노드의 실행 시간으로 기록
+        now = time.monotonic()
+        timing = self._timings.get(prompt_id)
+        if timing is None:
+            timing = self._timings[prompt_id] = {"node": None, "start": now, "durations": {}}
+            while len(self._timings) > FINISHED_KEEP:
+                self._timings.popitem(last=False)
+        if timing["node"] is not None:
+            timing["durations"][timing["node"]] = now - timing["start"]
+        timing["node"] = node_id
+        timing["start"] = now
+
+    def pop_node_durations(self, prompt_id: str) -> dict:
+        timing = self._timings.pop(prompt_id, None)
+        return timing["durations"] if timing else {}
+
+    def pop_execution_start(self, prompt_id: str):
+        # 웹소켓으로 받은 실행 시작 시각 (time.monotonic), 이벤트를 놓쳤으면 None
+        return self._started.pop(prompt_id, None)
+
+    # ---------------------------
+    # 노드 출력 이벤트 (실행 도중 중간 결과)
+    # ---------------------------
+
+    def _node_executed(self, prompt_id: str, node_id, output: dict):
+        outputs = self._node_outputs.get(prompt_id)
+        if outputs is None:
+            outputs = self._node_outputs[prompt_id] = {}
+            while len(self._node_outputs) > FINISHED_KEEP:
+                self._node_outputs.popitem(last=False)
+        outputs[node_id] = output
+        callback = self._output_watchers.get(prompt_id)
+        if callback is not None:
+            callback(node_id, output)
+
+    def watch_outputs(self, prompt_id: str, callback):
+        # callback(node_id, output) 은 executed 이벤트마다 이벤트 루프에서 호출된다 (등록 전에 온 출력은 즉시 재생)
+        self._output_watchers[prompt_id] = callback
+        for node_id, output in list(self._node_outputs.get(prompt_id, {}).items()):
+            callback(node_id, output)
+
+    def unwatch_outputs(self, prompt_id: str):
+        self._output_watchers.pop(prompt_id, None)
+        self._node_outputs.pop(prompt_id, None)
+
+    # ---------------------------
+    # 진행 이벤트 (노드, 스텝, 미리보기)
+    # ---------------------------
+
+    def _emit_progress(self, prompt_id: str, event: dict):
+        callback = self._progress_watchers.get(prompt_id)
+        if callback is not None:
+            callback(event)
+
+    def watch_progress(self, prompt_id: str, callback):
+        # callback(event) 은 이벤트 루프에서 호출된다. event["type"]:
+        #   executing - {"node"}, cached - {"nodes"}, progress - {"node", "value", "max"}, preview - {"mime", "data"}
+        self._progress_watchers[prompt_id] = callback
+
+    def unwatch_progress(self, prompt_id: str):
+        self._progress_watchers.pop(prompt_id, None)
+
+
+# ---------------------------
+# history 출력 해석
+# ---------------------------
+
+def output_images(history: dict, node_id: str = None, folder_type: str = "output") -> list:
+    # SaveImage 등이 남긴 이미지 목록 (filename/subfolder/type), PreviewImage 의 temp 출력은 제외
+    images = []
+    for nid, node_output in history.get("outputs", {}).items():
+        if node_id is not None and nid != node_id:
+            continue
+        for image in node_output.get("images", []):
+            if image.get("type", "output") == folder_type:
+                images.append(image)
+    return images
+
+
+def output_model_file(history: dict, node_id: str):
+    # Preview3D 노드의 ui 출력에 담긴 모델 파일 경로 (ComfyUI output 기준 상대 경로)
+    node_output = history.get("outputs", {}).get(node_id, {})
+    for key in ("result", "model_file"):
+        for value in node_output.get(key, []) or []:
+            if isinstance(value, str) and value:
+                return value.replace("\\", "/")
+    return None
+
+
+_clients = {}
+
+
+def get_client(ip: str) -> ComfyClient:
+    if ip not in _clients:
+        _clients[ip] = ComfyClient(ip)
+    return _clients[ip]
+
+
+async def close_clients():
+    for client in list(_clients.values()):
+        await client.close()
+    _clients.clear()
@@ -6,10 +6,17 @@ load_dotenv()
 
 # ✅ DISCORD 설정
 DISCORD_TOKEN = os.getenv("DISCORD_API_KEY")
+DISCORD_ATTACHMENT_LIMIT = int(os.getenv("DISCORD_ATTACHMENT_LIMIT", str(10 * 1024 * 1024)))  # 첨부 파일 최대 크기(바이트)
+DISCORD_WORKERS = int(os.getenv("DISCORD_WORKERS", "2"))  # 동시에 처리할 !3d 요청 수
 
 # ✅ 3D 경로 설정
-OUTPUT_DIR = os.getenv("OUTPUT_DIR")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
 OUTPUT_3D_DIR = os.path.join(OUTPUT_DIR, "3D")
 MVADAPTER_SERVER = os.getenv("MVADAPTER_SERVER")
 HY3D_SERVER = os.getenv("HY3D_SERVER")
-PROMPT_CONVERT_API = os.getenv("PROMPT_CONVERT_API")
\ No newline at end of file
+PROMPT_CONVERT_API = os.getenv("PROMPT_CONVERT_API")
+
+# ✅ 프롬프트 변환 결과 캐시 (같은 한글 프롬프트는 변환 API 를 다시 부르지 않음)
+PROMPT_CACHE_FILE = os.getenv("PROMPT_CACHE_FILE", os.path.join("cache", "prompt_convert.json"))
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))  # 초
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "2000"))
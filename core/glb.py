@@ -0,0 +1,362 @@
+import io
+import json
+import os
+import struct
+import time
+
+import numpy as np
+from PIL import Image
+
+# =========================
+# GLB 경량화 (CPU 전용)
+# =========================
+# Hy3DExportMesh 가 만든 GLB 를 전송 전에 줄인다.
+# - 정점 속성 양자화 (KHR_mesh_quantization): POSITION → int16, NORMAL → int8, TEXCOORD → uint16
+#   POSITION 의 오프셋/스케일은 메시를 참조하는 노드 행렬에 합쳐 원래 좌표로 복원된다.
+# - 인덱스: 정점 수가 65535 미만이면 uint32 → uint16
+# - 내장 텍스처: 최대 변 길이로 축소 후 JPEG(알파가 있으면 PNG)로 재압축, 작아질 때만 교체
+# 목표 용량(max_bytes)을 주면 JPEG 품질 → 텍스처 크기 순으로 낮추며 들어갈 때까지 다시 만든다.
+# 처리할 수 없는 구성(외부 버퍼, Draco 등 다른 필수 확장)은 원본을 그대로 둔다.
+
+TEXTURE_MAX_SIZE = int(os.getenv("GLB_TEXTURE_MAX_SIZE", "0"))  # 0 이면 원본 크기 유지
+JPEG_QUALITY = int(os.getenv("GLB_JPEG_QUALITY", "85"))
+MIN_JPEG_QUALITY = 55      # 목표 용량 맞출 때 내려갈 최저 품질
+MIN_TEXTURE_SIZE = 256     # 목표 용량 맞출 때 내려갈 최저 텍스처 크기
+QUALITY_STEP = 15
+
+_GLB_MAGIC = 0x46546C67
+_CHUNK_JSON = 0x4E4F534A
+_CHUNK_BIN = 0x004E4942
+
+_COMPONENT_DTYPES = {
+    5120: np.int8, 5121: np.uint8, 5122: np.int16,
+    5123: np.uint16, 5125: np.uint32, 5126: np.float32,
+}
+_DTYPE_COMPONENTS = {np.dtype(dtype): code for code, dtype in _COMPONENT_DTYPES.items()}
+_TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+
+_ARRAY_BUFFER = 34962
+_ELEMENT_ARRAY_BUFFER = 34963
+
+_SUPPORTED_EXTENSIONS = {"KHR_mesh_quantization", "KHR_materials_unlit", "KHR_texture_transform"}
+
+
+# ---------------------------
+# GLB 읽기 / 쓰기
+# ---------------------------
+
+def read_glb(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, _, length = struct.unpack_from("<III", data, 0)
+    if magic != _GLB_MAGIC:
+        raise ValueError(f"GLB 파일이 아닙니다: {path}")
+    offset = 12
+    gltf, binary = None, b""
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == _CHUNK_JSON:
+            gltf = json.loads(chunk.decode("utf-8"))
+        elif chunk_type == _CHUNK_BIN:
+            binary = chunk
+        offset += 8 + chunk_length
+    return gltf, binary
+
+
+def pack_glb(gltf: dict, binary: bytes) -> bytes:
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    binary += b"\x00" * (-len(binary) % 4)
+    length = 12 + 8 + len(json_chunk) + (8 + len(binary) if binary else 0)
+    parts = [struct.pack("<III", _GLB_MAGIC, 2, length), struct.pack("<II", len(json_chunk), _CHUNK_JSON), json_chunk]
+    if binary:
+        parts += [struct.pack("<II", len(binary), _CHUNK_BIN), binary]
+    return b"".join(parts)
+
+
+def _read_accessor(gltf: dict, binary: bytes, accessor: dict) -> np.ndarray:
+    dtype = np.dtype(_COMPONENT_DTYPES[accessor["componentType"]])
+    width = _TYPE_SIZES[accessor["type"]]
+    count = accessor["count"]
+    if "bufferView" not in accessor:
+        return np.zeros((count, width), dtype)
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    stride = view.get("byteStride") or dtype.itemsize * width
+    array = np.ndarray((count, width), dtype, buffer=binary, offset=offset, strides=(stride, dtype.itemsize))
+    return array.copy()
+
+
+def _can_rewrite(gltf: dict) -> bool:
+    if len(gltf.get("buffers", [])) != 1 or "uri" in gltf["buffers"][0]:
+        return False
+    if set(gltf.get("extensionsRequired", [])) - _SUPPORTED_EXTENSIONS:
+        return False
+    if any("sparse" in accessor for accessor in gltf.get("accessors", [])):
+        return False
+    return True
+
+
+# ---------------------------
+# 양자화
+# ---------------------------
+
+def _trs_matrix(node: dict) -> np.ndarray:
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4, order="F")
+    tx, ty, tz = node.get("translation", [0, 0, 0])
+    x, y, z, w = node.get("rotation", [0, 0, 0, 1])
+    sx, sy, sz = node.get("scale", [1, 1, 1])
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array([sx, sy, sz])
+    matrix[:3, 3] = [tx, ty, tz]
+    return matrix
+
+
+def _quantizable_meshes(gltf: dict) -> set:
+    # 노드 행렬에 역양자화를 합쳐도 안전한 메시: 자식/스킨/애니메이션이 없는 노드에서만 쓰이고 모프 타깃이 없음
+    if gltf.get("animations"):
+        return set()
+    usable, blocked = set(), set()
+    for node in gltf.get("nodes", []):
+        if "mesh" not in node:
+            continue
+        (blocked if node.get("children") or "skin" in node else usable).add(node["mesh"])
+    position_owner = {}
+    for mesh_index, mesh in enumerate(gltf.get("meshes", [])):
+        for primitive in mesh["primitives"]:
+            if primitive.get("targets"):
+                blocked.add(mesh_index)
+            position = primitive["attributes"].get("POSITION")
+            if position is not None and position_owner.setdefault(position, mesh_index) != mesh_index:
+                blocked.update((mesh_index, position_owner[position]))
+    return usable - blocked
+
+
+def _quantize_attributes(gltf: dict, arrays: dict, roles: dict) -> bool:
+    # arrays: accessor index → numpy 배열 (제자리 교체), roles: accessor index → 쓰임새
+    quantizable = _quantizable_meshes(gltf)
+    mesh_transforms = {}
+    for mesh_index in quantizable:
+        positions = [
+            arrays[primitive["attributes"]["POSITION"]]
+            for primitive in gltf["meshes"][mesh_index]["primitives"]
+            if "POSITION" in primitive["attributes"]
+        ]
+        if not positions:
+            continue
+        stacked = np.concatenate(positions).astype(np.float64)
+        low, high = stacked.min(axis=0), stacked.max(axis=0)
+        center = (low + high) / 2
+        scale = float(max((high - low).max() / 2, 1e-12))
+        mesh_transforms[mesh_index] = (center, scale)
+        for primitive in gltf["meshes"][mesh_index]["primitives"]:
+            index = primitive["attributes"].get("POSITION")
+            if index is not None and roles.get(index) != "quantized":
+                values = (arrays[index].astype(np.float64) - center) / scale
+                arrays[index] = np.clip(np.round(values * 32767), -32767, 32767).astype(np.int16)
+                roles[index] = "quantized"
+                gltf["accessors"][index]["normalized"] = True
+
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh["primitives"]:
+            for name, index in primitive["attributes"].items():
+                if roles.get(index) == "quantized" or arrays[index].dtype != np.float32:
+                    continue
+                values = arrays[index]
+                if name == "NORMAL":
+                    arrays[index] = np.clip(np.round(values * 127), -127, 127).astype(np.int8)
+                elif name.startswith("TEXCOORD_") and values.size and values.min() >= 0 and values.max() <= 1:
+                    arrays[index] = np.round(values * 65535).astype(np.uint16)
+                else:
+                    continue
+                roles[index] = "quantized"
+                gltf["accessors"][index]["normalized"] = True
+
+    # 메시를 참조하는 노드 행렬에 오프셋/스케일을 합친다
+    for node in gltf.get("nodes", []):
+        transform = mesh_transforms.get(node.get("mesh"))
+        if transform is None:
+            continue
+        center, scale = transform
+        dequantize = np.eye(4)
+        dequantize[:3, :3] *= scale
+        dequantize[:3, 3] = center
+        matrix = _trs_matrix(node) @ dequantize
+        for key in ("translation", "rotation", "scale"):
+            node.pop(key, None)
+        node["matrix"] = [float(value) for value in matrix.flatten(order="F")]
+    return any(role == "quantized" for role in roles.values())
+
+
+# ---------------------------
+# 텍스처
+# ---------------------------
+
+def _encode_image(image: Image.Image, max_size: int, quality: int):
+    if max_size and max(image.size) > max_size:
+        ratio = max_size / max(image.size)
+        image = image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))), Image.LANCZOS)
+    out = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") and image.getchannel("A").getextrema()[0] < 255
+    if has_alpha:
+        image.save(out, format="PNG", optimize=True)
+        return out.getvalue(), "image/png"
+    image.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+
+# ---------------------------
+# 재조립
+# ---------------------------
+
+def _rebuild(gltf: dict, binary: bytes, images: dict, quantize: bool, max_texture: int, quality: int):
+    gltf = json.loads(json.dumps(gltf))
+    accessors = gltf.get("accessors", [])
+    arrays = {index: _read_accessor(gltf, binary, accessor) for index, accessor in enumerate(accessors)}
+    roles = {}
+    attribute_accessors, index_accessors = set(), set()
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh["primitives"]:
+            attribute_accessors.update(primitive["attributes"].values())
+            for target in primitive.get("targets", []):
+                attribute_accessors.update(target.values())
+            if "indices" in primitive:
+                index_accessors.add(primitive["indices"])
+
+    quantized = _quantize_attributes(gltf, arrays, roles) if quantize else False
+    for index in index_accessors:
+        values = arrays[index]
+        if values.dtype == np.uint32 and values.size and values.max() < 65535:
+            arrays[index] = values.astype(np.uint16)
+
+    chunks, views, offset = [], [], 0
+
+    def append(data: bytes, **view):
+        nonlocal offset
+        padding = -offset % 4
+        if padding:
+            chunks.append(b"\x00" * padding)
+            offset += padding
+        chunks.append(data)
+        views.append(dict(buffer=0, byteOffset=offset, byteLength=len(data), **view))
+        offset += len(data)
+        return len(views) - 1
+
+    for index, accessor in enumerate(accessors):
+        if "bufferView" not in accessor:
+            continue
+        values = arrays[index]
+        accessor["componentType"] = _DTYPE_COMPONENTS[values.dtype]
+        accessor.pop("byteOffset", None)
+        view = {}
+        if index in attribute_accessors:
+            view["target"] = _ARRAY_BUFFER
+            element = values.dtype.itemsize * values.shape[1]
+            if element % 4:
+                # 정점 속성 요소는 4 바이트 경계에 맞춰야 하므로 패딩 열을 붙이고 stride 지정
+                pad = (-element % 4) // values.dtype.itemsize
+                values = np.hstack([values, np.zeros((len(values), pad), values.dtype)])
+                view["byteStride"] = element + (-element % 4)
+        elif index in index_accessors:
+            view["target"] = _ELEMENT_ARRAY_BUFFER
+        if ("min" in accessor or roles.get(index) == "quantized") and len(arrays[index]):
+            # min/max 는 저장된 (양자화된) 값 기준
+            accessor["min"] = arrays[index].min(axis=0).tolist()
+            accessor["max"] = arrays[index].max(axis=0).tolist()
+        accessor["bufferView"] = append(np.ascontiguousarray(values).tobytes(), **view)
+
+    largest = 0
+    for index, image_info in enumerate(gltf.get("images", [])):
+        if "bufferView" not in image_info:
+            continue
+        original_bytes, mime_type, image = images[index]
+        data = original_bytes
+        if image is not None:
+            largest = max(largest, *image.size)
+            encoded, encoded_type = _encode_image(image, max_texture, quality)
+            if len(encoded) < len(original_bytes) or (max_texture and max(image.size) > max_texture):
+                data, mime_type = encoded, encoded_type
+        image_info["bufferView"] = append(data)
+        image_info["mimeType"] = mime_type
+
+    gltf["bufferViews"] = views
+    gltf["buffers"] = [{"byteLength": offset}]
+    if quantized:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            extensions = gltf.setdefault(key, [])
+            if "KHR_mesh_quantization" not in extensions:
+                extensions.append("KHR_mesh_quantization")
+    return pack_glb(gltf, b"".join(chunks)), largest
+
+
+def _load_images(gltf: dict, binary: bytes) -> dict:
+    images = {}
+    for index, image_info in enumerate(gltf.get("images", [])):
+        if "bufferView" not in image_info:
+            continue
+        view = gltf["bufferViews"][image_info["bufferView"]]
+        start = view.get("byteOffset", 0)
+        data = binary[start:start + view["byteLength"]]
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception:
+            image = None
+        images[index] = (data, image_info.get("mimeType", "image/png"), image)
+    return images
+
+
+def compact_glb(src_path: str, dst_path: str, max_bytes: int = 0, max_texture: int = TEXTURE_MAX_SIZE,
+                quality: int = JPEG_QUALITY, quantize: bool = True) -> dict:
+    # 반환: 전/후 크기, 소요 시간, 최종 텍스처 크기/품질, 목표 용량 충족 여부
+    started = time.perf_counter()
+    before = os.path.getsize(src_path)
+    try:
+        gltf, binary = read_glb(src_path)
+    except (ValueError, struct.error):
+        gltf, binary = None, b""
+    report = {"before_bytes": before, "quantized": False, "texture_max": max_texture, "jpeg_quality": quality}
+
+    if gltf is None or not _can_rewrite(gltf):
+        data = None
+    else:
+        images = _load_images(gltf, binary)
+        while True:
+            data, largest = _rebuild(gltf, binary, images, quantize, max_texture, quality)
+            if not max_bytes or len(data) <= max_bytes:
+                break
+            # 품질을 먼저 낮추고, 그래도 크면 텍스처 변 길이를 절반씩 줄인다
+            if quality - QUALITY_STEP >= MIN_JPEG_QUALITY:
+                quality -= QUALITY_STEP
+            elif largest and (max_texture or largest) // 2 >= MIN_TEXTURE_SIZE:
+                max_texture = (max_texture or largest) // 2
+            else:
+                break
+        report.update(quantized=quantize, texture_max=max_texture, jpeg_quality=quality)
+
+    if data is None or len(data) >= before:
+        # 줄어들지 않으면 원본 유지
+        if src_path != dst_path:
+            with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+                dst.write(src.read())
+        after = before
+        report["quantized"] = False
+    else:
+        with open(dst_path, "wb") as f:
+            f.write(data)
+        after = len(data)
+
+    report.update(
+        after_bytes=after,
+        ratio=round(after / before, 4) if before else 1.0,
+        within_budget=not max_bytes or after <= max_bytes,
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    return report
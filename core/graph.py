@@ -0,0 +1,149 @@
+import json
+import logging
+import threading
+
+# =========================
+# 워크플로우 그래프 최적화 (출력 기준 가지치기)
+# =========================
+# 요청에 실제로 필요한 출력 노드에서 시작해 입력 링크([node_id, output_index])를 거꾸로 따라가며
+# 결과에 기여하지 않는 노드(PreviewImage, MaskPreview+, 부가 export 등)를 제거한다.
+# 입력을 그대로 돌려주는 미리보기 노드는 소비자의 링크를 원래 입력으로 바꿔 달아 건너뛴다.
+
+# class_type -> 그대로 통과시키는 입력 이름
+PASSTHROUGH_NODES = {
+    "AILab_ImagePreview": "image",
+}
+
+EMA_ALPHA = 0.2  # 노드 실행 시간 지수이동평균 가중치
+
+logger = logging.getLogger(__name__)
+
+
+def _is_link(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def _resolve(graph: dict, link: list) -> list:
+    # 통과 노드를 따라 올라가 실제 출처 링크를 찾는다
+    seen = set()
+    while True:
+        node = graph.get(link[0])
+        if node is None or link[0] in seen:
+            return link
+        passthrough = PASSTHROUGH_NODES.get(node.get("class_type"))
+        source = node["inputs"].get(passthrough) if passthrough else None
+        if not _is_link(source):
+            return link
+        seen.add(link[0])
+        link = source
+
+
+def prune_graph(graph: dict, keep) -> tuple:
+    # 반환: (가지치기된 그래프, 제거된 노드 id 목록)
+    # 원본 그래프/노드는 수정하지 않으며, 링크가 바뀌는 노드만 새 dict 로 만든다
+    rewired = {}
+    for node_id, node in graph.items():
+        inputs = node["inputs"]
+        changed = None
+        for name, value in inputs.items():
+            if _is_link(value):
+                target = _resolve(graph, value)
+                if target is not value:
+                    changed = changed or dict(inputs)
+                    changed[name] = target
+        rewired[node_id] = dict(node, inputs=changed) if changed else node
+
+    needed = set()
+    stack = [node_id for node_id in keep if node_id in rewired]
+    while stack:
+        node_id = stack.pop()
+        if node_id in needed:
+            continue
+        needed.add(node_id)
+        for value in rewired[node_id]["inputs"].values():
+            if _is_link(value) and value[0] in rewired:
+                stack.append(value[0])
+
+    pruned = {node_id: node for node_id, node in rewired.items() if node_id in needed}
+    removed = [node_id for node_id in graph if node_id not in needed]
+    return pruned, removed
+
+
+# ---------------------------
+# 노드 실행 시간 모델 (절감 시간 추정용)
+# ---------------------------
+
+class NodeCostModel:
+    # 가지치기하지 않은 실행에서 관측한 노드별 실행 시간으로 제거된 노드의 절감 시간을 추정한다
+    # 가지치기가 켜져 있으면 제거된 노드는 실행되지 않으므로 WorkflowRegistry.cost_sample 이 가끔 원본 그래프로 실행해 표본을 모은다
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._costs = {}  # (워크플로우 이름, node_id) -> 평균 실행 시간(초)
+
+    def observe(self, workflow_name: str, durations: dict):
+        with self._lock:
+            for node_id, seconds in durations.items():
+                key = (workflow_name, node_id)
+                previous = self._costs.get(key)
+                self._costs[key] = seconds if previous is None else previous + EMA_ALPHA * (seconds - previous)
+
+    def estimate(self, workflow_name: str, node_ids) -> float:
+        # 관측된 적 없는 노드는 0 으로 계산
+        with self._lock:
+            return sum(self._costs.get((workflow_name, node_id), 0.0) for node_id in node_ids)
+
+    def known(self, workflow_name: str, node_ids) -> int:
+        with self._lock:
+            return sum(1 for node_id in node_ids if (workflow_name, node_id) in self._costs)
+
+
+node_costs = NodeCostModel()
+
+
+def report_pruning(workflow, durations: dict):
+    # 템플릿에서 렌더링된 워크플로우의 가지치기 결과와 추정 절감 시간
+    template = getattr(workflow, "template", None)
+    if template is None:
+        return None
+    node_costs.observe(template.name, durations)
+    report = {"workflow": template.name, "removed_nodes": template.removed}
+    if not template.removed:
+        report["unpruned"] = True  # 원본 그래프 실행 (비용 표본 또는 PRUNE_WORKFLOWS=0)
+    return _with_estimate(report, template.name, template.removed)
+
+
+def report_variant(workflow):
+    # 변형 템플릿(예: 입력 알파를 재사용해 배경 제거를 건너뛰는 *_alpha)이 기본 워크플로우 대비 아낀 시간 추정
+    # 기본 워크플로우에서 관측된 대체 노드 비용 - 변형이 새로 넣은 노드의 관측 비용 (report_pruning 이후 호출)
+    template = getattr(workflow, "template", None)
+    if template is None or not template.variant_of:
+        return None
+    report = {"workflow": template.name, "variant_of": template.variant_of, "skipped_nodes": template.replaces}
+    report = _with_estimate(report, template.variant_of, template.replaces)
+    if "estimated_saved_sec" in report:
+        added = node_costs.estimate(template.name, template.added)
+        report["estimated_saved_sec"] = round(max(0.0, report["estimated_saved_sec"] - added), 3)
+    return report
+
+
+def _with_estimate(report: dict, workflow_name: str, node_ids) -> dict:
+    # 관측된 적 있는 노드가 하나도 없으면 추정치를 싣지 않는다 (0 으로 보이지 않게)
+    known = node_costs.known(workflow_name, node_ids)
+    if known:
+        report["estimated_saved_sec"] = round(node_costs.estimate(workflow_name, node_ids), 3)
+        report["estimated_nodes"] = f"{known}/{len(node_ids)}"
+    return report
+
+
+def report_workflow(workflow, durations: dict) -> dict:
+    # 가지치기/변형 리포트를 모아 디버그 로그 한 줄로 남기고 작업 info 에 넣을 dict 로 반환
+    reports = {}
+    pruning = report_pruning(workflow, durations)
+    if pruning:
+        reports["pruning"] = pruning
+    variant = report_variant(workflow)
+    if variant:
+        reports["variant"] = variant
+    if reports:
+        logger.debug("[PRUNE] %s", json.dumps(reports, ensure_ascii=False))
+    return reports
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+
+from core.tracing import trace_headers
+
+# =========================
+# 장기 HTTP 클라이언트 (봇 → 백엔드 서버)
+# =========================
+# 서버(프롬프트 변환, MV, Hy3D)마다 세션/커넥션 풀을 하나씩 두고 요청마다 재사용한다.
+# - 단계별 타임아웃: 호출 시 timeout 으로 지정 (기본값은 클라이언트 생성 시)
+# - 재시도: 멱등 요청(idempotent=True)만 지수 백오프 + 지터로 재시도
+# - 서킷 브레이커: 연속 실패가 BREAKER_THRESHOLD 를 넘으면 BREAKER_COOLDOWN 초 동안 요청을 보내지 않고 즉시 실패,
+#   쿨다운이 지나면 요청 하나만 시험으로 보내 성공하면 닫는다 (복구 중인 GPU 서버에 재시도가 몰리지 않게)
+# 연결 오류, 타임아웃, 5xx 응답을 실패로 본다. 4xx 는 요청 문제이므로 재시도/실패 집계하지 않는다.
+# 5xx 가 아닌 응답은 본문까지 다 읽은 뒤에 성공으로 기록한다. 본문 수신 실패와 JSON 이 아닌 2xx 본문은 실패로 보고,
+# 결과 없이 끝난 시험 요청(취소, 예상 밖 예외)은 시험 자리를 돌려준다.
+# 현재 trace 가 있으면 X-Trace-Id 헤더를 붙여 서버 쪽 span 과 이어지게 한다.
+
+RETRIES = int(os.getenv("BOT_HTTP_RETRIES", "3"))                      # 멱등 요청 최대 시도 횟수
+RETRY_BACKOFF = float(os.getenv("BOT_HTTP_RETRY_BACKOFF", "0.5"))       # 백오프 기본 간격(초)
+BREAKER_THRESHOLD = int(os.getenv("BOT_BREAKER_THRESHOLD", "5"))        # 서킷을 여는 연속 실패 수
+BREAKER_COOLDOWN = float(os.getenv("BOT_BREAKER_COOLDOWN", "30"))       # 서킷이 열려 있는 시간(초)
+POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE", "8"))                   # 서버당 최대 동시 연결 수
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class ServiceUnavailable(RuntimeError):
+    # 서킷이 열려 요청을 보내지 않았거나, 재시도 후에도 서버가 응답하지 않은 경우
+    def __init__(self, service: str, message: str):
+        super().__init__(message)
+        self.service = service
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False  # half-open 상태에서 시험 요청이 나가 있는지
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def release_trial(self):
+        # 시험 요청이 성공/실패 판정 없이 끝남 → 다음 요청이 다시 시험할 수 있게
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            # half-open 시험이 실패하면 쿨다운을 다시 시작
+            self.opened_at = time.monotonic()
+
+
+class ServiceClient:
+    def __init__(self, name: str, base_url: str, timeout: float = 30, retries: int = RETRIES):
+        self.name = name
+        self.base_url = base_url or ""
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.breaker = CircuitBreaker()
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 이벤트 루프 안에서 처음 쓸 때 만든다
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=POOL_SIZE))
+        return self._session
+
+    def url(self, path: str) -> str:
+        if path.startswith("http"):
+            return path
+        return f"{self.base_url.rstrip('/')}{path}" if path else self.base_url
+
+    async def request(self, method: str, path: str, *, timeout: float = None, idempotent: bool = False,
+                      expect=(200,), read: str = "json", **kwargs):
+        # read: "json" | "bytes" — 응답 본문을 읽어 돌려준다. expect 에 없는 4xx 는 ClientResponseError
+        attempts = self.retries if idempotent else 1
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        kwargs["headers"] = {**trace_headers(), **(kwargs.get("headers") or {})}
+        last_error = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise ServiceUnavailable(
+                    self.name, f"{self.name} 서버 응답 없음 (약 {int(self.breaker.retry_after()) + 1}초 후 재시도)"
+                )
+            settled = False  # 서킷 브레이커에 성공/실패를 기록했는지
+            try:
+                async with self._get_session().request(method, self.url(path), timeout=client_timeout, **kwargs) as resp:
+                    if resp.status >= 500:
+                        raise aiohttp.ClientResponseError(
+                            resp.request_info, resp.history, status=resp.status, message=resp.reason
+                        )
+                    # 본문을 끝까지 받아야 성공 (이후 json()/text() 는 읽어 둔 본문을 쓴다)
+                    body = await resp.read()
+                    if resp.status not in expect:
+                        # 응답이 왔으면 서버는 살아 있다 (4xx 는 요청 쪽 문제)
+                        self.breaker.record_success()
+                        settled = True
+                        raise aiohttp.ClientResponseError(
+                            resp.request_info, resp.history, status=resp.status, message=(await resp.text())[:200]
+                        )
+                    if read == "json":
+                        try:
+                            body = await resp.json(content_type=None)
+                        except ValueError as e:
+                            raise aiohttp.ClientPayloadError(f"JSON 이 아닌 응답 본문 (HTTP {resp.status}): {e}") from e
+                self.breaker.record_success()
+                settled = True
+                return body
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    raise
+                last_error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+            finally:
+                if not settled:
+                    self.breaker.release_trial()
+            self.breaker.record_failure()
+            if attempt + 1 < attempts:
+                # 지수 백오프 + full jitter
+                await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * (2 ** attempt)))
+        reason = f"HTTP {last_error.status}" if isinstance(last_error, aiohttp.ClientResponseError) else type(last_error).__name__
+        raise ServiceUnavailable(self.name, f"{self.name} 서버 요청 실패 ({reason})")
+
+    async def get_json(self, path: str, **kwargs):
+        return await self.request("GET", path, idempotent=True, **kwargs)
+
+    async def post_json(self, path: str, payload=None, **kwargs):
+        return await self.request("POST", path, json=payload, **kwargs)
+
+    async def download(self, path: str, dst: str, timeout: float = None):
+        data = await self.request("GET", path, idempotent=True, timeout=timeout, read="bytes")
+        # 수 MB 짜리 GLB/이미지 쓰기가 봇 이벤트 루프를 막지 않도록 스레드에서
+        await asyncio.to_thread(_write_file, dst, data)
+        return dst
+
+    def stats(self) -> dict:
+        return {
+            "service": self.name,
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 1),
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
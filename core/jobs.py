@@ -0,0 +1,268 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from core.comfy_client import get_client
+from core.progress import JobProgress, sse_message
+from core.tracing import current_trace
+
+# =========================
+# 비동기 작업(Job) 저장소
+# =========================
+# POST /jobs/... 로 제출된 워크플로우를 백그라운드 asyncio 태스크로 실행하고,
+# 상태(status)/단계(stage)/결과(outputs)를 GET /jobs/{id} 로 조회할 수 있게 보관한다.
+# 실행 중인 노드/스텝/미리보기는 GET /jobs/{id}/events (Server-Sent Events) 로 바뀔 때마다 받을 수 있다.
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+JOB_TTL = 3600       # 끝난 작업을 보관하는 시간(초)
+MAX_FINISHED = 1000  # 끝난 작업을 보관하는 최대 개수
+KEEPALIVE_INTERVAL = 15  # SSE 스트림에 변화가 없을 때 연결 유지용 주석을 보내는 간격(초)
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.outputs = None
+        self.partial = {}  # 완료 전에 먼저 나온 중간 결과 (예: 텍스처 전 메시)
+        self.error = None
+        self.prompt_id = None
+        self.comfy_ip = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.task = None
+        self.info = {}  # 가지치기 결과 등 부가 정보
+        self.trace = None  # 제출한 요청의 trace (단계별 소요 시간)
+        self.progress = JobProgress(self.notify)  # 현재 노드 / 스텝 / 미리보기
+        self.version = 0  # 상태가 바뀔 때마다 증가 (SSE 구독자가 놓친 변화 확인용)
+        self._change_waiters = []
+
+    def attach_prompt(self, prompt_id: str, comfy_ip: str, workflow=None):
+        # workflow 를 주면 진행 상황에 노드 이름과 전체 노드 수가 함께 나온다
+        self.detach_progress()
+        self.prompt_id = prompt_id
+        self.comfy_ip = comfy_ip
+        self.progress.start(workflow)
+        get_client(comfy_ip).watch_progress(prompt_id, self.progress.handle)
+        self.set_stage("executing")
+
+    def detach_progress(self):
+        if self.prompt_id:
+            get_client(self.comfy_ip).unwatch_progress(self.prompt_id)
+
+    def add_partial(self, name: str, value):
+        self.partial[name] = value
+        self.updated_at = time.time()
+        self.notify()
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        self.updated_at = time.time()
+        self.notify()
+
+    # ---------------------------
+    # 변경 알림 (SSE 스트림)
+    # ---------------------------
+
+    def notify(self):
+        self.version += 1
+        for future in self._change_waiters:
+            if not future.done():
+                future.set_result(None)
+        self._change_waiters.clear()
+
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        # version 이후 변화가 있으면 True, timeout 동안 없으면 False
+        if self.version != version:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self._change_waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if future in self._change_waiters:
+                self._change_waiters.remove(future)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "outputs": self.outputs,
+            "partial": self.partial,
+            "error": self.error,
+            "prompt_id": self.prompt_id,
+            "backend": self.comfy_ip,
+            "info": self.info,
+            "progress": self.progress.to_dict(),
+            "trace_id": self.trace.trace_id if self.trace is not None else None,
+            "timings": self.trace.summary() if self.trace is not None else {},
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobStore:
+    def __init__(self, ttl: float = JOB_TTL, max_finished: int = MAX_FINISHED):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+
+    def submit(self, kind: str, runner) -> Job:
+        # runner: job 을 인자로 받아 결과 dict 를 돌려주는 코루틴 함수
+        self._evict()
+        job = Job(kind)
+        job.trace = current_trace()
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, runner))
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status not in FINISHED_STATES and job.task is not None:
+            job.task.cancel()
+            try:
+                await job.task
+            except (asyncio.CancelledError, Exception):
+                pass
+            # ComfyUI 대기열/실행 중인 prompt 도 함께 정리
+            if job.prompt_id:
+                try:
+                    await get_client(job.comfy_ip).cancel_prompt(job.prompt_id)
+                except Exception:
+                    pass
+        return job
+
+    def active_counts(self) -> dict:
+        # (kind, status) -> 아직 끝나지 않은 작업 수 (지표용)
+        counts = {}
+        for job in self._jobs.values():
+            if job.status not in FINISHED_STATES:
+                counts[(job.kind, job.status)] = counts.get((job.kind, job.status), 0) + 1
+        return counts
+
+    def remove(self, job_id: str):
+        return self._jobs.pop(job_id, None)
+
+    async def _run(self, job: Job, runner):
+        job.status = RUNNING
+        job.set_stage(RUNNING)
+        try:
+            job.outputs = await runner(job)
+            job.status = COMPLETED
+            job.set_stage(COMPLETED)
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            job.set_stage(CANCELLED)
+        except Exception as e:
+            job.status = FAILED
+            job.error = getattr(e, "detail", None) or str(e)
+            job.set_stage(FAILED)
+        finally:
+            job.detach_progress()
+
+    def _evict(self):
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+        overflow = len(finished) - self.max_finished
+        for job in finished:
+            if overflow > 0 or now - job.updated_at > self.ttl:
+                self._jobs.pop(job.id, None)
+                overflow -= 1
+
+
+# ---------------------------
+# 진행 상황 스트림 (Server-Sent Events)
+# ---------------------------
+
+async def job_events(job: Job, request: Request, previews: bool = True):
+    # 바뀐 것만 보낸다: status (상태/단계/중간 결과), progress (노드, 스텝 k/N), preview (축소 JPEG data URL)
+    # 작업이 끝나면 done 으로 전체 작업 정보를 보내고 스트림을 닫는다
+    last = {}
+    while True:
+        version = job.version
+        status = {"status": job.status, "stage": job.stage, "partial": dict(job.partial), "error": job.error}
+        if status != last.get("status"):
+            last["status"] = status
+            yield sse_message("status", status)
+        progress = job.progress.to_dict()
+        if progress != last.get("progress"):
+            last["progress"] = progress
+            yield sse_message("progress", progress)
+        if previews and job.progress.preview is not None and job.progress.preview_seq != last.get("preview_seq"):
+            last["preview_seq"] = job.progress.preview_seq
+            yield sse_message("preview", job.progress.preview_message())
+        if job.status in FINISHED_STATES:
+            yield sse_message("done", job.to_dict())
+            return
+        if await request.is_disconnected():
+            return
+        if not await job.wait_for_change(version, KEEPALIVE_INTERVAL):
+            yield ": keepalive\n\n"
+
+
+# ---------------------------
+# 공용 조회/취소 라우터
+# ---------------------------
+
+def create_job_router(store: JobStore) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        job = store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+        # 제출 요청의 단계별 소요 시간을 Server-Timing 헤더로도 내려준다
+        headers = {"Server-Timing": job.trace.server_timing()} if job.trace is not None and job.trace.spans else None
+        return JSONResponse(job.to_dict(), headers=headers)
+
+    @router.get("/jobs/{job_id}/events")
+    async def stream_job(job_id: str, request: Request, previews: bool = True):
+        job = store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+        # 프록시(nginx 등)가 이벤트를 모아 두지 않도록 버퍼링을 끈다
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(job_events(job, request, previews), media_type="text/event-stream", headers=headers)
+
+    @router.get("/jobs/{job_id}/preview")
+    async def get_job_preview(job_id: str):
+        job = store.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+        if job.progress.preview is None:
+            raise HTTPException(status_code=404, detail="아직 미리보기가 없습니다.")
+        return Response(job.progress.preview, media_type="image/jpeg", headers={"Cache-Control": "no-store"})
+
+    @router.delete("/jobs/{job_id}")
+    async def delete_job(job_id: str):
+        job = await store.cancel(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="작업을 찾을 수 없습니다.")
+        store.remove(job_id)
+        return job.to_dict()
+
+    return router
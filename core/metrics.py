@@ -0,0 +1,247 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.backends import backend_states
+from core.tracing import record_span
+
+# =========================
+# Prometheus 텍스트 형식 지표
+# =========================
+# 외부 라이브러리 없이 히스토그램/카운터/게이지를 메모리에 모아 GET /metrics 로 내보낸다.
+# 기록은 dict 조회 + 버킷 이분 탐색 한 번뿐이라 요청 경로에 부담이 없고,
+# 대기열 깊이처럼 이미 다른 곳에 있는 값은 스크랩할 때 콜백으로 읽는다.
+#
+# ComfyUI 단계(stage 라벨):
+#   upload     - 입력 이미지를 ComfyUI /upload/image 로 전송
+#   submit     - POST /prompt
+#   queue_wait - 제출 후 ComfyUI 가 실행을 시작할 때까지 (대기열 + 모델 로드 대기)
+#   execution  - 실행 시작부터 완료 이벤트까지
+#   retrieval  - history/ /view 로 결과 파일을 받아 저장
+# 응답 전송 시간은 미들웨어가 첫 응답 바이트부터 마지막 바이트까지 잰다.
+# 같은 구간은 현재 요청 trace 에도 span 으로 남는다 (core/tracing.py).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # 라벨 값 -> [버킷별 개수(+Inf 포함), 합계, 개수]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    # fn 이 주어지면 스크랩할 때 {라벨 값 튜플: 값} 을 받아 내보낸다
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def render(self):
+        values = self.fn() if self.fn is not None else self._values
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 콜백 게이지 하나가 실패해도 나머지 지표는 내보낸다
+                lines.append(f"# {metric.name} 수집 실패: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+comfy_stage_seconds = registry.register(Histogram(
+    "comfy_stage_seconds", "ComfyUI 단계별 소요 시간(초)", ("stage", "endpoint", "backend")
+))
+comfy_errors_total = registry.register(Counter(
+    "comfy_errors_total", "ComfyUI 단계별 오류 수", ("stage", "endpoint", "backend")
+))
+response_stream_seconds = registry.register(Histogram(
+    "http_response_stream_seconds", "응답 첫 바이트부터 마지막 바이트까지 전송 시간(초)", ("endpoint", "method")
+))
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP 요청 수 (응답 코드별)", ("endpoint", "method", "status")
+))
+
+
+@contextmanager
+def track(stage: str, endpoint: str, backend: str):
+    # with track("submit", "text2img", ip): ... → 성공 시 소요 시간, 예외 시 오류 수 기록
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        comfy_errors_total.inc(stage, endpoint, backend)
+        record_span(f"{endpoint}.{stage}", started, time.monotonic(), endpoint=endpoint, backend=backend, error=type(e).__name__)
+        raise
+    ended = time.monotonic()
+    comfy_stage_seconds.observe(ended - started, stage, endpoint, backend)
+    record_span(f"{endpoint}.{stage}", started, ended, endpoint=endpoint, backend=backend)
+
+
+@contextmanager
+def count_errors(stage: str, endpoint: str, backend: str):
+    try:
+        yield
+    except Exception:
+        comfy_errors_total.inc(stage, endpoint, backend)
+        raise
+
+
+def observe_execution(endpoint: str, backend: str, submitted_at: float, started_at=None):
+    # 제출 시각 ~ 실행 시작 ~ 지금(완료)을 queue_wait / execution 으로 나눠 기록 (time.monotonic 기준)
+    # 시작 이벤트를 놓쳤으면 전체를 queue_wait 로 본다
+    done_at = time.monotonic()
+    started_at = min(max(started_at or done_at, submitted_at), done_at)
+    comfy_stage_seconds.observe(started_at - submitted_at, "queue_wait", endpoint, backend)
+    comfy_stage_seconds.observe(done_at - started_at, "execution", endpoint, backend)
+    record_span(f"{endpoint}.queue_wait", submitted_at, started_at, endpoint=endpoint, backend=backend)
+    record_span(f"{endpoint}.execution", started_at, done_at, endpoint=endpoint, backend=backend)
+
+
+# ---------------------------
+# 스크랩 시점 게이지 (잡 저장소, 백엔드 풀)
+# ---------------------------
+
+def register_job_gauges(store):
+    registry.register(Gauge(
+        "jobs_inflight", "아직 끝나지 않은 작업 수", ("kind", "status"), fn=store.active_counts
+    ))
+
+
+def register_backend_gauges():
+    def queue_depth():
+        values = {}
+        for backend in backend_states():
+            values[(backend.ip, "running")] = backend.queue_running
+            values[(backend.ip, "pending")] = backend.queue_pending
+        return values
+
+    registry.register(Gauge(
+        "comfy_queue_depth", "ComfyUI /queue 깊이 (마지막 폴링 값)", ("backend", "state"), fn=queue_depth
+    ))
+    registry.register(Gauge(
+        "comfy_prompts_inflight", "이 서버가 배정했고 아직 끝나지 않은 prompt 수", ("backend",),
+        fn=lambda: {(backend.ip,): backend.inflight for backend in backend_states()}
+    ))
+    registry.register(Gauge(
+        "comfy_backend_healthy", "백엔드 정상 여부 (1/0)", ("backend",),
+        fn=lambda: {(backend.ip,): int(backend.healthy) for backend in backend_states()}
+    ))
+
+
+# ---------------------------
+# ASGI 미들웨어 / 라우터
+# ---------------------------
+
+class MetricsMiddleware:
+    # 라우팅 후 scope["route"] 의 경로 템플릿을 라벨로 써서 /jobs/{job_id} 같은 경로가 하나로 묶이게 한다
+    # 응답 본문 전송이 끝날 때 한 번만 기록하므로 스트리밍 응답(FileResponse)의 전송 시간도 잰다
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = {"started": None, "status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["started"] = time.perf_counter()
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                route = scope.get("route")
+                # 정적 파일 마운트(/images, /files)는 route 대신 root_path 에 마운트 경로가 남는다
+                endpoint = getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+                if state["started"] is not None:
+                    response_stream_seconds.observe(time.perf_counter() - state["started"], endpoint, scope["method"])
+                http_requests_total.inc(endpoint, scope["method"], state["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def create_metrics_router() -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    return router
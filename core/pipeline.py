@@ -0,0 +1,125 @@
+import asyncio
+import contextvars
+import time
+
+from core.tracing import span
+
+# =========================
+# 단계형 파이프라인 (작업 간 단계 겹치기)
+# =========================
+# 각 단계(text2img → mv_adapter → hy3d)는 자기 대기열과 동시 실행 수만큼의 워커를 가진다.
+# 작업은 단계를 차례로 통과하고, 한 단계를 끝내면 바로 다음 단계 대기열로 넘어가므로
+# A 가 Hy3D 에 있는 동안 B 는 MV-Adapter, C 는 text2img 에서 동시에 진행된다.
+# 단계 함수는 (job, data) -> data 코루틴이며, 앞 단계의 반환값이 다음 단계의 입력이 된다.
+
+
+class _Item:
+    __slots__ = ("job", "data", "future", "task", "cancelled", "context")
+
+    def __init__(self, job, data, future):
+        self.job = job
+        self.data = data
+        self.future = future
+        self.task = None
+        self.cancelled = False
+        # 워커는 다른 요청이 띄운 태스크이므로, 단계 함수는 제출한 쪽의 컨텍스트(trace 등)에서 실행한다
+        self.context = contextvars.copy_context()
+
+
+class Stage:
+    def __init__(self, name: str, fn, concurrency: int = 1):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, concurrency)
+        self.queue = asyncio.Queue()
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.workers = []
+
+    def stats(self) -> dict:
+        return {
+            "stage": self.name,
+            "concurrency": self.concurrency,
+            "queued": self.queue.qsize(),
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class StagePipeline:
+    def __init__(self, name: str, stages: list):
+        # stages: [(단계 이름, 단계 함수, 동시 실행 수), ...]
+        self.name = name
+        self.stages = [Stage(stage_name, fn, concurrency) for stage_name, fn, concurrency in stages]
+
+    def _ensure_workers(self):
+        for index, stage in enumerate(self.stages):
+            stage.workers = [worker for worker in stage.workers if not worker.done()]
+            while len(stage.workers) < stage.concurrency:
+                stage.workers.append(asyncio.create_task(self._work(index)))
+
+    async def run(self, job, data):
+        # 마지막 단계의 결과를 돌려준다. 취소되면 진행 중인 단계도 함께 취소
+        self._ensure_workers()
+        item = _Item(job, data, asyncio.get_running_loop().create_future())
+        await self.stages[0].queue.put(item)
+        try:
+            return await asyncio.shield(item.future)
+        except asyncio.CancelledError:
+            item.cancelled = True
+            if item.task is not None:
+                item.task.cancel()
+            raise
+
+    async def _work(self, index: int):
+        stage = self.stages[index]
+        while True:
+            item = await stage.queue.get()
+            if item.cancelled:
+                continue
+            stage.active += 1
+            started = time.monotonic()
+            try:
+                if item.job is not None:
+                    # 단계 함수 안에서 job.stage 가 세부 단계로 바뀌므로 파이프라인 단계는 info 에 따로 남긴다
+                    item.job.set_stage(stage.name)
+                    item.job.info["pipeline_stage"] = stage.name
+                item.task = item.context.run(asyncio.create_task, self._run_stage(stage, item))
+                item.data = await item.task
+                stage.completed += 1
+            except asyncio.CancelledError:
+                # 작업 취소로 단계 태스크만 취소된 경우 워커는 계속 동작
+                if not item.cancelled:
+                    raise
+                continue
+            except Exception as e:
+                stage.failed += 1
+                if not item.future.done():
+                    item.future.set_exception(e)
+                continue
+            finally:
+                item.task = None
+                stage.active -= 1
+                stage.busy_seconds += time.monotonic() - started
+
+            if index + 1 < len(self.stages):
+                await self.stages[index + 1].queue.put(item)
+            elif not item.future.done():
+                item.future.set_result(item.data)
+
+    async def _run_stage(self, stage: Stage, item: _Item):
+        with span(f"{self.name}.{stage.name}"):
+            return await stage.fn(item.job, item.data)
+
+    async def close(self):
+        for stage in self.stages:
+            for worker in stage.workers:
+                worker.cancel()
+            stage.workers = []
+
+    def stats(self) -> dict:
+        return {"pipeline": self.name, "stages": [stage.stats() for stage in self.stages]}
@@ -0,0 +1,132 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import time
+
+from PIL import Image
+
+# =========================
+# 작업 진행 상황 (현재 노드, 스텝 k/N, 미리보기)
+# =========================
+# ComfyUI 웹소켓의 executing / execution_cached / progress 이벤트와 샘플링 중 바이너리 미리보기 프레임을
+# 작업(Job)별로 모아 두고, 바뀔 때마다 작업의 notify 를 불러 GET /jobs/{id}/events (SSE) 구독자를 깨운다.
+# 미리보기는 PREVIEW_INTERVAL 마다 최대 한 장만 받아 PREVIEW_MAX_SIZE 이하 JPEG 로 줄인다 (스레드에서 처리).
+
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", "256"))    # 미리보기 긴 변 최대 크기(px)
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "70"))       # 미리보기 JPEG 품질
+PREVIEW_INTERVAL = float(os.getenv("PREVIEW_INTERVAL", "0.5"))  # 미리보기 갱신 최소 간격(초)
+
+
+def downscale_preview(data: bytes, max_size: int = PREVIEW_MAX_SIZE, quality: int = PREVIEW_QUALITY) -> bytes:
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def node_titles(workflow) -> dict:
+    # node_id -> 표시 이름 (_meta.title, 없으면 class_type)
+    graph = getattr(workflow, "graph", workflow) or {}
+    return {
+        node_id: (node.get("_meta") or {}).get("title") or node.get("class_type")
+        for node_id, node in graph.items() if isinstance(node, dict)
+    }
+
+
+def sse_message(event: str, data) -> str:
+    # text/event-stream 한 건
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class JobProgress:
+    FIELDS = ("node", "node_title", "step", "steps", "nodes_done", "nodes_total")
+
+    def __init__(self, notify):
+        self._notify = notify
+        self._titles = {}
+        self._done = set()
+        self._preview_at = 0.0
+        self._preview_task = None
+        self.node = None
+        self.node_title = None
+        self.step = None
+        self.steps = None
+        self.nodes_done = 0
+        self.nodes_total = None
+        self.preview = None  # 가장 최근 미리보기 JPEG
+        self.preview_seq = 0
+        self.updated_at = None
+
+    def start(self, workflow=None):
+        # 새 prompt 를 따라가기 시작 (파이프라인처럼 한 작업이 여러 prompt 를 거칠 때마다 호출)
+        self._titles = node_titles(workflow) if workflow is not None else {}
+        self._done = set()
+        self.node = self.node_title = self.step = self.steps = None
+        self.nodes_done = 0
+        self.nodes_total = len(self._titles) or None
+        self._changed()
+
+    def _changed(self):
+        self.updated_at = time.time()
+        self._notify()
+
+    def handle(self, event: dict):
+        # ComfyClient.watch_progress 콜백
+        kind = event["type"]
+        if kind == "executing":
+            if self.node is not None:
+                self._done.add(self.node)
+            self.node = event["node"]
+            self.node_title = self._titles.get(self.node)
+            self.step = self.steps = None
+        elif kind == "cached":
+            self._done.update(event["nodes"])
+        elif kind == "progress":
+            if event["node"] is not None and event["node"] != self.node:
+                self.node, self.node_title = event["node"], self._titles.get(event["node"])
+            self.step, self.steps = event["value"], event["max"]
+        elif kind == "preview":
+            self._accept_preview(event["data"])
+            return
+        self.nodes_done = len(self._done)
+        self._changed()
+
+    def _accept_preview(self, data: bytes):
+        now = time.monotonic()
+        if now - self._preview_at < PREVIEW_INTERVAL or (self._preview_task is not None and not self._preview_task.done()):
+            return
+        self._preview_at = now
+        self._preview_task = asyncio.create_task(self._store_preview(data))
+
+    async def _store_preview(self, data: bytes):
+        try:
+            self.preview = await asyncio.to_thread(downscale_preview, data)
+        except Exception:
+            return  # 깨진 프레임은 건너뛴다
+        self.preview_seq += 1
+        self._changed()
+
+    def mirror(self, remote: dict):
+        # 다른 서버 작업의 진행 상황을 그대로 옮긴다 (파이프라인의 Hy3D 단계, 미리보기 이미지는 제외)
+        if not remote or all(getattr(self, name) == remote.get(name) for name in self.FIELDS):
+            return
+        for name in self.FIELDS:
+            setattr(self, name, remote.get(name))
+        self._changed()
+
+    def to_dict(self) -> dict:
+        state = {name: getattr(self, name) for name in self.FIELDS}
+        state["preview_seq"] = self.preview_seq
+        state["updated_at"] = self.updated_at
+        return state
+
+    def preview_message(self) -> dict:
+        return {
+            "seq": self.preview_seq,
+            "image": "data:image/jpeg;base64," + base64.b64encode(self.preview).decode("ascii"),
+        }
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+# =========================
+# 모델 친화(affinity) 스케줄러
+# =========================
+# 같은 ComfyUI(GPU)에 서로 다른 체크포인트를 쓰는 워크플로우가 번갈아 들어오면 매번 수 GB 모델을 다시 올린다.
+# 스케줄러는 백엔드마다 "지금 올라가 있는 모델 그룹"을 기억하고,
+# - 같은 그룹 작업은 바로 제출, 다른 그룹 작업은 대기열에 보관
+# - 현재 그룹의 실행 중 작업이 모두 끝나면 가장 오래 기다린 그룹의 대기 작업을 한꺼번에 풀어 연속 실행
+# - 다른 그룹이 MAX_WAIT 초 넘게 기다리면 현재 그룹의 새 작업도 보류해 굶지 않게 한다
+# model_switches 는 실제 전환 수, arrival_switches 는 도착 순서 그대로 보냈을 때의 전환 수(비교용)다.
+
+AFFINITY_SCHEDULING = os.getenv("AFFINITY_SCHEDULING", "1") == "1"
+MAX_WAIT = float(os.getenv("AFFINITY_MAX_WAIT", "20"))  # 다른 그룹이 기다릴 수 있는 최대 시간(초)
+
+
+class AffinityScheduler:
+    def __init__(self, name: str, max_wait: float = MAX_WAIT, enabled: bool = AFFINITY_SCHEDULING):
+        self.name = name
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self.current = None      # 마지막으로 실행을 시작한 모델 그룹
+        self.inflight = 0        # 제출되어 아직 끝나지 않은 작업 수 (모두 current 그룹)
+        self.pending = {}        # 그룹 -> deque[(대기 시작 시각, future)]
+        self.model_switches = 0
+        self.arrival_switches = 0
+        self.admitted = {}
+        self._last_arrival = None
+
+    async def admit(self, group: str):
+        # 제출 가능해질 때까지 대기. 반환 후 작업이 끝나면 반드시 release(group) 호출
+        if self._last_arrival is not None and group != self._last_arrival:
+            self.arrival_switches += 1
+        self._last_arrival = group
+        if not self.enabled or self._can_admit(group):
+            self._start(group)
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiter = (time.monotonic(), future)
+        self.pending.setdefault(group, deque()).append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 풀려난 직후 취소된 경우: 차지한 실행 슬롯 반환
+                self.release(group)
+            else:
+                self.pending[group].remove(waiter)
+            raise
+
+    def release(self, group: str):
+        self.inflight = max(0, self.inflight - 1)
+        if self.inflight == 0:
+            self._switch_next()
+
+    def _can_admit(self, group: str) -> bool:
+        if self.inflight == 0 and not any(self.pending.values()):
+            return True
+        return group == self.current and not self._starving(group)
+
+    def _starving(self, group: str) -> bool:
+        now = time.monotonic()
+        return any(
+            waiters and now - waiters[0][0] > self.max_wait
+            for other, waiters in self.pending.items() if other != group
+        )
+
+    def _start(self, group: str):
+        if self.current is not None and group != self.current:
+            self.model_switches += 1
+        self.current = group
+        self.inflight += 1
+        self.admitted[group] = self.admitted.get(group, 0) + 1
+
+    def _switch_next(self):
+        # 가장 오래 기다린 그룹의 대기 작업을 모두 풀어 한 번에 연속 실행
+        heads = [(waiters[0][0], group) for group, waiters in self.pending.items() if waiters]
+        if not heads:
+            return
+        _, group = min(heads)
+        waiters = self.pending[group]
+        while waiters:
+            _, future = waiters.popleft()
+            if not future.done():
+                self._start(group)
+                future.set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "enabled": self.enabled,
+            "current_group": self.current,
+            "inflight": self.inflight,
+            "pending": {group: len(waiters) for group, waiters in self.pending.items()},
+            "admitted": dict(self.admitted),
+            "model_switches": self.model_switches,
+            "arrival_switches": self.arrival_switches,
+            "max_wait": self.max_wait,
+        }
+
+
+_schedulers = {}  # 백엔드 주소 -> AffinityScheduler
+
+
+def get_scheduler(ip: str) -> AffinityScheduler:
+    if ip not in _schedulers:
+        _schedulers[ip] = AffinityScheduler(ip)
+    return _schedulers[ip]
+
+
+def scheduler_stats() -> list:
+    return [scheduler.stats() for scheduler in _schedulers.values()]
@@ -0,0 +1,254 @@
+import atexit
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# =========================
+# 서비스 간 요청 추적 (trace)
+# =========================
+# !3d 한 번이 봇 → 프롬프트 변환 → comfy_mv_api(text2img, mv_adapter) → hy3d_api 를 거치는 동안
+# 같은 trace id 를 X-Trace-Id 헤더로 넘기고, 각 서비스는 단계(span)마다 시작/끝 시각을 로컬 trace 로그(JSONL)에 남긴다.
+# - 서버: TraceMiddleware 가 헤더의 trace id 를 이어받고(없으면 생성) 응답에 X-Trace-Id 와 Server-Timing 헤더를 붙인다
+# - ComfyUI: /prompt 의 extra_data.trace_id 로 넘겨 ComfyUI history/queue 에서도 찾을 수 있게 한다
+# - 내보내기: python -m core.tracing <trace_id> [로그 파일...] > trace.json
+#   → Chrome trace event 형식 (chrome://tracing, https://ui.perfetto.dev 에서 열기)
+# 현재 trace 는 contextvars 로 전달되므로 같은 요청에서 만든 asyncio 태스크(작업, 파이프라인 단계)로도 이어진다.
+# span 기록은 메모리 버퍼에 넣기만 하고, 백그라운드 스레드가 TRACE_FLUSH_INTERVAL 초마다 모아서 파일에 쓴다
+# (요청 경로에서 디스크 쓰기를 하지 않도록). 종료 시 남은 기록은 atexit 으로 flush.
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_LOG = os.getenv("TRACE_LOG", os.path.join("output", "traces.jsonl"))  # 빈 값이면 파일 기록 안 함
+SERVICE_NAME = os.getenv("TRACE_SERVICE", "app")  # start_trace/TraceMiddleware 에 service 를 주지 않았을 때
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))  # 버퍼를 파일로 내보내는 간격(초)
+
+_current = contextvars.ContextVar("trace", default=None)
+_log_lock = threading.Lock()    # _pending 보호 (요청 경로에서는 이 잠금만 잠깐 잡는다)
+_flush_lock = threading.Lock()  # 파일 쓰기 직렬화
+_pending = []
+_writer = None
+_log_file = None
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Trace:
+    def __init__(self, trace_id: str = None, service: str = None):
+        self.trace_id = trace_id or new_trace_id()
+        self.service = service or SERVICE_NAME
+        self.spans = []  # 이 프로세스에서 끝난 span (dict)
+
+    def add_span(self, name: str, start: float, end: float, **attrs):
+        # start/end: time.time() 기준 초
+        record = {
+            "trace_id": self.trace_id,
+            "service": self.service,
+            "name": name,
+            "start": round(start, 6),
+            "duration": round(max(0.0, end - start), 6),
+        }
+        if attrs:
+            record["attrs"] = attrs
+        self.spans.append(record)
+        _write(record)
+        return record
+
+    def summary(self) -> dict:
+        # 단계 이름 -> 누적 소요 시간(초)
+        totals = {}
+        for record in self.spans:
+            totals[record["name"]] = round(totals.get(record["name"], 0.0) + record["duration"], 6)
+        return totals
+
+    def server_timing(self) -> str:
+        # Server-Timing 헤더 값 (밀리초)
+        # 메트릭 이름은 토큰 문자만 허용되므로 나머지는 _ 로 바꾼다
+        return ", ".join(
+            f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={seconds * 1000:.1f}" for name, seconds in self.summary().items()
+        )
+
+
+def _write(record: dict):
+    global _writer
+    if not TRACE_LOG:
+        return
+    with _log_lock:
+        _pending.append(record)
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="trace-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+
+
+def _writer_loop():
+    while True:
+        time.sleep(TRACE_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"[TRACE] failed to write {TRACE_LOG}: {e}")
+
+
+def flush():
+    # 버퍼에 쌓인 span 을 한 번에 파일에 쓴다
+    global _log_file
+    with _flush_lock:
+        with _log_lock:
+            if not _pending:
+                return
+            records = _pending[:]
+            _pending.clear()
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        if _log_file is None:
+            directory = os.path.dirname(TRACE_LOG)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _log_file = open(TRACE_LOG, "a", encoding="utf-8")
+        _log_file.write(lines)
+        _log_file.flush()
+
+
+def current_trace():
+    return _current.get()
+
+
+def current_trace_id():
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def trace_headers() -> dict:
+    # 다른 서비스로 보내는 요청에 붙일 헤더
+    trace = _current.get()
+    return {TRACE_HEADER: trace.trace_id} if trace is not None else {}
+
+
+@contextmanager
+def start_trace(trace_id: str = None, service: str = None):
+    # with start_trace() as trace: ... 안에서 만든 span/요청이 모두 이 trace 로 묶인다
+    trace = Trace(trace_id, service)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    # 현재 trace 가 없으면 아무것도 기록하지 않는다
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    except Exception as e:
+        trace.add_span(name, start, time.time(), error=type(e).__name__, **attrs)
+        raise
+    trace.add_span(name, start, time.time(), **attrs)
+
+
+def record_span(name: str, start_monotonic: float, end_monotonic: float, **attrs):
+    # time.monotonic 으로 잰 구간을 나중에 span 으로 남길 때 (예: ComfyUI 대기/실행 구간)
+    trace = _current.get()
+    if trace is None:
+        return
+    offset = time.time() - time.monotonic()
+    trace.add_span(name, start_monotonic + offset, end_monotonic + offset, **attrs)
+
+
+# ---------------------------
+# ASGI 미들웨어
+# ---------------------------
+
+class TraceMiddleware:
+    def __init__(self, app, service: str = None):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id = None
+        for key, value in scope.get("headers", []):
+            if key.decode("latin-1").lower() == TRACE_HEADER.lower():
+                trace_id = value.decode("latin-1")[:64]
+                break
+        with start_trace(trace_id, self.service) as trace:
+            started = time.time()
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((TRACE_HEADER.lower().encode("latin-1"), trace.trace_id.encode("latin-1")))
+                    timing = trace.server_timing()
+                    if timing:
+                        headers.append((b"server-timing", timing.encode("latin-1")))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                endpoint = getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+                # 작업 조회 폴링/지표 수집 같은 GET 까지 남기면 로그가 불어나므로 생성 요청(POST 등)만 기록
+                if scope["method"] != "GET":
+                    trace.add_span(f"http {scope['method']} {endpoint}", started, time.time())
+
+
+# ---------------------------
+# 내보내기 (Chrome trace event 형식)
+# ---------------------------
+
+def load_spans(trace_id: str, paths: list) -> list:
+    spans = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("trace_id") == trace_id:
+                    spans.append(record)
+    return sorted(spans, key=lambda record: record["start"])
+
+
+def to_chrome_trace(spans: list) -> dict:
+    services = {}
+    events = []
+    for record in spans:
+        pid = services.setdefault(record["service"], len(services) + 1)
+        events.append({
+            "name": record["name"],
+            "cat": record["service"],
+            "ph": "X",
+            "ts": int(record["start"] * 1_000_000),
+            "dur": int(record["duration"] * 1_000_000),
+            "pid": pid,
+            "tid": 1,
+            "args": record.get("attrs", {}),
+        })
+    for service, pid in services.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": service}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m core.tracing <trace_id> [trace.jsonl ...]", file=sys.stderr)
+        sys.exit(1)
+    json.dump(to_chrome_trace(load_spans(sys.argv[1], sys.argv[2:] or [TRACE_LOG])), sys.stdout, ensure_ascii=False)
@@ -0,0 +1,297 @@
+import json
+import os
+import random
+import re
+
+from core.graph import prune_graph
+
+# =========================
+# 워크플로우 템플릿 엔진
+# =========================
+# workflows/<name>.v<version>.json 템플릿을 시작 시 한 번만 읽어 레지스트리에 올려 두고,
+# 요청마다 이름 붙은 슬롯(이미지, 프롬프트, 시드, 스텝 등)만 패치해서 렌더링한다.
+# 그래프 JSON 은 슬롯 위치를 기준으로 미리 직렬화해 두므로 요청당 비용은 슬롯 개수에만 비례한다.
+#
+# 템플릿 형식:
+# {
+#   "name": "text2img", "version": 1,
+#   "slots": {"seed": [{"node": "3", "input": "seed"}],
+#             "user_prompt": [{"node": "6", "input": "text", "format": "{value}, masterpiece"}]},
+#   "graph": { ...ComfyUI API 형식 그래프... }
+# }
+# format 이 있는 슬롯은 값을 "{value}" 자리에 넣은 문자열이 되며 필수다.
+# "outputs" 는 API 호출자에게 필요한 출력 노드 목록으로, 가지치기(prune)의 기준이 된다.
+# 변형 템플릿은 "variant_of": 기본 워크플로우 이름, "replaces": 기본 그래프에서 대신하는 노드 id 목록을 가진다
+# (예: hy3d_alpha 는 입력 알파를 재사용해 hy3d 의 배경 제거 노드를 건너뜀). 티어 프리셋은 기본 워크플로우의 것을 쓴다.
+#
+# 품질/속도 티어(draft, standard, final)는 workflows/tiers.json 에서 워크플로우별 슬롯 값 묶음으로 정의한다.
+# {"default": "standard", "tiers": {"draft": {"text2img": {"steps": 10}, "hy3d": {...}}, ...},
+#  "timeouts": {"draft": {"text2img": 300, ...}, ...}}
+# "timeouts" 는 티어·워크플로우별 prompt 한 건의 최대 대기 시간(초, 대기열 + 실행)으로, 넘기면 prompt 를 취소하고 작업을 실패 처리한다.
+
+PRUNE_WORKFLOWS = os.getenv("PRUNE_WORKFLOWS", "1") == "1"  # 0 이면 원본 그래프 그대로 실행
+PRUNE_SAMPLE_RATE = float(os.getenv("PRUNE_SAMPLE_RATE", "0.02"))  # 절감 시간 추정용으로 원본 그래프를 실행할 확률
+
+WORKFLOW_DIR = os.getenv("WORKFLOW_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workflows"))
+
+TIERS_FILE = os.getenv("WORKFLOW_TIERS_FILE", os.path.join(WORKFLOW_DIR, "tiers.json"))
+DEFAULT_TIER = os.getenv("DEFAULT_TIER")  # 지정하지 않으면 tiers.json 의 default
+DEFAULT_TIMEOUT = float(os.getenv("WORKFLOW_TIMEOUT", "3600"))  # tiers.json 에 timeouts 가 없을 때 (0 이면 무제한)
+
+_FILE_PATTERN = re.compile(r"^(?P<name>[\w\-]+)\.v(?P<version>\d+)\.json$")
+_SENTINEL = "\u0000slot:{}\u0000"
+_SENTINEL_PATTERN = re.compile(r'"\\u0000slot:(\d+)\\u0000"')
+
+
+class RenderedWorkflow:
+    # 렌더링 결과: 미리 직렬화된 JSON 문자열과 필요할 때만 만드는 dict 그래프
+    __slots__ = ("template", "values", "serialized", "_graph")
+
+    def __init__(self, template, values: dict, serialized: str):
+        self.template = template
+        self.values = values
+        self.serialized = serialized
+        self._graph = None
+
+    @property
+    def graph(self) -> dict:
+        if self._graph is None:
+            self._graph = self.template.render_graph(**self.values)
+        return self._graph
+
+
+class WorkflowTemplate:
+    def __init__(self, name: str, version: int, graph: dict, slots: dict, outputs=None, removed=None,
+                 variant_of: str = None, replaces=None, added=None):
+        self.name = name
+        self.version = version
+        self.graph = graph
+        self.slots = slots
+        self.outputs = list(outputs or [])
+        self.removed = list(removed or [])  # 가지치기로 제거된 노드 id
+        self.variant_of = variant_of  # 변형 템플릿이면 기본 워크플로우 이름
+        self.replaces = list(replaces or [])  # 기본 그래프에서 실행하지 않게 되는 노드 id
+        self.added = list(added or [])  # 기본 그래프에 없거나 종류가 바뀐 노드 id (레지스트리가 채움)
+        self._pruned = {}
+        self.defaults = {}
+        self.required = set()
+        for slot, positions in slots.items():
+            for position in positions:
+                if "format" in position:
+                    self.required.add(slot)
+                else:
+                    self.defaults.setdefault(slot, graph[position["node"]]["inputs"][position["input"]])
+        self._compile()
+
+    # ---------------------------
+    # 사전 직렬화
+    # ---------------------------
+
+    def _compile(self):
+        # 슬롯 위치에 센티널을 넣어 한 번 직렬화한 뒤 센티널 기준으로 조각을 나눈다
+        marked = {node_id: dict(node, inputs=dict(node["inputs"])) for node_id, node in self.graph.items()}
+        self._positions = []
+        for slot, positions in self.slots.items():
+            for position in positions:
+                marked[position["node"]]["inputs"][position["input"]] = _SENTINEL.format(len(self._positions))
+                self._positions.append((slot, position.get("format")))
+        pieces = _SENTINEL_PATTERN.split(json.dumps(marked, ensure_ascii=False))
+        # pieces = [조각0, 위치번호, 조각1, 위치번호, ...] → 문서 순서대로 위치를 재정렬
+        self._segments = pieces[0::2]
+        self._positions = [self._positions[int(index)] for index in pieces[1::2]]
+        # 값이 주어지지 않은 슬롯은 기본값의 직렬화 결과를 재사용
+        self._default_json = [
+            None if fmt is not None else json.dumps(self.defaults[slot], ensure_ascii=False)
+            for slot, fmt in self._positions
+        ]
+
+    def _slot_value(self, slot: str, fmt, values: dict):
+        value = values[slot] if slot in values else self.defaults[slot]
+        if fmt is not None:
+            return fmt.replace("{value}", str(value))
+        return value
+
+    def _check(self, values: dict):
+        unknown = set(values) - set(self.slots)
+        if unknown:
+            raise KeyError(f"{self.name}: 알 수 없는 슬롯 {sorted(unknown)}")
+        missing = self.required - set(values)
+        if missing:
+            raise KeyError(f"{self.name}: 필수 슬롯 누락 {sorted(missing)}")
+
+    # ---------------------------
+    # 가지치기
+    # ---------------------------
+
+    def prune(self, outputs=None):
+        # 필요한 출력 노드에 기여하지 않는 노드를 제거한 템플릿 (출력 조합별로 한 번만 계산)
+        keep = tuple(sorted(outputs or self.outputs))
+        if not keep:
+            return self
+        if keep not in self._pruned:
+            graph, removed = prune_graph(self.graph, keep)
+            slots = {
+                slot: [position for position in positions if position["node"] in graph]
+                for slot, positions in self.slots.items()
+            }
+            self._pruned[keep] = WorkflowTemplate(
+                self.name, self.version, graph, slots, keep, removed,
+                self.variant_of, self.replaces, [node_id for node_id in self.added if node_id in graph]
+            )
+        return self._pruned[keep]
+
+    # ---------------------------
+    # 렌더링
+    # ---------------------------
+
+    def render(self, **values) -> RenderedWorkflow:
+        self._check(values)
+        parts = [self._segments[0]]
+        for (slot, fmt), default_json, segment in zip(self._positions, self._default_json, self._segments[1:]):
+            if slot in values or default_json is None:
+                parts.append(json.dumps(self._slot_value(slot, fmt, values), ensure_ascii=False))
+            else:
+                parts.append(default_json)
+            parts.append(segment)
+        return RenderedWorkflow(self, values, "".join(parts))
+
+    def render_graph(self, **values) -> dict:
+        # 패치되는 노드만 복사하고 나머지 노드는 템플릿과 공유한다 (호출 측에서 수정하지 말 것)
+        self._check(values)
+        graph = dict(self.graph)
+        for slot, positions in self.slots.items():
+            for position in positions:
+                node_id = position["node"]
+                if graph[node_id] is self.graph[node_id]:
+                    graph[node_id] = dict(graph[node_id], inputs=dict(graph[node_id]["inputs"]))
+                graph[node_id]["inputs"][position["input"]] = self._slot_value(slot, position.get("format"), values)
+        return graph
+
+
+# ---------------------------
+# 레지스트리
+# ---------------------------
+
+class WorkflowRegistry:
+    def __init__(self, directory: str = WORKFLOW_DIR, tiers_file: str = TIERS_FILE):
+        self.directory = directory
+        self.tiers_file = tiers_file
+        self._templates = {}  # name -> {version: template}
+        self.tiers = {}  # tier -> {워크플로우 이름: 슬롯 값}
+        self.timeouts = {}  # tier -> {워크플로우 이름: 최대 대기 시간(초)}
+        self.default_tier = None
+        self.load()
+
+    def load(self):
+        self._templates.clear()
+        for filename in sorted(os.listdir(self.directory)):
+            match = _FILE_PATTERN.match(filename)
+            if not match:
+                continue
+            with open(os.path.join(self.directory, filename), encoding="utf-8") as f:
+                data = json.load(f)
+            name, version = match.group("name"), int(match.group("version"))
+            template = WorkflowTemplate(
+                name, version, data["graph"], data.get("slots", {}), data.get("outputs"),
+                variant_of=data.get("variant_of"), replaces=data.get("replaces")
+            )
+            self._templates.setdefault(name, {})[version] = template
+        self._link_variants()
+        self._load_tiers()
+
+    def _link_variants(self):
+        # 변형 템플릿이 기본 그래프 대비 새로 넣은 노드 (절감 시간 추정에서 뺄 비용)
+        for versions in self._templates.values():
+            for template in versions.values():
+                if not template.variant_of:
+                    continue
+                base = self.get(template.variant_of).graph
+                template.added = [
+                    node_id for node_id, node in template.graph.items()
+                    if node_id not in base or base[node_id].get("class_type") != node.get("class_type")
+                ]
+
+    def _load_tiers(self):
+        self.tiers = {}
+        self.default_tier = DEFAULT_TIER
+        if os.path.exists(self.tiers_file):
+            with open(self.tiers_file, encoding="utf-8") as f:
+                data = json.load(f)
+            self.tiers = data.get("tiers", {})
+            self.timeouts = data.get("timeouts", {})
+            self.default_tier = self.default_tier or data.get("default")
+        for tier, presets in self.tiers.items():
+            for name, values in presets.items():
+                unknown = set(values) - set(self.get(name).slots)
+                if unknown:
+                    raise KeyError(f"티어 {tier}: {name} 에 없는 슬롯 {sorted(unknown)}")
+            # 변형 템플릿은 기본 워크플로우의 프리셋을 그대로 받을 수 있어야 한다
+            for name in self._templates:
+                unknown = set(self.tier_values(name, tier)) - set(self.get(name).slots)
+                if unknown:
+                    raise KeyError(f"티어 {tier}: {name} 에 없는 슬롯 {sorted(unknown)}")
+
+    def get(self, name: str, version: int = None) -> WorkflowTemplate:
+        # 버전을 지정하지 않으면 가장 높은 버전
+        versions = self._templates.get(name)
+        if not versions:
+            raise KeyError(f"워크플로우 템플릿을 찾을 수 없습니다: {name}")
+        return versions[version if version is not None else max(versions)]
+
+    def template(self, name: str, outputs=None, prune: bool = PRUNE_WORKFLOWS) -> WorkflowTemplate:
+        # 실행용 템플릿: 기본적으로 필요한 출력 기준으로 가지치기된 그래프
+        template = self.get(name)
+        return template.prune(outputs) if prune else template
+
+    def cost_sample(self, workflow):
+        # 가지치기된 렌더링 결과를 PRUNE_SAMPLE_RATE 확률로 같은 슬롯 값의 원본 그래프로 바꾼다
+        # (제거된 노드는 실행되지 않으므로 이렇게 가끔 실행해야 NodeCostModel 에 비용이 쌓인다)
+        template = getattr(workflow, "template", None)
+        if template is None or not template.removed or random.random() >= PRUNE_SAMPLE_RATE:
+            return workflow
+        return self.get(template.name, template.version).render(**workflow.values)
+
+    # ---------------------------
+    # 티어
+    # ---------------------------
+
+    def resolve_tier(self, tier: str = None) -> str:
+        # None 이면 기본 티어, 정의되지 않은 티어는 KeyError
+        tier = tier or self.default_tier
+        if tier is None:
+            return None
+        if tier not in self.tiers:
+            raise KeyError(f"알 수 없는 티어: {tier} (사용 가능: {', '.join(self.tiers)})")
+        return tier
+
+    def tier_values(self, name: str, tier: str = None) -> dict:
+        tier = self.resolve_tier(tier)
+        if tier is None:
+            return {}
+        presets = self.tiers[tier]
+        if name not in presets:
+            name = self.get(name).variant_of or name
+        return dict(presets.get(name, {}))
+
+    def timeout(self, name: str, tier: str = None):
+        # prompt 한 건의 최대 대기 시간(초), 없으면 None (변형은 기본 워크플로우 값)
+        tier = self.resolve_tier(tier)
+        limits = self.timeouts.get(tier, {}) if tier is not None else {}
+        if name not in limits and name in self._templates:
+            name = self.get(name).variant_of or name
+        seconds = limits.get(name, DEFAULT_TIMEOUT)
+        return float(seconds) if seconds else None
+
+    def render(self, name: str, tier: str = None, outputs=None, **values) -> RenderedWorkflow:
+        # 티어 프리셋 위에 호출자가 준 슬롯 값을 덮어쓴다 (outputs 를 주면 해당 출력 노드 기준으로 가지치기)
+        return self.template(name, outputs).render(**{**self.tier_values(name, tier), **values})
+
+
+_registry = None
+
+
+def get_registry() -> WorkflowRegistry:
+    global _registry
+    if _registry is None:
+        _registry = WorkflowRegistry()
+    return _registry
@@ -1,16 +1,33 @@
 import os
+import re
+import unicodedata
 import discord
-import aiohttp
 import asyncio
 from datetime import datetime
 from core.config import (
-    DISCORD_TOKEN, OUTPUT_DIR, OUTPUT_3D_DIR,
-    MVADAPTER_SERVER, HY3D_SERVER,
-    PROMPT_CONVERT_API
+    DISCORD_TOKEN, DISCORD_ATTACHMENT_LIMIT, DISCORD_WORKERS, OUTPUT_DIR, OUTPUT_3D_DIR,
+    MVADAPTER_SERVER, HY3D_SERVER, PROMPT_CONVERT_API,
+    PROMPT_CACHE_FILE, PROMPT_CACHE_TTL, PROMPT_CACHE_MAX_ENTRIES
 )
+from core.cache import MemoCache
+from core.tracing import start_trace, span
+from core.http_client import ServiceClient, ServiceUnavailable
 
 os.makedirs(OUTPUT_3D_DIR, exist_ok=True)
 
+HY3D_POLL_INTERVAL = 2  # 파이프라인 작업 상태 조회 간격(초)
+CANCEL_EMOJI = "❌"  # 진행 메시지에 이 반응을 누르면 요청자의 작업을 중단
+
+# 서버별 장기 클라이언트 (커넥션 재사용, 단계별 타임아웃, 재시도, 서킷 브레이커)
+prompt_api = ServiceClient("프롬프트 변환", PROMPT_CONVERT_API, timeout=60)
+mv_api = ServiceClient("이미지 생성", MVADAPTER_SERVER, timeout=10)
+hy3d_api = ServiceClient("3D 생성", HY3D_SERVER, timeout=120)
+SUBMIT_TIMEOUT = 30     # 파이프라인 제출
+DOWNLOAD_TIMEOUT = 120  # GLB 다운로드
+
+# 프롬프트 변환 결과 캐시 (정규화한 한글 프롬프트 -> positive/negative 목록)
+prompt_cache = MemoCache(PROMPT_CACHE_FILE, PROMPT_CACHE_MAX_ENTRIES, PROMPT_CACHE_TTL)
+
 intents = discord.Intents.default()
 intents.message_content = True
 client = discord.Client(intents=intents)
@@ -18,18 +35,50 @@ client = discord.Client(intents=intents)
 last_help_time = None
 help_channel = None
 
+# !3d 요청 대기열: on_message 는 등록만 하고, DISCORD_WORKERS 개의 워커가 순서대로 처리
+job_queue = asyncio.Queue()
+waiting = []   # 아직 시작하지 않은 요청 (대기 순번 계산용)
+workers = []
+
+# 진행 메시지 id -> 요청자 id (중단 반응을 받을 메시지), 중단 요청이 들어온 진행 메시지 id
+cancellable = {}
+cancel_requested = set()
+
+PIPELINE_STAGE_LABELS = {
+    "text2img": "🖼️ 이미지 생성",
+    "mv_adapter": "🎨 텍스처 이미지 생성",
+    "hy3d": "🧊 GLB 생성",
+}
+
 def get_random_hex():
     return os.urandom(8).hex()
 
-def find_latest_named_images(folder, name_keys):
-    result = {}
-    for key in name_keys:
-        files = [f for f in os.listdir(folder) if key in f and f.endswith(".png")]
-        if not files:
-            result[key] = None
-        else:
-            result[key] = max(files, key=lambda f: os.path.getmtime(os.path.join(folder, f)))
-    return result
+def normalize_prompt(text):
+    # 유니코드 정규화 + 공백 정리 + 소문자: "작은  의자" 와 "작은 의자" 를 같은 키로
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+async def convert_prompt(user_kor_prompt):
+    # (positive 목록, negative 목록). 캐시에 있으면 변환 API 를 부르지 않는다
+    key = normalize_prompt(user_kor_prompt)
+    cached = prompt_cache.get(key)
+    stats = prompt_cache.stats()
+    if cached is not None:
+        print(f"[PROMPT-CACHE] hit '{key}' (hit ratio {stats['hit_ratio']:.0%}, {stats['hits']}/{stats['hits'] + stats['misses']})")
+        return cached["positive"], cached["negative"]
+    print(f"[PROMPT-CACHE] miss '{key}' (hit ratio {stats['hit_ratio']:.0%}, {stats['hits']}/{stats['hits'] + stats['misses']})")
+
+    # 변환은 같은 입력에 대해 다시 보내도 안전하므로 재시도 허용
+    result = await prompt_api.request("POST", "", params={"prompt": user_kor_prompt}, idempotent=True)
+    positive_list = result.get("prompts", {}).get("positive", [])
+    negative_list = result.get("prompts", {}).get("negative", [])
+    if not isinstance(negative_list, list):
+        negative_list = None
+    if isinstance(positive_list, list) and positive_list:
+        prompt_cache.put(key, {"positive": positive_list, "negative": negative_list})
+        # 파일 저장은 이벤트 루프를 막지 않도록 스레드에서
+        await asyncio.to_thread(prompt_cache.flush)
+    return positive_list, negative_list
 
 def help_message_text():
     return (
@@ -51,6 +100,9 @@ async def on_ready():
         await help_channel.send(help_message_text())
         last_help_time = datetime.utcnow()
         asyncio.create_task(periodic_help_sender())
+    # 재연결 때마다 on_ready 가 다시 호출되므로 워커는 한 번만 띄운다
+    if not workers:
+        workers.extend(asyncio.create_task(job_worker(index)) for index in range(DISCORD_WORKERS))
 
 async def periodic_help_sender():
     global last_help_time, help_channel
@@ -77,93 +129,166 @@ async def on_message(message):
         await message.channel.send(help_message_text())
         return
 
-    # ✅ 3D 생성 처리
+    # ✅ 3D 생성 요청은 대기열에 넣고 바로 순번을 알려준다
     if message.content.startswith("!3d "):
+        user_kor_prompt = message.content[4:].strip()
+        if not user_kor_prompt:
+            await message.channel.send("❗ 프롬프트를 입력하세요. 예: !3d 작은 나무 의자")
+            return
+        await enqueue_3d(message, user_kor_prompt)
+
+@client.event
+async def on_raw_reaction_add(payload):
+    # 요청한 사람이 진행 메시지에 ❌ 를 누르면 다음 상태 조회 때 작업을 취소한다
+    if str(payload.emoji) == CANCEL_EMOJI and cancellable.get(payload.message_id) == payload.user_id:
+        cancel_requested.add(payload.message_id)
+
+# =========================
+# !3d 작업 대기열
+# =========================
+
+def position_text(position):
+    return f"⏳ 대기열 {position}번째입니다. 차례가 되면 시작합니다."
+
+async def enqueue_3d(message, user_kor_prompt):
+    entry = {"message": message, "prompt": user_kor_prompt, "status": None}
+    waiting.append(entry)
+    entry["status"] = await message.reply(position_text(len(waiting)))
+    await job_queue.put(entry)
+
+async def update_positions():
+    # 앞 요청이 시작되면 남은 요청들의 순번 메시지를 갱신
+    for position, entry in enumerate(list(waiting), start=1):
+        if entry["status"] is None:
+            continue
         try:
-            user_kor_prompt = message.content[4:].strip()
-            if not user_kor_prompt:
-                await message.channel.send("❗ 프롬프트를 입력하세요. 예: !3d 작은 나무 의자")
-                return
-
-            await message.channel.send(f"🌐 프롬프트 변환 중: {user_kor_prompt}")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(PROMPT_CONVERT_API, params={"prompt": user_kor_prompt}) as resp:
-                    if resp.status != 200:
-                        await message.channel.send("❌ 프롬프트 변환 실패")
-                        return
-                    result = await resp.json()
-                    positive_list = result.get("prompts", {}).get("positive", [])
-                    negative_list = result.get("prompts", {}).get("negative", [])
-                    if not isinstance(positive_list, list) or not positive_list:
-                        await message.channel.send("❌ 변환된 프롬프트가 비어 있음")
-                        return
-                    prompt = ", ".join(positive_list)
-                    negative = ", ".join(negative_list) if isinstance(negative_list, list) else "low quality"
-
-            await message.channel.send(f"🖌️ 변환된 프롬프트: {prompt}")
-            await message.channel.send("🖼️ 이미지 생성 중...")
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{MVADAPTER_SERVER}/generate",
-                    json={"user_prompt": prompt, "user_negative": negative}
-                ) as resp:
-                    if resp.status != 200:
-                        await message.channel.send("❌ 이미지 생성 실패 (/generate)")
-                        return
-
-            await asyncio.sleep(2)
-
-            image_files = [f for f in os.listdir(OUTPUT_DIR) if f.endswith(".png")]
-            if not image_files:
-                await message.channel.send("❌ 생성된 PNG 파일이 없습니다.")
-                return
-
-            reference_filename = sorted(image_files, key=lambda f: os.path.getmtime(os.path.join(OUTPUT_DIR, f)))[-1]
-            reference_path = os.path.join(OUTPUT_DIR, reference_filename)
+            await entry["status"].edit(content=position_text(position))
+        except discord.HTTPException:
+            pass
 
-            await message.channel.send("🎨 텍스처 이미지 생성 중...", file=discord.File(reference_path))
+async def job_worker(index):
+    while True:
+        entry = await job_queue.get()
+        try:
+            waiting.remove(entry)
+            await update_positions()
+            try:
+                await entry["status"].edit(content="🚀 생성을 시작합니다!")
+            except discord.HTTPException:
+                pass
+            await run_3d(entry["message"], entry["prompt"])
+        except Exception as e:
+            print(f"[ERROR] worker {index}: {e}")
+        finally:
+            job_queue.task_done()
 
-            async with aiohttp.ClientSession() as session:
-                mv_payload = {
-                    "reference_filename": reference_filename,
-                    "user_prompt": prompt
-                }
-                async with session.post(f"{MVADAPTER_SERVER}/generate_mv_adapter", json=mv_payload) as resp:
-                    if resp.status != 200:
-                        await message.channel.send("❌ MVAdapter 텍스처 생성 실패")
-                        return
+def progress_line(job):
+    # 파이프라인 단계 + 실행 중인 노드와 스텝 (예: 🎨 텍스처 이미지 생성 · Diffusers MV Sampler 23/50)
+    label = PIPELINE_STAGE_LABELS.get((job.get("info") or {}).get("pipeline_stage"), "⏳ 준비")
+    progress = job.get("progress") or {}
+    detail = progress.get("node_title") or ""
+    if progress.get("steps"):
+        detail += f" {progress['step']}/{progress['steps']}"
+    line = f"{label} 중" + (f" · {detail.strip()}" if detail.strip() else "")
+    return f"{line}\n({CANCEL_EMOJI} 를 누르면 중단합니다)"
 
-            await asyncio.sleep(5)
+async def run_3d(message, user_kor_prompt):
+    # !3d 한 건을 하나의 trace 로 묶는다 (서버 요청에 X-Trace-Id 로 전달)
+    with start_trace(service="discord_bot") as trace:
+        print(f"[TRACE] !3d {trace.trace_id}: {user_kor_prompt}")
+        with span("discord.3d"):
+            await _run_3d(message, user_kor_prompt)
 
-            tex_imgs = find_latest_named_images(OUTPUT_DIR, ["front", "back", "left"])
-            if not all(tex_imgs.values()):
-                await message.channel.send("❌ front/back/left 텍스처 이미지 누락")
-                return
+async def _run_3d(message, user_kor_prompt):
+    try:
+        await message.channel.send(f"🌐 프롬프트 변환 중: {user_kor_prompt}")
+        with span("discord.prompt_convert"):
+            positive_list, negative_list = await convert_prompt(user_kor_prompt)
+        if not isinstance(positive_list, list) or not positive_list:
+            await message.channel.send("❌ 변환된 프롬프트가 비어 있음")
+            return
+        prompt = ", ".join(positive_list)
+        negative = ", ".join(negative_list) if isinstance(negative_list, list) else "low quality"
 
-            await message.channel.send("🧊 GLB 생성 중...")
+        await message.channel.send(f"🖌️ 변환된 프롬프트: {prompt}")
 
-            files = {
-                "front": open(os.path.join(OUTPUT_DIR, tex_imgs["front"]), "rb"),
-                "back": open(os.path.join(OUTPUT_DIR, tex_imgs["back"]), "rb"),
-                "left": open(os.path.join(OUTPUT_DIR, tex_imgs["left"]), "rb")
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(f"{HY3D_SERVER}/generate_hy3d", data=files) as resp:
-                    for f in files.values():
-                        f.close()
-                    if resp.status != 200:
-                        await message.channel.send(f"❌ GLB 생성 실패 (status: {resp.status})")
-                        return
-                    unique_filename = f"Hy3D_textured_{get_random_hex()}.glb"
-                    glb_path = os.path.join(OUTPUT_3D_DIR, unique_filename)
-                    with open(glb_path, "wb") as f:
-                        f.write(await resp.read())
-
-            await message.channel.send("✅ 3D 모델 생성 완료!", file=discord.File(glb_path))
+        # text2img → 텍스처 뷰 → GLB 를 서버 파이프라인 한 번으로 실행하고 중간 결과를 폴링으로 받는다
+        # 제출은 멱등이 아니므로 재시도하지 않는다 (중복 작업 방지)
+        payload = {
+            "user_prompt": prompt,
+            "user_negative": negative,
+            "max_bytes": DISCORD_ATTACHMENT_LIMIT  # 첨부 한도에 맞게 GLB 경량화
+        }
+        job = await mv_api.post_json("/pipeline", payload, expect=(202,), timeout=SUBMIT_TIMEOUT)
+
+        # 진행 메시지 하나를 계속 고쳐 쓰며 단계/스텝을 보여주고, 요청자의 ❌ 반응으로 중단할 수 있게 한다
+        progress_message = await message.channel.send(progress_line(job))
+        cancellable[progress_message.id] = message.author.id
+        try:
+            await progress_message.add_reaction(CANCEL_EMOJI)
+        except discord.HTTPException:
+            pass
+        try:
+            job = await follow_pipeline(message, job, progress_message)
+        finally:
+            cancellable.pop(progress_message.id, None)
+            cancel_requested.discard(progress_message.id)
+            # 진행 메시지는 진행 중에만 의미가 있으므로 끝나면 지운다
+            try:
+                await progress_message.delete()
+            except discord.HTTPException:
+                pass
+
+        if job["status"] == "cancelled":
+            await message.channel.send("🛑 요청에 따라 생성을 중단했습니다.")
+            return
+        if job["status"] != "completed":
+            await message.channel.send(f"❌ 3D 생성 실패 ({job.get('error') or job['status']})")
+            return
+        unique_filename = f"Hy3D_textured_{get_random_hex()}.glb"
+        glb_path = os.path.join(OUTPUT_3D_DIR, unique_filename)
+        with span("discord.download_glb"):
+            await hy3d_api.download(job["outputs"]["glb"]["url"], glb_path, timeout=DOWNLOAD_TIMEOUT)
+        print(f"[TRACE] {job.get('trace_id')} server timings: {job.get('timings')}")
+
+        await message.channel.send("✅ 3D 모델 생성 완료!", file=discord.File(glb_path))
+
+    except ServiceUnavailable as e:
+        # 서버가 내려가 있으면 바로 알려주고 재시도를 쌓지 않는다
+        await message.channel.send(f"🚧 {e} 잠시 후 다시 시도해 주세요.")
+    except Exception as e:
+        await message.channel.send(f"❌ 3D 생성 중 오류 발생: {e}")
+
+async def follow_pipeline(message, job, progress_message):
+    # 작업이 끝날 때까지 상태를 조회하며 중간 결과를 보내고 진행 메시지를 갱신, 끝난 작업 정보를 반환
+    sent = set()
+    shown = progress_message.content
+    while job["status"] not in ("completed", "failed", "cancelled"):
+        await asyncio.sleep(HY3D_POLL_INTERVAL)
+        if progress_message.id in cancel_requested:
+            return await mv_api.request("DELETE", f"/jobs/{job['job_id']}", idempotent=True)
+        job = await mv_api.get_json(f"/jobs/{job['job_id']}")
+        line = progress_line(job)
+        if line != shown and job["status"] not in ("completed", "failed", "cancelled"):
+            try:
+                await progress_message.edit(content=line)
+                shown = line
+            except discord.HTTPException:
+                pass
+        partial = job.get("partial") or {}
+        if "image" in partial and "image" not in sent:
+            reference_path = os.path.join(OUTPUT_DIR, partial["image"]["filename"])
+            await message.channel.send("🎨 텍스처 이미지 생성 중...", file=discord.File(reference_path))
+            sent.add("image")
+        if "views" in partial and "views" not in sent:
+            await message.channel.send("🧊 GLB 생성 중...")
+            sent.add("views")
+        if "mesh" in partial and "mesh" not in sent:
+            mesh_path = os.path.join(OUTPUT_3D_DIR, f"Hy3D_mesh_{get_random_hex()}.glb")
+            await hy3d_api.download(partial["mesh"]["url"], mesh_path, timeout=DOWNLOAD_TIMEOUT)
+            await message.channel.send("🧱 메시 먼저 도착! 텍스처 입히는 중...", file=discord.File(mesh_path))
+            sent.add("mesh")
+    return job
 
-        except Exception as e:
-            await message.channel.send(f"❌ 3D 생성 중 오류 발생: {e}")
 
 client.run(DISCORD_TOKEN)
\ No newline at end of file
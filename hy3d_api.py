@@ -1,22 +1,42 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import aiohttp
 import tempfile
 import os
-import json
+import shutil
+import hashlib
 import time
-import glob
-from urllib import request as urlrequest
+import uuid
 from dotenv import load_dotenv
 load_dotenv()
 
+from core.comfy_client import get_client, close_clients, output_model_file, ComfyUnavailable, ExecutionTimeout
+from core.jobs import JobStore, create_job_router
+from core.cache import FileCache
+from core.artifacts import ArtifactIndex, KIND_GLB, KIND_MESH
+from core.workflows import get_registry, RenderedWorkflow
+from core.graph import report_workflow
+from core.alpha import reusable_alpha
+from core.glb import compact_glb
+from core.backends import get_pool, close_pools, NoBackendAvailable
+from core.tracing import TraceMiddleware, span
+from core.metrics import (
+    MetricsMiddleware, create_metrics_router, register_job_gauges, register_backend_gauges,
+    track, count_errors, observe_execution
+)
+
 # =========================
 # 설정
 # =========================
 
-# ComfyUI 프롬프트 서버 주소
+# 기본 ComfyUI 프롬프트 서버 주소 (COMFY_BACKENDS_HY3D 로 여러 대 지정)
 comfy_ip = "127.0.0.1:8188"
 
+# Hy3D ComfyUI 백엔드 풀 (제출마다 가장 한가한 정상 인스턴스로 배정)
+hy3d_pool = get_pool("hy3d", comfy_ip)
+
 # GLB 저장 위치
 output_dir = os.getenv("OUTPUT_3D_DIR", "output")
 os.makedirs(output_dir, exist_ok=True)
@@ -24,935 +44,341 @@ os.makedirs(output_dir, exist_ok=True)
 TMP_DIR = "tmp"
 os.makedirs(TMP_DIR, exist_ok=True)
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 뷰 이미지를 ComfyUI /upload/image 로 올려 LoadImage 에 넘긴다 (0 이면 로컬 tmp 경로 전달, 같은 파일시스템일 때만 동작)
+UPLOAD_TO_COMFY = os.getenv("HY3D_UPLOAD_TO_COMFY", "1") == "1"
+UPLOAD_SUBFOLDER = os.getenv("HY3D_UPLOAD_SUBFOLDER", "hy3d")  # ComfyUI input 아래 업로드 폴더
+
+# 워크플로우 템플릿은 시작 시 한 번만 로드
+workflow_registry = get_registry()
+
+# 생성물 인덱스 (클라이언트가 디렉토리 스캔 대신 조회)
+artifacts = ArtifactIndex(os.getenv("ARTIFACT_DB", os.path.join(output_dir, "artifacts.db")))
+
+# 텍스처 GLB(Hy3DExportMesh 99) 경로를 history 에 남기는 Preview3D 노드
+TEXTURED_PREVIEW_NODE = "154"
+
+# 텍스처 전 raw 메시(Hy3DExportMesh 17, 3D/Hy3D) 경로를 남기는 Preview3D 노드 (progressive 모드에서만 유지)
+UNTEXTURED_PREVIEW_NODE = "162"
+
+# 완성 GLB 경량화 (정점 양자화 + 텍스처 재압축, CPU) 기본 적용 여부와 기본 목표 용량(0 이면 제한 없음)
+COMPACT_GLB = os.getenv("HY3D_COMPACT_GLB", "0") == "1"
+GLB_MAX_BYTES = int(os.getenv("HY3D_GLB_MAX_BYTES", "0"))
+
+# 완성 GLB 캐시 (front/back/left 업로드 해시 → GLB)
+hy3d_cache = FileCache(
+    os.getenv("HY3D_CACHE_DIR", os.path.join("cache", "hy3d")),
+    int(os.getenv("HY3D_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    int(os.getenv("HY3D_CACHE_MAX_ENTRIES", "0"))
+)
+
 # =========================
 # FastAPI 앱 설정
 # =========================
 
 app = FastAPI()
+
+@app.on_event("shutdown")
+async def shutdown_comfy_clients():
+    await close_pools()
+    await close_clients()
+
 app.mount("/files", StaticFiles(directory=os.path.join(output_dir, "3D")), name="files")
 
+jobs = JobStore()
+app.include_router(create_job_router(jobs))
+
+# GET /metrics (Prometheus 텍스트 형식)
+app.add_middleware(MetricsMiddleware)
+# X-Trace-Id 로 받은 trace 를 이어받아 단계별 span 기록, 응답에 Server-Timing 헤더
+app.add_middleware(TraceMiddleware, service="hy3d_api")
+app.include_router(create_metrics_router())
+register_job_gauges(jobs)
+register_backend_gauges()
+
 # =========================
 # 유틸 함수
 # =========================
 
-def save_upload_file(upload_file: UploadFile, suffix: str) -> str:
+# 업로드를 고정 크기 청크로 읽어 tmp 에 쓰면서 해시 (요청 수와 무관하게 메모리 사용량 일정)
+async def save_upload_file(upload_file: UploadFile, suffix: str, hasher=None) -> str:
     fd, path = tempfile.mkstemp(suffix=suffix, dir=TMP_DIR)
     with os.fdopen(fd, "wb") as f:
-        f.write(upload_file.file.read())
+        while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+            f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
     return path
 
-def queue_prompt(prompt_workflow: dict, ip: str) -> str:
-    data = json.dumps({"prompt": prompt_workflow}).encode("utf-8")
-    req = urlrequest.Request(f"http://{ip}/prompt", data=data)
-    res = urlrequest.urlopen(req)
-    return json.loads(res.read().decode("utf-8"))['prompt_id']
-
-def check_progress(prompt_id: str, ip: str) -> dict:
-    while True:
-        req = urlrequest.Request(f"http://{ip}/history/{prompt_id}")
-        res = urlrequest.urlopen(req)
-        history = json.loads(res.read().decode("utf-8"))
-        if prompt_id in history:
-            return history[prompt_id]
-        time.sleep(3)
+# 티어 이름 확인 (정의되지 않은 티어는 400)
+def resolve_tier(tier: str = None) -> str:
+    try:
+        return workflow_registry.resolve_tier(tier)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+
+# front/back/left 를 저장하면서 해시를 계산해 캐시 키(뷰 세트 해시 + 티어)를 만든다
+# 반환: (tmp 경로 목록, 캐시 키, ComfyUI 업로드 이름 목록 - 내용 해시 기반이라 같은 이미지는 덮어쓴다)
+async def save_view_uploads(front: UploadFile, back: UploadFile, left: UploadFile, tier: str = None):
+    paths = []
+    digests = []
+    for upload in (front, back, left):
+        hasher = hashlib.sha256()
+        paths.append(await save_upload_file(upload, ".png", hasher))
+        digests.append(hasher.hexdigest())
+    view_key = hashlib.sha256(":".join(digests + [tier or ""]).encode("utf-8")).hexdigest()
+    return paths, view_key, [f"{digest}.png" for digest in digests]
+
+# tmp 의 뷰 이미지를 ComfyUI 로 스트리밍 업로드하고 LoadImage 에 넣을 이름을 돌려준다
+async def push_view_images(paths: list, ip: str, names: list = None) -> list:
+    if not UPLOAD_TO_COMFY:
+        return paths
+    names = names or [os.path.basename(path) for path in paths]
+    client = get_client(ip)
+    return list(await asyncio.gather(*(
+        client.upload_image(path, name, UPLOAD_SUBFOLDER) for path, name in zip(paths, names)
+    )))
+
+# ComfyUI output 기준 상대 경로의 모델 파일을 output_dir 에 확정 (로컬에 없으면 /view 로 받아 저장)
+async def materialize_model_file(model_file: str, ip: str) -> str:
+    subfolder, filename = os.path.split(model_file)
+    glb_path = os.path.join(output_dir, subfolder, filename)
+    if not os.path.exists(glb_path):
+        data = await get_client(ip).view(filename, subfolder, "output")
+        os.makedirs(os.path.dirname(glb_path), exist_ok=True)
+        with open(glb_path, "wb") as f:
+            f.write(data)
+    return glb_path
+
+async def queue_prompt(prompt_workflow, ip: str) -> str:
+    return await get_client(ip).queue_prompt(prompt_workflow)
+
+# 웹소켓 완료 이벤트로 즉시 깨어나고, 소켓이 끊긴 경우에만 history 폴링
+# 백엔드가 응답하지 않으면 풀에서 빼고 502, 티어별 최대 대기 시간을 넘기면 prompt 를 취소하고 504
+async def check_progress(prompt_id: str, ip: str, timeout: float = None, pool=None) -> dict:
+    try:
+        return await get_client(ip).wait_for_completion(prompt_id, timeout)
+    except ComfyUnavailable as e:
+        if pool is not None:
+            pool.mark_failed(ip)
+        raise HTTPException(status_code=502, detail=str(e))
+    except ExecutionTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
 # ---------------------------
 # Hy3D 워크플로우 생성 함수
 # ---------------------------
 
-def generate_hy3d_workflow(front_img: str, back_img: str, left_img: str) -> dict:
-    return {
-        "10": {
-            "inputs": {
-                "model": "hunyuan3d-dit-v2-0-fp16.safetensors",
-                "attention_mode": "sdpa",
-                "cublas_ops": False
-            },
-            "class_type": "Hy3DModelLoader",
-            "_meta": {
-                "title": "Hy3DModelLoader"
-            }
-        },
-        "17": {
-            "inputs": {
-                "filename_prefix": "3D/Hy3D",
-                "file_format": "glb",
-                "save_file": True,
-                "trimesh": [
-                    "203",
-                    0
-            ]
-            },
-            "class_type": "Hy3DExportMesh",
-            "_meta": {
-                "title": "Hy3DExportMesh"
-            }
-        },
-        "28": {
-            "inputs": {
-            "model": "hunyuan3d-delight-v2-0"
-            },
-            "class_type": "DownloadAndLoadHy3DDelightModel",
-            "_meta": {
-            "title": "(Down)Load Hy3D DelightModel"
-            }
-        },
-        "35": {
-            "inputs": {
-            "steps": 50,
-            "width": 512,
-            "height": 512,
-            "cfg_image": 1,
-            "seed": 0,
-            "delight_pipe": [
-                "28",
-                0
-            ],
-            "image": [
-                "64",
-                0
-            ],
-            "scheduler": [
-                "148",
-                0
-            ]
-            },
-            "class_type": "Hy3DDelightImage",
-            "_meta": {
-            "title": "Hy3DDelightImage"
-            }
-        },
-        "45": {
-            "inputs": {
-            "images": [
-                "35",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "이미지 미리보기"
-            }
-        },
-        "52": {
-            "inputs": {
-            "width": 518,
-            "height": 518,
-            "interpolation": "lanczos",
-            "method": "pad",
-            "condition": "always",
-            "multiple_of": 2,
-            "image": [
-                "157",
-                0
-            ]
-            },
-            "class_type": "ImageResize+",
-            "_meta": {
-            "title": "🔧 Image Resize"
-            }
-        },
-        "55": {
-            "inputs": {
-            "mode": "base",
-            "use_jit": True
-            },
-            "class_type": "TransparentBGSession+",
-            "_meta": {
-            "title": "🔧 InSPyReNet TransparentBG"
-            }
-        },
-        "56": {
-            "inputs": {
-            "rembg_session": [
-                "55",
-                0
-            ],
-            "image": [
-                "52",
-                0
-            ]
-            },
-            "class_type": "ImageRemoveBackground+",
-            "_meta": {
-            "title": "🔧 Image Remove Background"
-            }
-        },
-        "61": {
-            "inputs": {
-            "camera_azimuths": "0, 90, 180, 270, 0, 180",
-            "camera_elevations": "0, 0, 0, 0, 90, -90",
-            "view_weights": "1, 0.1, 0.5, 0.1, 0.05, 0.05",
-            "camera_distance": 1.45,
-            "ortho_scale": 1.2
-            },
-            "class_type": "Hy3DCameraConfig",
-            "_meta": {
-            "title": "Hy3D Camera Config"
-            }
-        },
-        "64": {
-            "inputs": {
-            "x": 0,
-            "y": 0,
-            "resize_source": False,
-            "destination": [
-                "184",
-                0
-            ],
-            "source": [
-                "166",
-                1
-            ],
-            "mask": [
-                "166",
-                2
-            ]
-            },
-            "class_type": "ImageCompositeMasked",
-            "_meta": {
-            "title": "마스크된 이미지 합성"
-            }
-        },
-        "79": {
-            "inputs": {
-            "render_size": 1024,
-            "texture_size": 2048,
-            "normal_space": "world",
-            "trimesh": [
-                "83",
-                0
-            ],
-            "camera_config": [
-                "61",
-                0
-            ]
-            },
-            "class_type": "Hy3DRenderMultiView",
-            "_meta": {
-            "title": "Hy3D Render MultiView"
-            }
-        },
-        "83": {
-            "inputs": {
-            "trimesh": [
-                "203",
-                0
-            ]
-            },
-            "class_type": "Hy3DMeshUVWrap",
-            "_meta": {
-            "title": "Hy3D Mesh UV Wrap"
-            }
-        },
-        "85": {
-            "inputs": {
-            "model": "hunyuan3d-paint-v2-0"
-            },
-            "class_type": "DownloadAndLoadHy3DPaintModel",
-            "_meta": {
-            "title": "(Down)Load Hy3D PaintModel"
-            }
-        },
-        "88": {
-            "inputs": {
-            "view_size": 512,
-            "steps": 25,
-            "seed": 1024,
-            "denoise_strength": 1,
-            "pipeline": [
-                "85",
-                0
-            ],
-            "ref_image": [
-                "35",
-                0
-            ],
-            "normal_maps": [
-                "79",
-                0
-            ],
-            "position_maps": [
-                "79",
-                1
-            ],
-            "camera_config": [
-                "61",
-                0
-            ],
-            "scheduler": [
-                "149",
-                0
-            ]
-            },
-            "class_type": "Hy3DSampleMultiView",
-            "_meta": {
-            "title": "Hy3D Sample MultiView"
-            }
-        },
-        "90": {
-            "inputs": {
-            "images": [
-                "79",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "이미지 미리보기"
-            }
-        },
-        "92": {
-            "inputs": {
-            "images": [
-                "117",
-                0
-            ],
-            "renderer": [
-                "79",
-                2
-            ],
-            "camera_config": [
-                "61",
-                0
-            ]
-            },
-            "class_type": "Hy3DBakeFromMultiview",
-            "_meta": {
-            "title": "Hy3D Bake From Multiview"
-            }
-        },
-        "98": {
-            "inputs": {
-            "texture": [
-                "104",
-                0
-            ],
-            "renderer": [
-                "129",
-                2
-            ]
-            },
-            "class_type": "Hy3DApplyTexture",
-            "_meta": {
-            "title": "Hy3D Apply Texture"
-            }
-        },
-        "99": {
-            "inputs": {
-            "filename_prefix": "3D/Hy3D_textured",
-            "file_format": "glb",
-            "save_file": True,
-            "trimesh": [
-                "98",
-                0
-            ]
-            },
-            "class_type": "Hy3DExportMesh",
-            "_meta": {
-            "title": "Hy3DExportMesh"
-            }
-        },
-        "104": {
-            "inputs": {
-            "inpaint_radius": 3,
-            "inpaint_method": "ns",
-            "texture": [
-                "129",
-                0
-            ],
-            "mask": [
-                "129",
-                1
-            ]
-            },
-            "class_type": "CV2InpaintTexture",
-            "_meta": {
-            "title": "CV2 Inpaint Texture"
-            }
-        },
-        "111": {
-            "inputs": {
-            "images": [
-                "88",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "Preview Image: Multiview results"
-            }
-        },
-        "116": {
-            "inputs": {
-            "images": [
-                "79",
-                1
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "이미지 미리보기"
-            }
-        },
-        "117": {
-            "inputs": {
-            "width": 2048,
-            "height": 2048,
-            "interpolation": "lanczos",
-            "method": "stretch",
-            "condition": "always",
-            "multiple_of": 0,
-            "image": [
-                "88",
-                0
-            ]
-            },
-            "class_type": "ImageResize+",
-            "_meta": {
-            "title": "🔧 Image Resize"
-            }
-        },
-        "125": {
-            "inputs": {
-            "images": [
-                "92",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "Preview Image: Initial baked texture"
-            }
-        },
-        "126": {
-            "inputs": {
-            "images": [
-                "129",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "Preview Image: vertex inpainted texture"
-            }
-        },
-        "127": {
-            "inputs": {
-            "images": [
-                "104",
-                0
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "Preview Image: fully inpainted texture"
-            }
-        },
-        "129": {
-            "inputs": {
-            "texture": [
-                "92",
-                0
-            ],
-            "mask": [
-                "92",
-                1
-            ],
-            "renderer": [
-                "92",
-                2
-            ]
-            },
-            "class_type": "Hy3DMeshVerticeInpaintTexture",
-            "_meta": {
-            "title": "Hy3D Mesh Vertice Inpaint Texture"
-            }
-        },
-        "132": {
-            "inputs": {
-            "value": 0.8,
-            "width": 512,
-            "height": 512
-            },
-            "class_type": "SolidMask",
-            "_meta": {
-            "title": "단색 마스크"
-            }
-        },
-        "133": {
-            "inputs": {
-            "mask": [
-                "132",
-                0
-            ]
-            },
-            "class_type": "MaskToImage",
-            "_meta": {
-            "title": "마스크를 이미지로 변환"
-            }
-        },
-        "138": {
-            "inputs": {
-            "mask": [
-                "56",
-                1
-            ]
-            },
-            "class_type": "MaskPreview+",
-            "_meta": {
-            "title": "🔧 Mask Preview"
-            }
-        },
-        "140": {
-            "inputs": {
-            "box_v": 1.01,
-            "octree_resolution": 256,
-            "num_chunks": 32000,
-            "mc_level": 0,
-            "mc_algo": "mc",
-            "enable_flash_vdm": True,
-            "force_offload": True,
-            "vae": [
-                "10",
-                1
-            ],
-            "latents": [
-                "166",
-                0
-            ]
-            },
-            "class_type": "Hy3DVAEDecode",
-            "_meta": {
-            "title": "Hy3D VAE Decode"
-            }
-        },
-        "148": {
-            "inputs": {
-            "scheduler": "Euler A",
-            "sigmas": "default",
-            "pipeline": [
-                "28",
-                0
-            ]
-            },
-            "class_type": "Hy3DDiffusersSchedulerConfig",
-            "_meta": {
-            "title": "Hy3D Diffusers Scheduler Config"
-            }
-        },
-        "149": {
-            "inputs": {
-            "scheduler": "DPM++",
-            "sigmas": "default",
-            "pipeline": [
-                "85",
-                0
-            ]
-            },
-            "class_type": "Hy3DDiffusersSchedulerConfig",
-            "_meta": {
-            "title": "Hy3D Diffusers Scheduler Config"
-            }
-        },
-        "154": {
-            "inputs": {
-            "model_file": [
-                "99",
-                0
-            ],
-            "image": ""
-            },
-            "class_type": "Preview3D",
-            "_meta": {
-            "title": "3D 미리보기"
-            }
-        },
-        "157": {
-            "inputs": {
-            "image": front_img
-            },
-            "class_type": "LoadImage",
-            "_meta": {
-            "title": "Load Image: Front"
-            }
-        },
-        "159": {
-            "inputs": {
-            "image": back_img
-            },
-            "class_type": "LoadImage",
-            "_meta": {
-            "title": "Load Image: Back"
-            }
-        },
-        "160": {
-            "inputs": {
-            "image": left_img
-            },
-            "class_type": "LoadImage",
-            "_meta": {
-            "title": "Load Image: Left"
-            }
-        },
-        "162": {
-            "inputs": {
-            "model_file": [
-                "17",
-                0
-            ],
-            "image": ""
-            },
-            "class_type": "Preview3D",
-            "_meta": {
-            "title": "3D 미리보기"
-            }
-        },
-        "163": {
-            "inputs": {
-            "render_type": "normal",
-            "render_size": 1024,
-            "camera_type": "orth",
-            "camera_distance": 1.45,
-            "pan_x": 0,
-            "pan_y": 0,
-            "ortho_scale": 1.2,
-            "azimuth": 146.666748046875,
-            "elevation": 0,
-            "bg_color": "128, 128, 255",
-            "trimesh": [
-                "203",
-                0
-            ]
-            },
-            "class_type": "Hy3DRenderSingleView",
-            "_meta": {
-            "title": "Hy3D Render SingleView"
-            }
-        },
-        "166": {
-            "inputs": {
-            "guidance_scale": 5.5,
-            "steps": 30,
-            "seed": 416935455784444,
-            "scheduler": "FlowMatchEulerDiscreteScheduler",
-            "pipeline": [
-                "10",
-                0
-            ],
-            "front": [
-                "195",
-                0
-            ],
-            "left": [
-                "196",
-                0
-            ],
-            "back": [
-                "198",
-                0
-            ]
-            },
-            "class_type": "Hy3DGenerateMeshMultiView",
-            "_meta": {
-            "title": "Hy3DGenerateMeshMultiView"
-            }
-        },
-        "170": {
-            "inputs": {
-            "rembg_session": [
-                "55",
-                0
-            ],
-            "image": [
-                "171",
-                0
-            ]
-            },
-            "class_type": "ImageRemoveBackground+",
-            "_meta": {
-            "title": "🔧 Image Remove Background"
-            }
-        },
-        "171": {
-            "inputs": {
-            "width": 518,
-            "height": 518,
-            "interpolation": "lanczos",
-            "method": "pad",
-            "condition": "always",
-            "multiple_of": 2,
-            "image": [
-                "160",
-                0
-            ]
-            },
-            "class_type": "ImageResize+",
-            "_meta": {
-            "title": "🔧 Image Resize"
-            }
-        },
-        "174": {
-            "inputs": {
-            "mask": [
-                "170",
-                1
-            ]
-            },
-            "class_type": "MaskPreview+",
-            "_meta": {
-            "title": "🔧 Mask Preview"
-            }
-        },
-        "176": {
-            "inputs": {
-            "width": 518,
-            "height": 518,
-            "interpolation": "lanczos",
-            "method": "pad",
-            "condition": "always",
-            "multiple_of": 2,
-            "image": [
-                "159",
-                0
-            ]
-            },
-            "class_type": "ImageResize+",
-            "_meta": {
-            "title": "🔧 Image Resize"
-            }
-        },
-        "177": {
-            "inputs": {
-            "rembg_session": [
-                "55",
-                0
-            ],
-            "image": [
-                "176",
-                0
-            ]
-            },
-            "class_type": "ImageRemoveBackground+",
-            "_meta": {
-            "title": "🔧 Image Remove Background"
-            }
-        },
-        "178": {
-            "inputs": {
-            "mask": [
-                "177",
-                1
-            ]
-            },
-            "class_type": "MaskPreview+",
-            "_meta": {
-            "title": "🔧 Mask Preview"
-            }
-        },
-        "182": {
-            "inputs": {
-            "images": [
-                "166",
-                1
-            ]
-            },
-            "class_type": "PreviewImage",
-            "_meta": {
-            "title": "이미지 미리보기"
-            }
-        },
-        "183": {
-            "inputs": {
-            "mask": [
-                "166",
-                2
-            ]
-            },
-            "class_type": "MaskPreview+",
-            "_meta": {
-            "title": "🔧 Mask Preview"
-            }
-        },
-        "184": {
-            "inputs": {
-            "amount": [
-                "185",
-                0
-            ],
-            "image": [
-                "133",
-                0
-            ]
-            },
-            "class_type": "RepeatImageBatch",
-            "_meta": {
-            "title": "이미지 반복 배치 생성"
-            }
-        },
-        "185": {
-            "inputs": {
-            "batch": [
-                "166",
-                1
-            ]
-            },
-            "class_type": "BatchCount+",
-            "_meta": {
-            "title": "🔧 Batch Count"
-            }
-        },
-        "195": {
-            "inputs": {
-            "image": [
-                "52",
-                0
-            ],
-            "alpha": [
-                "202",
-                0
-            ]
-            },
-            "class_type": "JoinImageWithAlpha",
-            "_meta": {
-            "title": "알파와 함께 이미지 결합"
-            }
-        },
-        "196": {
-            "inputs": {
-            "image": [
-                "171",
-                0
-            ],
-            "alpha": [
-                "199",
-                0
-            ]
-            },
-            "class_type": "JoinImageWithAlpha",
-            "_meta": {
-            "title": "알파와 함께 이미지 결합"
-            }
-        },
-        "198": {
-            "inputs": {
-            "image": [
-                "176",
-                0
-            ],
-            "alpha": [
-                "201",
-                0
-            ]
-            },
-            "class_type": "JoinImageWithAlpha",
-            "_meta": {
-            "title": "알파와 함께 이미지 결합"
-            }
-        },
-        "199": {
-            "inputs": {
-            "mask": [
-                "170",
-                1
-            ]
-            },
-            "class_type": "InvertMask",
-            "_meta": {
-            "title": "마스크 반전"
-            }
-        },
-        "201": {
-            "inputs": {
-            "mask": [
-                "177",
-                1
-            ]
-            },
-            "class_type": "InvertMask",
-            "_meta": {
-            "title": "마스크 반전"
-            }
-        },
-        "202": {
-            "inputs": {
-            "mask": [
-                "56",
-                1
-            ]
-            },
-            "class_type": "InvertMask",
-            "_meta": {
-            "title": "마스크 반전"
-            }
-        },
-        "203": {
-            "inputs": {
-            "remove_floaters": True,
-            "remove_degenerate_faces": True,
-            "reduce_faces": True,
-            "max_facenum": 50000,
-            "smooth_normals": False,
-            "trimesh": [
-                "140",
-                0
-            ]
-            },
-            "class_type": "Hy3DPostprocessMesh",
-            "_meta": {
-            "title": "Hy3D Postprocess Mesh"
-            }
-        },
-        "204": {
-            "inputs": {
-            "INPUT_mesh_key": [
-                "99",
-                0
-            ],
-            "filename_prefix": "mesh/ComfyUI"
-            },
-            "class_type": "SaveGLB_motorway_edition",
-            "_meta": {
-            "title": "SaveGLB_motorway_edition"
-            }
-        }
-        }
+# workflows/hy3d 템플릿에 세 뷰 이미지 경로만 패치
+# progressive 이면 raw 메시 미리보기(162)까지 남겨 텍스처 체인보다 먼저 메시 경로를 받는다
+def generate_hy3d_workflow(front_img: str, back_img: str, left_img: str, tier: str = None, progressive: bool = False, alpha: bool = False, **slots) -> RenderedWorkflow:
+    # alpha=True 면 뷰 이미지의 알파를 마스크로 쓰는 변형(hy3d_alpha)으로 뷰별 InSPyReNet 배경 제거를 건너뛴다
+    outputs = [TEXTURED_PREVIEW_NODE, UNTEXTURED_PREVIEW_NODE] if progressive else None
+    name = "hy3d_alpha" if alpha else "hy3d"
+    return workflow_registry.render(name, tier=tier, outputs=outputs, front_image=front_img, back_image=back_img, left_image=left_img, **slots)
+
+# raw 메시를 받아 job 의 중간 결과로 공개
+async def publish_untextured_mesh(model_file: str, run_id: str, ip: str, job=None):
+    mesh_path = await materialize_model_file(model_file, ip)
+    artifacts.record(run_id, KIND_MESH, os.path.relpath(mesh_path, output_dir), "hy3d_mesh")
+    mesh_name = os.path.basename(mesh_path)
+    print(f"[HY3D] untextured mesh ready: {mesh_name}")
+    if job is not None:
+        job.add_partial("mesh", {"filename": mesh_name, "url": f"/files/{mesh_name}"})
+        job.set_stage("mesh_ready")
+
+# raw 메시 노드(162)의 executed 이벤트가 오는 즉시 공개 태스크를 띄운다
+def watch_untextured_mesh(prompt_id: str, run_id: str, ip: str, job=None) -> list:
+    tasks = []
+
+    def on_output(node_id, output):
+        if node_id != UNTEXTURED_PREVIEW_NODE or tasks:
+            return
+        model_file = output_model_file({"outputs": {node_id: output}}, node_id)
+        if model_file:
+            tasks.append(asyncio.create_task(publish_untextured_mesh(model_file, run_id, ip, job)))
+
+    get_client(ip).watch_outputs(prompt_id, on_output)
+    return tasks
 
 # ---------------------------
 # Hy3D 실행 API
 # ---------------------------
 
+async def run_generate_hy3d(front_img: str, back_img: str, left_img: str, view_key: str = None, tier: str = None, progressive: bool = False, upload_names: list = None, job=None, run_id: str = None) -> str:
+    run_id = job.id if job is not None else run_id or uuid.uuid4().hex
+
+    # 같은 뷰 세트로 만든 GLB 가 캐시에 있으면 바로 반환 (캐시 디스크 IO 는 이벤트 루프를 막지 않도록 스레드에서)
+    if view_key:
+        cached = await asyncio.to_thread(hy3d_cache.get, view_key)
+        if cached is not None:
+            cache_path, meta = cached
+            glb_path = os.path.join(output_dir, "3D", meta["filename"])
+            if not os.path.exists(glb_path):
+                await asyncio.to_thread(shutil.copyfile, cache_path, glb_path)
+            if job is not None:
+                job.set_stage("cache_hit")
+            artifacts.record(run_id, KIND_GLB, os.path.relpath(glb_path, output_dir), "hy3d")
+            return glb_path
+
+    # 세 뷰 모두 배경이 지워진 RGBA 면 배경 제거 없는 변형 워크플로우 사용 (지표/trace 는 변형 이름으로 집계)
+    alpha = await reusable_alpha([front_img, back_img, left_img])
+    endpoint = "hy3d_alpha" if alpha else hy3d_pool.name
+
+    # 풀에서 가장 한가한 백엔드를 골라 뷰 이미지를 올린 뒤 워크플로우 생성 및 실행
+    try:
+        ip = hy3d_pool.acquire()
+    except NoBackendAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        if job is not None:
+            job.set_stage("uploading")
+        with track("upload", hy3d_pool.name, ip):
+            front_img, back_img, left_img = await push_view_images([front_img, back_img, left_img], ip, upload_names)
+        # 가끔 가지치기하지 않은 원본으로 실행해 제거 노드의 비용 표본을 모은다
+        prompt_workflow = workflow_registry.cost_sample(generate_hy3d_workflow(front_img, back_img, left_img, tier, progressive, alpha))
+        with track("submit", endpoint, ip):
+            prompt_id = await queue_prompt(prompt_workflow, ip)
+        submitted_at = time.monotonic()
+        if job is not None:
+            job.attach_prompt(prompt_id, ip, prompt_workflow)
+        mesh_tasks = watch_untextured_mesh(prompt_id, run_id, ip, job) if progressive else []
+        try:
+            with count_errors("execution", endpoint, ip):
+                result = await check_progress(prompt_id, ip, workflow_registry.timeout(endpoint, tier), hy3d_pool)
+            observe_execution(endpoint, ip, submitted_at, get_client(ip).pop_execution_start(prompt_id))
+            await asyncio.gather(*mesh_tasks)
+            # 웹소켓이 끊겨 executed 이벤트를 놓쳤다면 history 의 raw 메시 출력으로 대신 공개
+            if progressive and not mesh_tasks:
+                model_file = output_model_file(result, UNTEXTURED_PREVIEW_NODE)
+                if model_file:
+                    await publish_untextured_mesh(model_file, run_id, ip, job)
+        finally:
+            get_client(ip).unwatch_outputs(prompt_id)
+    except aiohttp.ClientConnectionError:
+        hy3d_pool.mark_failed(ip)
+        raise
+    finally:
+        hy3d_pool.release(ip)
+    if job is not None:
+        job.set_stage("collecting_outputs")
+
+    # 가지치기/변형으로 건너뛴 노드와 추정 절감 시간 기록
+    reports = report_workflow(prompt_workflow, get_client(ip).pop_node_durations(prompt_id))
+    if job is not None:
+        job.info.update(reports)
+
+    # 텍스처 GLB(99) 경로를 history 의 Preview3D(154) 출력에서 그대로 가져온다
+    model_file = output_model_file(result, TEXTURED_PREVIEW_NODE)
+    if not model_file:
+        raise HTTPException(status_code=404, detail="Hy3D GLB 파일을 찾을 수 없습니다.")
+    with track("retrieval", hy3d_pool.name, ip):
+        glb_path = await materialize_model_file(model_file, ip)
+    artifacts.record(run_id, KIND_GLB, os.path.relpath(glb_path, output_dir), "hy3d")
+    if view_key:
+        await asyncio.to_thread(hy3d_cache.put, view_key, glb_path, {"filename": os.path.basename(glb_path)})
+    return glb_path
+
+# 완성 GLB 를 경량화해 <이름>_compact.glb 로 저장 (이벤트 루프를 막지 않도록 스레드에서 실행)
+async def compact_output(glb_path: str, run_id: str, max_bytes: int = 0, job=None):
+    if job is not None:
+        job.set_stage("compacting")
+    compact_path = os.path.splitext(glb_path)[0] + "_compact.glb"
+    with span("hy3d.compact"):
+        report = await asyncio.to_thread(compact_glb, glb_path, compact_path, max_bytes)
+    print(f"[GLB] {os.path.basename(glb_path)}: {report['before_bytes']} -> {report['after_bytes']} bytes ({report['seconds']}s)")
+    artifacts.record(run_id, KIND_GLB, os.path.relpath(compact_path, output_dir), "hy3d_compact")
+    if job is not None:
+        job.info["compaction"] = report
+    return compact_path, report
+
+def wants_compact(compact: bool = None, max_bytes: int = None) -> bool:
+    return bool(max_bytes or GLB_MAX_BYTES) or (COMPACT_GLB if compact is None else compact)
+
+def remove_files(paths):
+    for f in paths:
+        if os.path.exists(f):
+            os.remove(f)
+
 @app.post("/generate_hy3d")
 async def generate_hy3d(
     front: UploadFile = File(...),
     back: UploadFile = File(...),
-    left: UploadFile = File(...)
+    left: UploadFile = File(...),
+    tier: str = Form(None),  # draft / standard / final (없으면 기본 티어)
+    compact: bool = Form(None),  # GLB 경량화 (생략 시 HY3D_COMPACT_GLB)
+    max_bytes: int = Form(None)  # 경량화 목표 용량 (예: Discord 첨부 한도)
 ):
+    tier = resolve_tier(tier)
+    run_id = uuid.uuid4().hex  # 원본/경량화 GLB 를 같은 작업 id 로 인덱싱
+    uploads = []
     try:
-        # 업로드된 파일 저장
-        front_img = save_upload_file(front, ".png")
-        back_img = save_upload_file(back, ".png")
-        left_img = save_upload_file(left, ".png")
-
-        # 워크플로우 생성 및 실행
-        prompt_workflow = generate_hy3d_workflow(front_img, back_img, left_img)
-        prompt_id = queue_prompt(prompt_workflow, comfy_ip)
-        _ = check_progress(prompt_id, comfy_ip)
-
-        # 최신 GLB 파일 반환
-        glb_files = glob.glob(os.path.join(output_dir, "3D", "Hy3D_textured*.glb"))
-        glb_files.sort(key=os.path.getmtime, reverse=True)
-        if not glb_files:
-            raise HTTPException(status_code=404, detail="Hy3D GLB 파일을 찾을 수 없습니다.")
+        # 업로드된 파일 저장 (저장하면서 뷰 세트 해시 계산)
+        uploads, view_key, upload_names = await save_view_uploads(front, back, left, tier)
 
+        glb_path = await run_generate_hy3d(*uploads, view_key=view_key, tier=tier, upload_names=upload_names, run_id=run_id)
+        headers = {}
+        if wants_compact(compact, max_bytes):
+            glb_path, report = await compact_output(glb_path, run_id, max_bytes or GLB_MAX_BYTES)
+            headers = {
+                "X-GLB-Original-Bytes": str(report["before_bytes"]),
+                "X-GLB-Compact-Bytes": str(report["after_bytes"]),
+                "X-GLB-Compact-Seconds": str(report["seconds"]),
+            }
         return FileResponse(
-            glb_files[0],
-            filename=os.path.basename(glb_files[0]),
-            media_type="application/octet-stream"
+            glb_path,
+            filename=os.path.basename(glb_path),
+            media_type="application/octet-stream",
+            headers=headers
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        for f in [front_img, back_img, left_img]:
-            if os.path.exists(f):
-                os.remove(f)
\ No newline at end of file
+        remove_files(uploads)
+
+# 백엔드 풀 상태 (헬스, 대기열 깊이, 배정 수)
+
+@app.get("/backends")
+async def backend_stats():
+    return [hy3d_pool.stats()]
+
+# GLB 캐시 통계
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return hy3d_cache.stats()
+
+# 비동기 작업 제출 (즉시 job_id 반환, 완료 후 outputs 의 url 로 GLB 다운로드)
+# progressive 모드에서는 raw 메시가 export 되는 즉시 partial.mesh 의 url 로 먼저 받을 수 있다
+
+@app.post("/jobs/generate_hy3d", status_code=202)
+async def submit_generate_hy3d_job(
+    front: UploadFile = File(...),
+    back: UploadFile = File(...),
+    left: UploadFile = File(...),
+    tier: str = Form(None),
+    progressive: bool = Form(False),  # true 면 텍스처 전 메시를 partial.mesh 로 먼저 공개
+    compact: bool = Form(None),
+    max_bytes: int = Form(None)
+):
+    tier = resolve_tier(tier)
+    # 업로드 파일은 응답 후 닫히므로 제출 시점에 저장해 둔다
+    uploads, view_key, upload_names = await save_view_uploads(front, back, left, tier)
+
+    async def runner(job):
+        try:
+            glb_path = await run_generate_hy3d(
+                *uploads, view_key=view_key, tier=tier, progressive=progressive, upload_names=upload_names, job=job
+            )
+        finally:
+            remove_files(uploads)
+        if wants_compact(compact, max_bytes):
+            glb_path, _ = await compact_output(glb_path, job.id, max_bytes or GLB_MAX_BYTES, job)
+        glb_name = os.path.basename(glb_path)
+        return {"filename": glb_name, "url": f"/files/{glb_name}", "tier": tier}
+
+    job = jobs.submit("generate_hy3d", runner)
+    return job.to_dict()
@@ -1,24 +1,32 @@
 import os
-import time
-import glob
 import streamlit as st
 import requests
 import zipfile
 import io
-import shutil
+import json
+import base64
+import uuid
 from dotenv import load_dotenv
 load_dotenv()
 
+from core.artifacts import ArtifactIndex, KIND_IMAGE
+
 # 환경 변수 설정 및 불러오기
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
 OUTPUT_IMAGE_FOLDER = OUTPUT_DIR
 FASTAPI_STATIC_DIR = os.path.join(OUTPUT_IMAGE_FOLDER, "3D")  # FastAPI static 서빙 디렉토리
 MVADAPTER_SERVER = os.getenv("MVADAPTER_SERVER")
 HY3D_SERVER = os.getenv("HY3D_SERVER")
+ARTIFACT_DB = os.getenv("ARTIFACT_DB", os.path.join(OUTPUT_DIR, "artifacts.db"))
+SSE_READ_TIMEOUT = 60  # 진행 상황 스트림 읽기 타임아웃(초), 서버가 15초마다 keepalive 를 보낸다
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(FASTAPI_STATIC_DIR, exist_ok=True)
 
+@st.cache_resource
+def get_artifact_index():
+    return ArtifactIndex(ARTIFACT_DB)
+
 # Streamlit 시작
 st.set_page_config(page_title="ComfyUI + MVAdapter REST", layout="centered")
 st.title("🧊 이미지 기반 3D 생성기 (REST 연동 버전)")
@@ -28,46 +36,119 @@ if "image_path" not in st.session_state:
     st.session_state.image_path = None
 if "glb_path" not in st.session_state:
     st.session_state.glb_path = None
+if "trace_id" not in st.session_state:
+    st.session_state.trace_id = uuid.uuid4().hex  # 이미지 → 텍스처 → GLB 한 흐름을 서버 trace 로 묶는 id
+if "active_job" not in st.session_state:
+    st.session_state.active_job = None  # 진행 상황을 보고 있는 서버 작업 (중단 버튼용)
 
-# 유틸 함수
-def find_latest_png(folder_path):
-    png_files = glob.glob(os.path.join(folder_path, '*.png'))
-    return max(png_files, key=os.path.getctime) if png_files else None
+# 생성 중에 중단 버튼을 누르면 스크립트가 처음부터 다시 실행되므로 여기서 서버 작업을 취소한다
+active_job = st.session_state.active_job
+if active_job and st.session_state.get(f"cancel_{active_job['job_id']}"):
+    try:
+        requests.delete(f"{active_job['server']}/jobs/{active_job['job_id']}", timeout=10)
+        st.warning("⏹️ 진행 중이던 생성을 중단했습니다.")
+    except Exception as e:
+        st.error(f"중단 요청 실패: {e}")
+    st.session_state.active_job = None
 
-def find_latest_named_images(folder, name_keys):
-    result = {}
-    for key in name_keys:
-        files = glob.glob(os.path.join(folder, f"*{key}*.png"))
-        result[key] = max(files, key=os.path.getmtime) if files else None
-    return result
+# 유틸 함수 (출력 폴더 스캔 대신 생성물 인덱스 조회)
+def find_latest_png(folder_path, job_id=None):
+    row = get_artifact_index().latest(KIND_IMAGE, job_id=job_id)
+    return os.path.join(folder_path, row["path"]) if row else None
 
-def find_latest_glb(directory):
-    glb_files = glob.glob(os.path.join(directory, "Hy3D_textured*.glb"))
-    return os.path.basename(max(glb_files, key=os.path.getmtime)) if glb_files else None
+def find_latest_named_images(folder, name_keys, job_id=None):
+    views = get_artifact_index().latest_views(name_keys, job_id)
+    return {key: os.path.join(folder, path) if path else None for key, path in views.items()}
 
 def get_random_hex():
     return os.urandom(8).hex()
 
+def trace_headers():
+    return {"X-Trace-Id": st.session_state.trace_id}
+
+def show_timings(timing):
+    # 서버가 돌려준 단계별 소요 시간 (Server-Timing 헤더 / 작업의 timings)
+    if isinstance(timing, dict):
+        timing = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timing.items())
+    if timing:
+        st.caption(f"⏱️ {timing} (trace {st.session_state.trace_id})")
+
+def iter_sse(res):
+    # text/event-stream 응답을 (event, data) 로 나눈다
+    event, data = None, []
+    for line in res.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event or "message", json.loads("\n".join(data))
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+def progress_text(progress):
+    # 현재 노드 이름과 스텝, 워크플로우 전체 진행률(0~1)
+    node = progress.get("node_title") or progress.get("node") or ("결과 정리 중" if progress.get("nodes_done") else "대기 중")
+    step, steps = progress.get("step"), progress.get("steps")
+    text = f"🔄 {node}" + (f" ({step}/{steps} 스텝)" if steps else "")
+    total = progress.get("nodes_total")
+    if not total:
+        return text, None
+    done = progress.get("nodes_done") or 0
+    if steps:
+        done += step / steps
+    return text, min(1.0, done / total)
+
+def follow_job(server, job, on_status=None):
+    # 작업의 SSE 스트림으로 진행 노드/스텝/미리보기를 보여주고 끝난 작업 정보를 반환
+    # on_status(status) 는 단계나 중간 결과가 바뀔 때마다 호출된다
+    st.session_state.active_job = {"server": server, "job_id": job["job_id"]}
+    st.button("⏹️ 생성 중단", key=f"cancel_{job['job_id']}")
+    caption, bar, preview = st.empty(), st.progress(0.0), st.empty()
+    with requests.get(f"{server}/jobs/{job['job_id']}/events", stream=True, timeout=(5, SSE_READ_TIMEOUT)) as res:
+        res.raise_for_status()
+        for event, data in iter_sse(res):
+            if event == "progress":
+                text, fraction = progress_text(data)
+                caption.caption(text)
+                if fraction is not None:
+                    bar.progress(fraction)
+            elif event == "preview":
+                preview.image(base64.b64decode(data["image"].split(",", 1)[1]), caption="👀 생성 중 미리보기", width=256)
+            elif event == "status" and on_status is not None:
+                on_status(data)
+            elif event == "done":
+                job = data
+                break
+    st.session_state.active_job = None
+    caption.empty()
+    bar.empty()
+    preview.empty()
+    return job
+
 # Step 1. 프롬프트로 이미지 생성
 st.header("1️⃣ 프롬프트로 이미지 생성")
 prompt = st.text_input("✨ 프롬프트 입력", "a single pepper, vibrant red hot chili pepper")
 negative = st.text_input("🚫 네거티브 프롬프트", "shadow")
 
 if st.button("🚀 이미지 생성 요청"):
-    with st.spinner("ComfyUI 서버 호출 중..."):
-        try:
-            res = requests.post(
-                f"{MVADAPTER_SERVER}/generate",
-                json={"user_prompt": prompt, "user_negative": negative}
-            )
-            if res.status_code == 200 and res.json().get("status") == "completed":
-                time.sleep(2)
-                st.session_state.image_path = find_latest_png(OUTPUT_IMAGE_FOLDER)
-                st.success("✅ 이미지 생성 완료!")
-            else:
-                st.error("❌ 이미지 생성 실패 또는 서버 오류!")
-        except Exception as e:
-            st.error(f"예외 발생: {e}")
+    st.session_state.trace_id = uuid.uuid4().hex  # 새 생성 흐름
+    try:
+        # 작업으로 제출하고 진행 상황 스트림을 따라간다
+        res = requests.post(
+            f"{MVADAPTER_SERVER}/jobs/generate",
+            json={"user_prompt": prompt, "user_negative": negative},
+            headers=trace_headers()
+        )
+        job = follow_job(MVADAPTER_SERVER, res.json()) if res.status_code == 202 else None
+        if job and job["status"] == "completed" and job["outputs"].get("status") == "completed":
+            st.session_state.image_path = find_latest_png(OUTPUT_IMAGE_FOLDER, job["job_id"])
+            st.success("✅ 이미지 생성 완료!")
+            show_timings(job.get("timings"))
+        else:
+            st.error(f"❌ 이미지 생성 실패 또는 서버 오류! ({(job or {}).get('error') or (job or {}).get('status') or res.status_code})")
+    except Exception as e:
+        st.error(f"예외 발생: {e}")
 
 if st.session_state.image_path:
     st.image(st.session_state.image_path, caption="🖼 생성된 이미지", use_container_width=True)
@@ -77,36 +158,38 @@ if st.session_state.image_path:
 # Step 2. MVAdapter로 텍스처 이미지 생성
 st.header("2️⃣ 텍스처 이미지 생성")
 if st.session_state.image_path and st.button("🎨 텍스처 이미지 생성"):
-    with st.spinner("MVAdapter 서버에 요청 중..."):
-        try:
-            image_filename = os.path.basename(st.session_state.image_path)
-            res = requests.post(
-                f"{MVADAPTER_SERVER}/generate_mv_adapter",
-                json={"reference_filename": image_filename, "user_prompt": prompt}
-            )
-
-            if res.status_code == 200 and res.json().get("status") == "completed":
-                st.success("✅ 텍스처 이미지 생성 완료!")
-                named_imgs = find_latest_named_images(OUTPUT_IMAGE_FOLDER, ["front", "back", "left"])
-                if all(named_imgs.values()):
-                    cols = st.columns(3)
-                    for idx, (name, path) in enumerate(named_imgs.items()):
-                        with cols[idx]:
-                            st.image(path, caption=name, use_container_width=True)
-
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, "w") as zipf:
-                        for name, path in named_imgs.items():
-                            zipf.write(path, arcname=os.path.basename(path))
-                    zip_buffer.seek(0)
-
-                    st.download_button("⬇️ 텍스처 ZIP 다운로드", zip_buffer, file_name="texture_images.zip", mime="application/zip")
-                else:
-                    st.warning("⚠️ front/back/left 이미지 중 일부 누락")
+    try:
+        image_filename = os.path.basename(st.session_state.image_path)
+        res = requests.post(
+            f"{MVADAPTER_SERVER}/jobs/generate_mv_adapter",
+            json={"reference_filename": image_filename, "user_prompt": prompt},
+            headers=trace_headers()
+        )
+        job = follow_job(MVADAPTER_SERVER, res.json()) if res.status_code == 202 else None
+
+        if job and job["status"] == "completed" and job["outputs"].get("status") == "completed":
+            st.success("✅ 텍스처 이미지 생성 완료!")
+            show_timings(job.get("timings"))
+            named_imgs = find_latest_named_images(OUTPUT_IMAGE_FOLDER, ["front", "back", "left"], job["job_id"])
+            if all(named_imgs.values()):
+                cols = st.columns(3)
+                for idx, (name, path) in enumerate(named_imgs.items()):
+                    with cols[idx]:
+                        st.image(path, caption=name, use_container_width=True)
+
+                zip_buffer = io.BytesIO()
+                with zipfile.ZipFile(zip_buffer, "w") as zipf:
+                    for name, path in named_imgs.items():
+                        zipf.write(path, arcname=os.path.basename(path))
+                zip_buffer.seek(0)
+
+                st.download_button("⬇️ 텍스처 ZIP 다운로드", zip_buffer, file_name="texture_images.zip", mime="application/zip")
             else:
-                st.error("❌ 텍스처 생성 실패")
-        except Exception as e:
-            st.error(f"예외 발생: {e}")
+                st.warning("⚠️ front/back/left 이미지 중 일부 누락")
+        else:
+            st.error("❌ 텍스처 생성 실패")
+    except Exception as e:
+        st.error(f"예외 발생: {e}")
 
 # Step 3. 업로드한 이미지로 Hy3D GLB 생성 요청
 st.header("3️⃣ 업로드 이미지로 GLB 생성")
@@ -114,6 +197,7 @@ st.header("3️⃣ 업로드 이미지로 GLB 생성")
 uploaded_front = st.file_uploader("📤 Front 이미지", type=["png"], key="front")
 uploaded_back = st.file_uploader("📤 Back 이미지", type=["png"], key="back")
 uploaded_left = st.file_uploader("📤 Left 이미지", type=["png"], key="left")
+compact_glb = st.checkbox("🗜️ GLB 경량화 (정점 양자화, 텍스처 재압축 - 용량은 줄지만 손실 압축)", value=False)
 
 if st.button("🧊 GLB 생성 요청"):
     if not (uploaded_front and uploaded_back and uploaded_left):
@@ -127,21 +211,43 @@ if st.button("🧊 GLB 생성 요청"):
                     "left": ("left.png", uploaded_left, "image/png")
                 }
 
-                res = requests.post(f"{HY3D_SERVER}/generate_hy3d", files=files)
-                if res.status_code == 200:
-                    # ▶️ GLB 파일명을 유니크하게 설정
-                    unique_filename = f"Hy3D_textured_{get_random_hex()}.glb"
-                    glb_path = os.path.join(FASTAPI_STATIC_DIR, unique_filename)
+                # progressive 작업으로 제출해 텍스처 전 메시를 먼저 받는다 (경량화는 선택한 경우만)
+                form = {"progressive": "true"}
+                if compact_glb:
+                    form["compact"] = "true"
+                res = requests.post(f"{HY3D_SERVER}/jobs/generate_hy3d", files=files, data=form, headers=trace_headers())
+                if res.status_code == 202:
+                    mesh_slot = st.empty()
+                    mesh_shown = []
+
+                    def show_mesh(status):
+                        mesh = status["partial"].get("mesh")
+                        if mesh and not mesh_shown:
+                            mesh_data = requests.get(f"{HY3D_SERVER}{mesh['url']}").content
+                            with mesh_slot.container():
+                                st.info("🧱 텍스처 전 메시가 먼저 준비되었습니다. 텍스처 작업 중...")
+                                st.download_button("⬇️ 메시(텍스처 전) 다운로드", mesh_data, file_name=mesh["filename"], mime="application/octet-stream")
+                            mesh_shown.append(mesh)
+
+                    job = follow_job(HY3D_SERVER, res.json(), on_status=show_mesh)
+
+                    if job["status"] == "completed":
+                        # ▶️ GLB 파일명을 유니크하게 설정
+                        unique_filename = f"Hy3D_textured_{get_random_hex()}.glb"
+                        glb_path = os.path.join(FASTAPI_STATIC_DIR, unique_filename)
 
-                    # ▶️ GLB 파일을 리눅스 서버 output/3D 경로에 저장
-                    with open(glb_path, "wb") as f:
-                        f.write(res.content)
+                        # ▶️ GLB 파일을 리눅스 서버 output/3D 경로에 저장
+                        with open(glb_path, "wb") as f:
+                            f.write(requests.get(f"{HY3D_SERVER}{job['outputs']['url']}").content)
 
-                    st.session_state.glb_path = glb_path
-                    st.success("✅ GLB 생성이 완료되었습니다!")
+                        st.session_state.glb_path = glb_path
+                        st.success("✅ GLB 생성이 완료되었습니다!")
+                        show_timings(job.get("timings"))
 
-                    with open(glb_path, "rb") as f:
-                        st.download_button("⬇️ GLB 다운로드", f, file_name=unique_filename, mime="application/octet-stream")
+                        with open(glb_path, "rb") as f:
+                            st.download_button("⬇️ GLB 다운로드", f, file_name=unique_filename, mime="application/octet-stream")
+                    else:
+                        st.error(f"❌ GLB 생성 실패 ({job.get('error') or job['status']})")
                 else:
                     st.error(f"❌ GLB 생성 실패 (status code: {res.status_code})")
             except Exception as e: